@@ -16,6 +16,36 @@ char pass[] = "your-password";  // your network password
 #define SERVER_PORT         (12345)
 #define BIT_RATE_MPS        (4)
 
+/* >> ENABLE THIS TO USE THE LENGTH-PREFIXED BINARY CONTROL PROTOCOL << */
+// The server detects the protocol from the first byte, so the legacy text
+// lines ("mac,ip,port" and "AliveHeartBeat") keep working when disabled.
+// #define USE_BINARY_CONTROL_PROTOCOL
+
+#define CTRL_MAGIC           (0xA5)
+#define CTRL_VERSION         (0x01)
+#define CTRL_MSG_DEVICE_INFO (0x01)
+#define CTRL_MSG_HEARTBEAT   (0x02)
+#define CTRL_MSG_COMMAND     (0x10)
+#define CTRL_MSG_ACK         (0x11)
+#define CTRL_HEADER_SIZE     (6)
+
+// Rate commands from the server (python/v1/camera_commands.py), answered with
+// an ACK carrying the value actually applied
+#define CTRL_PARAM_FPS        (0x01)
+#define CTRL_PARAM_BITRATE    (0x02)
+#define CTRL_PARAM_RESOLUTION (0x03)  // width << 16 | height
+
+#define CTRL_ACK_OK          (0)
+#define CTRL_ACK_CLAMPED     (1)
+#define CTRL_ACK_UNSUPPORTED (2)
+#define CTRL_ACK_INVALID     (3)
+#define CTRL_ACK_FAILED      (4)
+
+#define MIN_FPS     (1)
+#define MAX_FPS     (30)
+#define MIN_BITRATE (256 * 1024)
+#define MAX_BITRATE (8 * 1024 * 1024)
+
 /* >> DISABLE THIS WHEN YOU WANT DIRECTLY SHOW RTSP << */
 // #define START_STREAM_ONLY_AFTER_CONNECT_TO_SERVER
 
@@ -28,6 +58,12 @@ char pass[] = "your-password";  // your network password
 // // Custom FPS
 VideoSetting config(VIDEO_FHD, RTSP_FPS, VIDEO_HEVC, 0);
 
+// Current video settings, changed by the server's rate commands
+uint16_t videoWidth = 1920;
+uint16_t videoHeight = 1080;
+uint32_t videoFps = RTSP_FPS;
+uint32_t videoBitrate = BIT_RATE_MPS * 1024 * 1024;
+
 RTSP rtsp;
 WiFiClient client;
 MDNSManager mdnsManager(false, true);
@@ -44,6 +80,10 @@ const long interval = 10000;  // 10 seconds
 bool enable_camera_stream = false;
 #endif
 
+// Bytes of the command being received from the server
+uint8_t ctrlBuf[64];
+size_t ctrlLen = 0;
+
 bool getServerIpByMdns()
 {
   bool ret = false;
@@ -74,6 +114,262 @@ bool getServerIpByMdns()
   return ret;
 }
 
+/**
+ * @brief Sends one binary control frame (see python/v1/protocol.py):
+ * magic, version, type, flags, payload length (u16, big endian), payload
+ */
+void sendControlFrame(WiFiClient& client, uint8_t msgType,
+                      const uint8_t* payload, uint16_t len)
+{
+  uint8_t header[6] = {CTRL_MAGIC, CTRL_VERSION, msgType, 0,
+                       (uint8_t)(len >> 8), (uint8_t)(len & 0xFF)};
+  client.write(header, sizeof(header));
+  if (len > 0)
+  {
+    client.write(payload, len);
+  }
+}
+
+void sendHeartbeat(WiFiClient& client)
+{
+#ifdef USE_BINARY_CONTROL_PROTOCOL
+  sendControlFrame(client, CTRL_MSG_HEARTBEAT, NULL, 0);
+#else
+  client.println("AliveHeartBeat");
+#endif
+}
+
+const char* paramName(uint8_t param)
+{
+  switch (param)
+  {
+    case CTRL_PARAM_FPS:
+      return "fps";
+    case CTRL_PARAM_BITRATE:
+      return "bitrate";
+    case CTRL_PARAM_RESOLUTION:
+      return "resolution";
+    default:
+      return "unknown";
+  }
+}
+
+/**
+ * @brief Answers a command, "ACK,<id>,<param>,<status>,<value>" in the text
+ * protocol, e.g. "ACK,7,fps,clamped,30"
+ */
+void sendAck(WiFiClient& client, uint16_t id, uint8_t param, uint8_t status,
+             uint32_t value)
+{
+#ifdef USE_BINARY_CONTROL_PROTOCOL
+  // payload: command id (u16) + param (u8) + status (u8) + value (u32)
+  uint8_t payload[8] = {(uint8_t)(id >> 8),     (uint8_t)(id & 0xFF),
+                        param,                  status,
+                        (uint8_t)(value >> 24), (uint8_t)(value >> 16),
+                        (uint8_t)(value >> 8),  (uint8_t)(value & 0xFF)};
+  sendControlFrame(client, CTRL_MSG_ACK, payload, sizeof(payload));
+#else
+  static const char* statusNames[] = {"ok", "clamped", "unsupported",
+                                      "invalid", "failed"};
+  String line = "ACK," + String(id) + "," + paramName(param) + "," +
+                statusNames[status] + ",";
+  if (param == CTRL_PARAM_RESOLUTION)
+  {
+    line += String(value >> 16) + "x" + String(value & 0xFFFF);
+  }
+  else
+  {
+    line += String(value);
+  }
+  client.println(line);
+#endif
+}
+
+/**
+ * @brief Restarts the video channel, RTSP and StreamIO with new settings,
+ * the RTSP clients reconnect
+ */
+void applyVideoSettings(uint16_t width, uint16_t height, uint32_t fps,
+                        uint32_t bitrate)
+{
+  videoStreamer.pause();
+  Camera.channelEnd(CHANNEL);
+  rtsp.end();
+
+  config = VideoSetting(width, height, fps, VIDEO_HEVC, 0);
+  config.setBitrate(bitrate);
+  Camera.configVideoChannel(CHANNEL, config);
+  rtsp.configVideo(config);
+  rtsp.begin();
+
+  videoStreamer.resume();
+#ifdef START_STREAM_ONLY_AFTER_CONNECT_TO_SERVER
+  if (enable_camera_stream)
+  {
+    Camera.channelBegin(CHANNEL);
+  }
+#else
+  Camera.channelBegin(CHANNEL);
+#endif
+
+  videoWidth = width;
+  videoHeight = height;
+  videoFps = fps;
+  videoBitrate = bitrate;
+}
+
+bool isSupportedResolution(uint16_t width, uint16_t height)
+{
+  return (width == 1920 && height == 1080) || (width == 1280 && height == 720) ||
+         (width == 640 && height == 480);
+}
+
+/**
+ * @brief Applies one rate command, values out of range are clamped
+ */
+void handleCommand(WiFiClient& client, uint16_t id, uint8_t param,
+                   uint32_t value)
+{
+  uint16_t width = videoWidth;
+  uint16_t height = videoHeight;
+  uint32_t fps = videoFps;
+  uint32_t bitrate = videoBitrate;
+  uint32_t applied = value;
+  uint8_t status = CTRL_ACK_OK;
+
+  switch (param)
+  {
+    case CTRL_PARAM_FPS:
+      fps = applied = constrain(value, (uint32_t)MIN_FPS, (uint32_t)MAX_FPS);
+      break;
+    case CTRL_PARAM_BITRATE:
+      bitrate = applied =
+          constrain(value, (uint32_t)MIN_BITRATE, (uint32_t)MAX_BITRATE);
+      break;
+    case CTRL_PARAM_RESOLUTION:
+      width = value >> 16;
+      height = value & 0xFFFF;
+      if (!isSupportedResolution(width, height))
+      {
+        sendAck(client, id, param, CTRL_ACK_INVALID,
+                ((uint32_t)videoWidth << 16) | videoHeight);
+        return;
+      }
+      break;
+    default:
+      sendAck(client, id, param, CTRL_ACK_UNSUPPORTED, 0);
+      return;
+  }
+  if (applied != value)
+  {
+    status = CTRL_ACK_CLAMPED;
+  }
+
+  // an unchanged value (e.g. repeated after a reconnect) keeps the stream
+  if (width != videoWidth || height != videoHeight || fps != videoFps ||
+      bitrate != videoBitrate)
+  {
+    Serial.print("Command ");
+    Serial.print(paramName(param));
+    Serial.print(" = ");
+    Serial.println(applied);
+    applyVideoSettings(width, height, fps, bitrate);
+  }
+  sendAck(client, id, param, status, applied);
+}
+
+/**
+ * @brief Reads the commands the server sent: binary frames, or text lines
+ * "SET,<id>,<param>,<value>" (e.g. "SET,7,fps,15", "SET,8,resolution,1280x720")
+ */
+void readServerCommands(WiFiClient& client)
+{
+  while (client.available() > 0)
+  {
+    int c = client.read();
+    if (c < 0)
+    {
+      break;
+    }
+#ifdef USE_BINARY_CONTROL_PROTOCOL
+    if (ctrlLen == 0 && c != CTRL_MAGIC)
+    {
+      continue;  // resynchronize on the next frame
+    }
+    ctrlBuf[ctrlLen++] = (uint8_t)c;
+    if (ctrlLen < CTRL_HEADER_SIZE)
+    {
+      continue;
+    }
+    size_t payloadLen = ((size_t)ctrlBuf[4] << 8) | ctrlBuf[5];
+    if (CTRL_HEADER_SIZE + payloadLen > sizeof(ctrlBuf))
+    {
+      ctrlLen = 0;
+      continue;
+    }
+    if (ctrlLen < CTRL_HEADER_SIZE + payloadLen)
+    {
+      continue;
+    }
+    const uint8_t* p = ctrlBuf + CTRL_HEADER_SIZE;
+    if (ctrlBuf[2] == CTRL_MSG_COMMAND && payloadLen == 7)
+    {
+      handleCommand(client, ((uint16_t)p[0] << 8) | p[1], p[2],
+                    ((uint32_t)p[3] << 24) | ((uint32_t)p[4] << 16) |
+                        ((uint32_t)p[5] << 8) | p[6]);
+    }
+    ctrlLen = 0;
+#else
+    if (c == '\r')
+    {
+      continue;
+    }
+    if (c != '\n')
+    {
+      if (ctrlLen < sizeof(ctrlBuf) - 1)
+      {
+        ctrlBuf[ctrlLen++] = (uint8_t)c;
+      }
+      continue;
+    }
+    ctrlBuf[ctrlLen] = '\0';
+    ctrlLen = 0;
+
+    unsigned int id;
+    char name[16];
+    char valueStr[24];
+    if (sscanf((const char*)ctrlBuf, "SET,%u,%15[^,],%23s", &id, name,
+               valueStr) != 3)
+    {
+      continue;
+    }
+    if (strcmp(name, "fps") == 0)
+    {
+      handleCommand(client, id, CTRL_PARAM_FPS, strtoul(valueStr, NULL, 10));
+    }
+    else if (strcmp(name, "bitrate") == 0)
+    {
+      handleCommand(client, id, CTRL_PARAM_BITRATE,
+                    strtoul(valueStr, NULL, 10));
+    }
+    else if (strcmp(name, "resolution") == 0)
+    {
+      unsigned int width, height;
+      if (sscanf(valueStr, "%ux%u", &width, &height) == 2)
+      {
+        handleCommand(client, id, CTRL_PARAM_RESOLUTION,
+                      ((uint32_t)width << 16) | (height & 0xFFFF));
+      }
+      else
+      {
+        sendAck(client, id, CTRL_PARAM_RESOLUTION, CTRL_ACK_INVALID,
+                ((uint32_t)videoWidth << 16) | videoHeight);
+      }
+    }
+#endif
+  }
+}
+
 void sendDeviceInfo(WiFiClient& client, const char* serverIP,
                     uint16_t serverPort, uint16_t rtspPort)
 {
@@ -85,6 +381,7 @@ void sendDeviceInfo(WiFiClient& client, const char* serverIP,
      */
 
     Serial.println("Connected to server");
+    ctrlLen = 0;  // drop a partial command of the previous connection
 
     // Get MAC address
     uint8_t mac[6];
@@ -100,12 +397,25 @@ void sendDeviceInfo(WiFiClient& client, const char* serverIP,
     char ipStr[16];  // Max length of an IP address in the form xxx.xxx.xxx.xxx
     sprintf(ipStr, "%d.%d.%d.%d", ip[0], ip[1], ip[2], ip[3]);
 
+#ifdef USE_BINARY_CONTROL_PROTOCOL
+    // payload: mac (6 bytes) + ipv4 (4 bytes) + rtsp port (u16, big endian)
+    uint8_t payload[12];
+    memcpy(payload, mac, 6);
+    for (int i = 0; i < 4; i++)
+    {
+      payload[6 + i] = ip[i];
+    }
+    payload[10] = (uint8_t)(rtspPort >> 8);
+    payload[11] = (uint8_t)(rtspPort & 0xFF);
+    sendControlFrame(client, CTRL_MSG_DEVICE_INFO, payload, sizeof(payload));
+#else
     // Create dataToSend string
     String dataToSend =
         String(macStr) + "," + String(ipStr) + "," + String(rtspPort);
 
     // Send data to server
     client.println(dataToSend);
+#endif
 
 /* enable camera */
 #ifdef START_STREAM_ONLY_AFTER_CONNECT_TO_SERVER
@@ -157,8 +467,7 @@ void setup()
 
   // Configure camera video channel with video format information
   // Adjust the bitrate based on your WiFi network quality
-  config.setBitrate(BIT_RATE_MPS * 1024 *
-                    1024);  // Recommend to use 2Mbps for RTSP
+  config.setBitrate(videoBitrate);  // Recommend to use 2Mbps for RTSP
   // config.setJpegQuality(25);
   // streaming to prevent network congestion
   Camera.configVideoChannel(CHANNEL, config);
@@ -213,13 +522,18 @@ void loop()
     previousMillis = currentMillis;
     if (client.connected())
     {
-      client.println("AliveHeartBeat");
+      sendHeartbeat(client);
     }
     else
     {
       Serial.println("Cannot send heartbeat, not connected to server");
     }
   }
+
+  if (client.connected())
+  {
+    readServerCommands(client);
+  }
 }
 
 void printInfo(void)
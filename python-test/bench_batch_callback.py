@@ -0,0 +1,114 @@
+import argparse
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python', 'v1'))
+
+import numpy as np
+from batch_callback import FrameBatcher
+from frame_ring import FrameRing
+
+'''
+batch_callback.py: 每張 frame 呼叫一次 consumer 與整批呼叫的比較
+
+--cameras 個 thread 以 --fps 將 frame 寫入各自的 FrameRing (代替 RTSP 子進程)，FrameBatcher 在
+batch_size = 1 (等同每張 frame 一次 callback) 與 --batch-size 時各執行 --seconds 秒。consumer 對整批做一次
+向量化計算 (每張 frame 縮小後的平均亮度)，代表分析模型。印出 consumer 呼叫次數、每張 frame 的 CPU 時間，
+以及執行期間 Python 配置的記憶體 (tracemalloc) 峰值增加量。
+
+Example:
+    python python-test/bench_batch_callback.py --cameras 12 --fps 15 --batch-size 12
+'''
+
+
+class Cameras:
+    """Stands in for CameraManager: rings written by one thread per camera."""
+
+    def __init__(self, count, fps, shape):
+        self.rings = {f'10.3.0.{i + 1}': FrameRing.create(slots=4, max_shape=shape) for i in range(count)}
+        self.fps = fps
+        self.frame = np.random.default_rng(0).integers(0, 255, size=shape, dtype=np.uint8)
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.seq = 0
+
+    def get_frame_rings(self):
+        return dict(self.rings)
+
+    def _write(self, ring):
+        seq = ring.latest_seq
+        while not self.stop_event.wait(1.0 / self.fps):
+            seq += 1
+            ring.write(self.frame, seq)
+
+    def start(self):
+        self.stop_event.clear()
+        self.threads = [threading.Thread(target=self._write, args=(ring,), daemon=True)
+                        for ring in self.rings.values()]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+
+
+def brightness(frames, meta, cameras):
+    return frames[:, ::8, ::8].mean(axis=(1, 2, 3))
+
+
+def run(cameras, batch_size, args):
+    batcher = FrameBatcher(cameras, brightness, batch_size=batch_size, timeout=args.timeout_ms / 1000,
+                           shape=(args.height, args.width, 3))
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    cameras.start()
+    cpu_start = time.process_time()
+    batcher.start()
+    time.sleep(args.seconds)
+    cameras.stop()
+    batcher.stop()
+    cpu = time.process_time() - cpu_start
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return batcher.stats(), cpu, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-frame callbacks versus batched callbacks")
+    parser.add_argument('--cameras', type=int, default=12)
+    parser.add_argument('--fps', type=float, default=15.0)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=360)
+    parser.add_argument('--batch-size', type=int, default=12)
+    parser.add_argument('--timeout-ms', type=float, default=50.0)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args()
+
+    cameras = Cameras(args.cameras, args.fps, (args.height, args.width, 3))
+    results = {}
+    try:
+        for batch_size in (1, args.batch_size):
+            results[batch_size] = run(cameras, batch_size, args)
+    finally:
+        cameras.close()
+
+    print(f"\n=== {args.cameras} cameras @ {args.fps:.0f} fps, {args.width}x{args.height}, {args.seconds:.0f} s ===")
+    print(f"{'Batch':>6} {'Calls':>8} {'Frames':>8} {'Avg batch':>10} {'Dropped':>8} {'CPU ms/frame':>13}"
+          f" {'Peak alloc KB':>14}")
+    print("-" * 74)
+    for batch_size, (stats, cpu, peak) in results.items():
+        print(f"{batch_size:>6} {stats['batches']:>8} {stats['frames']:>8} {stats['avg_batch']:>10.1f}"
+              f" {stats['dropped']:>8} {cpu / max(1, stats['frames']) * 1000:>13.3f} {peak / 1024:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python', 'v1'))
+
+from frame_index import FrameIndex, FrameIndexWriter
+
+'''
+frame_index.py 的寫入速度與查詢延遲
+
+以 FrameIndexWriter 寫入 --rows 筆合成的 frame 記錄 (--cameras 台 camera，每台每秒 --fps 張，每小時重新連線一次)，
+印出每秒寫入筆數與資料庫大小，再對隨機的 camera 與時間查詢 --window-ms 長的範圍，印出查詢延遲。
+
+Example:
+    python python-test/bench_frame_index.py --rows 10000000 --cameras 16
+    python python-test/bench_frame_index.py --db frames.db --queries 0
+'''
+
+
+def fill(path, rows, cameras, fps, start_ms):
+    writer = FrameIndexWriter(path, batch_size=1000, queue_size=100000)
+    writer.start()
+    interval = 1.0 / fps
+    start = time.perf_counter()
+    for i in range(rows):
+        camera = i % cameras
+        n = i // cameras
+        timestamp = start_ms / 1000 + n * interval
+        session = start_ms + int(n * interval // 3600) * 3600000
+        while not writer.add(f'00:00:00:00:00:{camera:02x}', f'10.0.0.{camera + 1}', session, n + 1, timestamp,
+                             f'archive/10.0.0.{camera + 1}/000000000001.frames', n * 100000, 100000, n + 1):
+            writer.dropped -= 1  # the benchmark waits for the writer instead of dropping
+            time.sleep(0.001)
+    writer.stop()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Insert rate and query latency of the frame index")
+    parser.add_argument('--db', help="index database to use, a temporary one when omitted")
+    parser.add_argument('--rows', type=int, default=1_000_000, help="frames to insert, 0 only queries --db")
+    parser.add_argument('--cameras', type=int, default=16)
+    parser.add_argument('--fps', type=float, default=2.0, help="saved frames per camera per second")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--window-ms', type=int, default=60_000, help="time range of each query")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.db or os.path.join(directory, 'frames.db')
+        start_ms = int(time.time() * 1000)
+        if args.rows:
+            elapsed = fill(path, args.rows, args.cameras, args.fps, start_ms)
+            print(f"\n=== Insert {args.rows} frames ({args.cameras} cameras) ===")
+            print(f"{'Seconds':>8} {'Frames/s':>10} {'DB MB':>8}")
+            print(f"{elapsed:>8.1f} {args.rows / elapsed:>10.0f} {os.path.getsize(path) / 1e6:>8.1f}")
+
+        with FrameIndex(path) as index:
+            cameras = [ip for _, ip in index.cameras()]
+            if not cameras or not args.queries:
+                return
+            first, last = index.conn.execute('SELECT MIN(timestamp_ms), MAX(timestamp_ms) FROM frames').fetchone()
+            latencies = []
+            found = 0
+            for _ in range(args.queries):
+                begin = random.randint(first, max(first, last - args.window_ms))
+                start = time.perf_counter()
+                found += len(index.query(random.choice(cameras), begin, begin + args.window_ms))
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            print(f"\n=== {args.queries} queries of {args.window_ms} ms, {index.count()} frames indexed ===")
+            print(f"{'Frames/query':>12} {'p50 ms':>8} {'p99 ms':>8} {'Max ms':>8}")
+            print(f"{found / args.queries:>12.1f} {latencies[len(latencies) // 2] * 1000:>8.2f}"
+                  f" {latencies[int(len(latencies) * 0.99)] * 1000:>8.2f} {latencies[-1] * 1000:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
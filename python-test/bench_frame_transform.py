@@ -0,0 +1,88 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python', 'v1'))
+
+import cv2
+import numpy as np
+from frame_ring import FrameRing
+from frame_transform import FrameTransform
+
+'''
+frame_transform.py: 在 RTSP 子進程轉換 frame 的成本與之後省下的資料量與 CPU
+
+以合成的 --width x --height BGR frame 比較不轉換與幾組常見的 FrameTransform，印出每張 frame 的轉換時間、
+輸出 bytes、寫入 FrameRing 的時間 (IPC 的複製)，以及 JPEG encode 的時間與大小 (存圖)。
+
+Example:
+    python python-test/bench_frame_transform.py --frames 100 --width 1920 --height 1080
+'''
+
+TRANSFORMS = {
+    'none': {},
+    '640 gray': {'resize_width': 640, 'color': 'gray'},
+    '640 gray linear': {'resize_width': 640, 'color': 'gray', 'interpolation': 'linear'},
+    'decimate 3 gray': {'decimate': 3, 'color': 'gray'},
+    '640 i420': {'resize_width': 640, 'color': 'i420'},
+    'crop half, 640': {'crop': (0, 0, 960, 540), 'resize_width': 640},
+}
+
+
+def make_frame(width, height):
+    yy, xx = np.mgrid[0:height, 0:width]
+    scene = ((xx * 255 // width + yy * 127 // height) % 256).astype(np.uint8)
+    frame = cv2.merge([scene, np.flipud(scene), np.fliplr(scene)])
+    noise = np.random.default_rng(0).integers(-6, 7, size=frame.shape, dtype=np.int16)
+    return np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def run(options, frame, ring, frames):
+    transform = FrameTransform.from_options(options)
+    transform_time = ring_time = encode_time = 0.0
+    size = 0
+    out = frame
+    for i in range(frames):
+        start = time.perf_counter()
+        if transform is not None:
+            out = transform.apply(frame, i % 3)
+        transform_time += time.perf_counter() - start
+        start = time.perf_counter()
+        ring.write(out, i + 1)
+        ring_time += time.perf_counter() - start
+        start = time.perf_counter()
+        _, jpeg = cv2.imencode('.jpg', out, [int(cv2.IMWRITE_JPEG_QUALITY), 95])
+        encode_time += time.perf_counter() - start
+        size += len(jpeg)
+    return out.shape, out.nbytes, transform_time / frames, ring_time / frames, encode_time / frames, size / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cost and savings of in-worker frame transforms")
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    args = parser.parse_args()
+
+    frame = make_frame(args.width, args.height)
+    ring = FrameRing.create(slots=4, max_shape=frame.shape)
+    try:
+        results = {name: run(options, frame, ring, args.frames) for name, options in TRANSFORMS.items()}
+    finally:
+        ring.close()
+
+    print(f"\n=== Frame transforms, {args.width}x{args.height} BGR, {args.frames} frames ===")
+    print(f"{'Transform':<18} {'Shape':<15} {'Bytes':>9} {'x less':>7} {'Transform ms':>13} {'Ring ms':>8}"
+          f" {'JPEG ms':>8} {'JPEG KB':>8}")
+    print("-" * 92)
+    base = results['none'][1]
+    for name, (shape, nbytes, transform_time, ring_time, encode_time, size) in results.items():
+        print(f"{name:<18} {'x'.join(map(str, shape)):<15} {nbytes:>9} {base / nbytes:>7.1f}"
+              f" {transform_time * 1000:>13.2f} {ring_time * 1000:>8.2f} {encode_time * 1000:>8.2f}"
+              f" {size / 1024:>8.0f}")
+    print("==========================")
+
+
+if __name__ == "__main__":
+    main()
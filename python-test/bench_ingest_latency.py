@@ -0,0 +1,105 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python', 'v1'))
+
+from ingest_profile import INGEST_PRESETS, get_ingest_profile
+
+'''
+量測每個 ingest preset 的延遲
+
+對同一個 RTSP url (例如 rtsp://192.168.1.10:554) 以每個 preset 依序開啟，量測:
+- open: VideoCapture 開啟所需時間
+- first frame: 開啟後拿到第一張 frame 的時間
+- fps: 穩定讀取時的 FPS
+- buffered lag: 停止讀取 --stall 秒後，立即 (少於半個 frame 間隔) 就能讀到的 frame 數 x frame 間隔。
+  這些 frame 是 FFmpeg/OpenCV 內部 buffer 住的，代表 reader 看到的畫面比實際晚了多少，
+  也就是 glass-to-glass 延遲中 server 端 buffer 造成的部分
+- pts drift: 牆上時間與 stream timestamp 的差距，持續增加代表 buffer 在累積
+
+Example:
+    python python-test/bench_ingest_latency.py rtsp://192.168.1.10:554 --duration 10
+'''
+
+
+def measure(url, profile_name, duration, stall, nominal_fps):
+    profile = get_ingest_profile(profile_name)
+    result = {'profile': profile_name}
+
+    start = time.perf_counter()
+    cap = profile.open(url)
+    result['open_ms'] = (time.perf_counter() - start) * 1000
+    if not cap.isOpened():
+        result['error'] = 'open failed'
+        return result
+
+    ret, _ = cap.read()
+    result['first_frame_ms'] = (time.perf_counter() - start) * 1000
+    if not ret:
+        cap.release()
+        result['error'] = 'no frame'
+        return result
+
+    # steady state: fps and pts drift against the wall clock
+    frames = 0
+    first_wall = time.perf_counter()
+    first_pts = cap.get(0)  # cv2.CAP_PROP_POS_MSEC
+    drift = 0.0
+    while time.perf_counter() - first_wall < duration:
+        ret, _ = cap.read()
+        if not ret:
+            break
+        frames += 1
+        pts = cap.get(0)
+        drift = (time.perf_counter() - first_wall) * 1000 - (pts - first_pts)
+    elapsed = time.perf_counter() - first_wall
+    result['fps'] = frames / elapsed if elapsed > 0 else 0.0
+    result['pts_drift_ms'] = drift
+
+    # buffered lag: frames returned immediately after a stall were sitting in a buffer
+    fps = result['fps'] or nominal_fps
+    interval = 1.0 / fps
+    time.sleep(stall)
+    buffered = 0
+    while buffered < fps * (stall + 5):
+        t0 = time.perf_counter()
+        ret, _ = cap.read()
+        if not ret or time.perf_counter() - t0 >= interval / 2:
+            break
+        buffered += 1
+    # frames produced during the stall are expected; anything beyond the stall is extra lag
+    result['buffered_frames'] = buffered
+    result['buffered_lag_ms'] = max(0.0, buffered * interval - stall) * 1000
+    cap.release()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RTSP ingest preset latency measurement")
+    parser.add_argument('url', help="RTSP url, e.g. rtsp://192.168.1.10:554")
+    parser.add_argument('--profiles', nargs='+', default=list(INGEST_PRESETS),
+                        choices=list(INGEST_PRESETS))
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help="seconds of steady-state reading per profile")
+    parser.add_argument('--stall', type=float, default=1.0,
+                        help="seconds without reading before the buffered-lag probe")
+    parser.add_argument('--fps', type=float, default=30.0,
+                        help="nominal stream FPS (RTSP_FPS in RTSP.ino)")
+    args = parser.parse_args()
+
+    print(f"{'Profile':<16} {'Open ms':>9} {'1st frame ms':>13} {'FPS':>7} {'Drift ms':>9} "
+          f"{'Buffered':>9} {'Lag ms':>8}")
+    print("-" * 80)
+    for name in args.profiles:
+        r = measure(args.url, name, args.duration, args.stall, args.fps)
+        if 'error' in r:
+            print(f"{name:<16} {r['open_ms']:>9.0f} {r['error']}")
+            continue
+        print(f"{name:<16} {r['open_ms']:>9.0f} {r['first_frame_ms']:>13.0f} {r['fps']:>7.1f} "
+              f"{r['pts_drift_ms']:>9.0f} {r['buffered_frames']:>9} {r['buffered_lag_ms']:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python', 'v1'))
+
+import numpy as np
+from camera_client_handler import register_camera
+from camera_manager import CameraManager
+from encoder_pool import EncoderPool, SaveRequestDispatcher
+from frame_source import SyntheticSource, VideoFileSource, read_stamp
+from main import FrameCallback
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+'''
+多台 camera 的 end-to-end throughput benchmark
+
+以 N 台合成 camera 走完整的路徑: register_camera -> RTSP 子進程 (RTSPClient / FreshestFrame)
+-> FrameRing -> main.FrameCallback -> SaveRequestDispatcher -> 中央 EncoderPool -> 寫入 JPEG，
+依序測試每個 camera 數量，找出這台機器實際能撐住幾台 camera，而不是相信 MAX_CAMERA_NUM = 12。
+
+合成 camera 使用 frame_source.SyntheticSource 取代 RTSP stream (--video 則循環播放一個影片檔或目錄):
+- 以指定的 FPS 產生 frame；consumer 跟不上時 frame 會累積 (如同 socket / FFmpeg buffer)，延遲因此上升
+- 預設每張 frame 都以 cv2.imdecode 解一張預先編好的 JPEG，模擬 H.264 decode 的 CPU 成本 (--source raw 則不 decode)
+- 每張 frame 的左上角 16 個 pixel 寫入產生時間與序號，callback 以 read_stamp() 讀回來計算 end-to-end 延遲與掉 frame 數
+
+報告 (每個 camera 數量一列):
+- FPS/cam: 每台 camera callback 收到的平均 FPS，Drop%: 產生了但 callback 沒看到的 frame 比例
+- Lat p50/p95: 產生 -> callback 的延遲
+- Save FPS / Missed: 中央 encoder 寫入的 JPEG 數量，以及在 ring 中被覆寫而來不及儲存的 frame
+- CPU% / RSS: RTSP 子進程平均 (需要 psutil) 與主進程
+
+Example:
+    python python-test/bench_multi_camera.py --cameras 1 2 4 8 12 --width 1920 --height 1080 --fps 30
+'''
+
+
+class BenchCallback(FrameCallback):
+    """The real FrameCallback, plus per-second latency and drop reports sent to the benchmark."""
+
+    def __init__(self, stats_queue, **kwargs):
+        super().__init__(**kwargs)
+        self.stats_queue = stats_queue
+        self.pending = {}
+
+    def __call__(self, frame, other_info):
+        now = time.time()
+        produced, number = read_stamp(frame)
+        ip = other_info['ip']
+        step = other_info.get('decode_every', 1)  # sampled decoding skips step - 1 frames on purpose
+        p = self.pending.get(ip)
+        if p is None:
+            p = self.pending[ip] = {'frames': 0, 'last': number - step, 'lost': 0,
+                                    'latency': [], 'since': now}
+        p['frames'] += 1
+        p['lost'] += max(0, number - p['last'] - step)
+        p['last'] = number
+        p['latency'].append(now - produced)
+        super().__call__(frame, other_info)
+        if now - p['since'] >= 1.0:
+            self.stats_queue.put((ip, now, p['frames'], p['lost'], p['latency']))
+            p.update(frames=0, lost=0, latency=[], since=now)
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if values else 0.0
+
+
+def run_once(count, args, stats_queue):
+    """Runs `count` synthetic cameras and returns one result row."""
+    camera_manager = CameraManager(client_threads={})
+    encoder_pool = EncoderPool(num_workers=args.encoder_workers, queue_size=args.queue_size)
+    encoder_pool.start()
+    save_queue = multiprocessing.Queue()
+    dispatcher = SaveRequestDispatcher(save_queue, encoder_pool, camera_manager)
+    dispatcher.start()
+
+    callback = BenchCallback(stats_queue, n=args.save_every, save_queue=save_queue)
+    if args.video:
+        source = VideoFileSource(args.video, loop=True, stamp=True)
+    else:
+        source = SyntheticSource(args.width, args.height, args.fps, decode=args.source == 'jpeg')
+    rtsp_options = {'frame_source': source}
+    if args.decode_mode == 'sampled':
+        rtsp_options.update(decode_mode='sampled', sample_every=args.save_every)
+    for i in range(count):
+        cam_ip = f'10.0.{i // 250}.{i % 250 + 1}'
+        register_camera(camera_manager, cam_ip, f'00:00:00:00:{i // 256:02X}:{i % 256:02X}', cam_ip,
+                        '554', callback, show_stream=False, rtsp_options=rtsp_options)
+
+    processes = []
+    if psutil:
+        processes = [psutil.Process(info['process'].pid)
+                     for info in camera_manager.connected_cameras.values()]
+        main_process = psutil.Process()
+
+    frames = lost = 0
+    latency = []
+    measure_start = time.time() + args.warmup
+    measure_end = measure_start + args.duration
+    saved_start = None
+    cpu_started = False
+    while time.time() < measure_end:
+        now = time.time()
+        if now >= measure_start and not cpu_started:
+            cpu_started = True
+            saved_start = encoder_pool.stats()['total']['frames']
+            for p in processes + ([main_process] if psutil else []):
+                p.cpu_percent(None)
+        try:
+            ip, when, n, n_lost, samples = stats_queue.get(timeout=0.2)
+        except queue.Empty:
+            continue
+        if measure_start <= when <= measure_end:
+            frames += n
+            lost += n_lost
+            latency.extend(samples)
+
+    saved = encoder_pool.stats()['total']['frames'] - (saved_start or 0)
+    row = {
+        'cameras': count,
+        'fps': frames / args.duration / count,
+        'drop': lost / (frames + lost) * 100 if frames + lost else 0.0,
+        'lat_p50': _percentile(latency, 50),
+        'lat_p95': _percentile(latency, 95),
+        'save_fps': saved / args.duration,
+    }
+    if psutil:
+        cpu, rss = [], []
+        for p in processes:
+            try:
+                cpu.append(p.cpu_percent(None))
+                rss.append(p.memory_info().rss)
+            except psutil.Error:
+                pass
+        row['child_cpu'] = sum(cpu) / len(cpu) if cpu else 0.0
+        row['child_rss'] = sum(rss) / len(rss) / 1e6 if rss else 0.0
+        row['main_cpu'] = main_process.cpu_percent(None)
+        row['main_rss'] = main_process.memory_info().rss / 1e6
+
+    for info in list(camera_manager.connected_cameras.values()):
+        camera_manager.release_camera(info)
+    camera_manager.connected_cameras.clear()
+    dispatcher.stop()
+    encoder_pool.stop()
+    row['missed'] = dispatcher.missed
+    while True:  # reports of the stopped cameras
+        try:
+            stats_queue.get_nowait()
+        except queue.Empty:
+            break
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic multi-camera end-to-end benchmark")
+    parser.add_argument('--cameras', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help="camera counts to run, one row each")
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--source', choices=('jpeg', 'raw'), default='jpeg',
+                        help="jpeg decodes a JPEG per frame to emulate decoding cost, raw only copies")
+    parser.add_argument('--video', default=None,
+                        help="loop this video file (or directory of segments) instead of the synthetic pattern")
+    parser.add_argument('--decode-mode', choices=('full', 'sampled'), default='full')
+    parser.add_argument('--save-every', type=int, default=15, help="SAVE_EVERY_N_FRAME")
+    parser.add_argument('--encoder-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--queue-size', type=int, default=8, help="SAVE_QUEUE_SIZE")
+    parser.add_argument('--duration', type=float, default=10.0, help="measured seconds per row")
+    parser.add_argument('--warmup', type=float, default=3.0, help="seconds ignored after start")
+    parser.add_argument('--out', default=None, help="directory the JPEGs are saved to, temporary if omitted")
+    args = parser.parse_args()
+
+    out_dir = args.out or tempfile.mkdtemp(prefix='bench_multi_camera_')
+    os.makedirs(out_dir, exist_ok=True)
+    os.chdir(out_dir)  # FrameCallback saves to ./img/<ip>
+    if psutil is None:
+        print("psutil is not installed, CPU and RSS columns are skipped")
+
+    stats_queue = multiprocessing.Queue()
+    rows = []
+    try:
+        for count in args.cameras:
+            print(f"--- {count} camera(s), {args.width}x{args.height} @ {args.fps} FPS ---")
+            rows.append(run_once(count, args, stats_queue))
+    finally:
+        if args.out is None:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    print(f"\n=== Multi-camera benchmark ({args.width}x{args.height} @ {args.fps} FPS, "
+          f"source {args.source}, decode {args.decode_mode}, save every {args.save_every}) ===")
+    header = (f"{'Cams':>5} {'FPS/cam':>8} {'Drop%':>6} {'Lat p50':>8} {'Lat p95':>8} "
+              f"{'Save FPS':>9} {'Missed':>7}")
+    if psutil:
+        header += f" {'CPU%/cam':>9} {'RSS/cam MB':>11} {'Main CPU%':>10} {'Main MB':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        line = (f"{r['cameras']:>5} {r['fps']:>8.1f} {r['drop']:>6.1f} {r['lat_p50']:>8.1f} "
+                f"{r['lat_p95']:>8.1f} {r['save_fps']:>9.1f} {r['missed']:>7}")
+        if psutil:
+            line += (f" {r['child_cpu']:>9.0f} {r['child_rss']:>11.0f} {r['main_cpu']:>10.0f} "
+                     f"{r['main_rss']:>8.0f}")
+        print(line)
+    print("Latency is milliseconds from frame production to FrameCallback.")
+
+
+if __name__ == "__main__":
+    main()
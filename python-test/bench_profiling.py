@@ -0,0 +1,98 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python', 'v1'))
+
+import profiling
+from encoder_pool import EncoderPool
+from frame_source import SyntheticSource
+from rtsp_client import RTSPClient, RTSPClientOptions
+
+'''
+profiling.py 的開銷與 stage 延遲表
+
+1. 每次 start() / stop() 的開銷: 關閉 (NullProfiler)、每次都量測、每 n 次量測 1 次
+2. 以合成 camera 在本進程執行 RTSPClient，frame callback 每 n 張交給 EncoderPool 存成 JPEG，
+   比較 profiling 關閉與開啟時每張 frame 的 CPU 時間，最後印出各 stage 的延遲表
+
+Example:
+    python python-test/bench_profiling.py --seconds 10 --sample-every 4
+'''
+
+
+def call_overhead(stage, calls):
+    """Nanoseconds per start() / stop() pair around an empty block."""
+    start = time.perf_counter()
+    for _ in range(calls):
+        timed = stage.start()
+        stage.stop(timed)
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+class SavingCallback:
+    """Saves one frame in n through an EncoderPool, like FrameCallback without the ring."""
+
+    def __init__(self, encoder_pool, directory, n):
+        self.encoder_pool = encoder_pool
+        self.directory = directory
+        self.n = n
+        self.count = 0
+
+    def __call__(self, frame, other_info):
+        self.count += 1
+        if self.count % self.n == 0:
+            path = os.path.join(self.directory, other_info['ip'], f"{other_info['seq']}.jpg")
+            self.encoder_pool.submit(frame.copy(), path, other_info['ip'])
+
+
+def run_pipeline(args, sample_every, directory):
+    profiling.enable_profiling(sample_every)
+    encoder_pool = EncoderPool(num_workers=1)
+    encoder_pool.start()
+    callback = SavingCallback(encoder_pool, directory, args.save_every)
+    options = RTSPClientOptions(display_window=False, show_fps=False,
+                                frame_source=SyntheticSource(args.width, args.height, fps=args.fps))
+    client = RTSPClient('10.2.0.1', '554', '00:00:00:00:02:01', options=options, frame_callback=callback)
+    cpu_start = time.process_time()
+    client.start()
+    time.sleep(args.seconds)
+    client.stop()  # prints the stage table of the camera when profiling is on
+    encoder_pool.stop()
+    cpu = time.process_time() - cpu_start
+    return client.frames, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cost of the stage profiler and the stage latency table")
+    parser.add_argument('--calls', type=int, default=1_000_000, help="start()/stop() pairs per overhead run")
+    parser.add_argument('--seconds', type=float, default=10.0, help="pipeline run time per mode")
+    parser.add_argument('--sample-every', type=int, default=1)
+    parser.add_argument('--save-every', type=int, default=5)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--fps', type=float, default=30.0)
+    args = parser.parse_args()
+
+    print(f"\n=== start()/stop() overhead ({args.calls} calls) ===")
+    print(f"{'Profiler':<22} {'ns/call':>8}")
+    print(f"{'off':<22} {call_overhead(profiling.NULL_STAGE, args.calls):>8.0f}")
+    for n in sorted({1, max(1, args.sample_every), 10}):
+        stage = profiling.StageTimer('read', sample_every=n)
+        print(f"{f'on, 1 in {n} timed':<22} {call_overhead(stage, args.calls):>8.0f}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for mode, sample_every in (('off', 0), ('on', args.sample_every)):
+            results[mode] = run_pipeline(args, sample_every, directory)
+
+    print(f"\n=== Pipeline, {args.width}x{args.height} @ {args.fps:.0f} fps for {args.seconds:.0f} s ===")
+    print(f"{'Profiling':<10} {'Frames':>8} {'CPU ms/frame':>13}")
+    for mode, (frames, cpu) in results.items():
+        print(f"{mode:<10} {frames:>8} {cpu / max(1, frames) * 1000:>13.3f}")
+
+
+if __name__ == "__main__":
+    main()
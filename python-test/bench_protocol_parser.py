@@ -0,0 +1,103 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python', 'v1'))
+
+from protocol import (ControlParser, decode_device_info, encode_device_info, encode_heartbeat,
+                      MSG_DEVICE_INFO)
+
+'''
+控制協定 parser 的吞吐量測試
+
+比較三種情況:
+- legacy: 舊版 CameraClientHandler 的作法 (decode 成 str、字串 buffer 累加、split '\\r\\n')
+- text: ControlParser 解析舊版文字協定
+- binary: ControlParser 解析 length-prefixed binary frame
+
+資料以隨機大小的 chunk 餵入，模擬 TCP 將訊息切斷的情況。
+'''
+
+
+def build_stream(binary, messages, info_every):
+    """Builds a control stream with one device info message every `info_every` heartbeats."""
+    info = encode_device_info('AA:BB:CC:DD:EE:01', '192.168.1.10', 554) if binary \
+        else b'AA:BB:CC:DD:EE:01,192.168.1.10,554\r\n'
+    heartbeat = encode_heartbeat() if binary else b'AliveHeartBeat\r\n'
+    return b''.join(info if i % info_every == 0 else heartbeat for i in range(messages))
+
+
+def split_chunks(stream, max_chunk, seed=0):
+    rng = random.Random(seed)
+    chunks = []
+    pos = 0
+    while pos < len(stream):
+        size = rng.randint(1, max_chunk)
+        chunks.append(stream[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def run_legacy(chunks):
+    count = 0
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk.decode()
+        while '\r\n' in buffer:
+            line, buffer = buffer.split('\r\n', 1)
+            line = line.strip()
+            if not line:
+                continue
+            if line != "AliveHeartBeat":
+                line.split(',')
+            count += 1
+    return count
+
+
+def run_parser(chunks):
+    count = 0
+    parser = ControlParser()
+    for chunk in chunks:
+        for msg in parser.feed(chunk):
+            if msg.msg_type == MSG_DEVICE_INFO:
+                decode_device_info(msg)
+            count += 1
+    return count
+
+
+def bench(name, func, chunks, total_bytes, repeat):
+    best = float('inf')
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = func(chunks)
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<8} {count:>10} msgs {count / best / 1e6:>8.2f} Mmsg/s "
+          f"{total_bytes / best / 1e6:>8.1f} MB/s {best * 1e9 / count:>8.0f} ns/msg")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Control protocol parser throughput benchmark")
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--info-every', type=int, default=100,
+                        help="one device info message every n messages")
+    parser.add_argument('--max-chunk', type=int, default=1024,
+                        help="largest recv() chunk size")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    text_stream = build_stream(False, args.messages, args.info_every)
+    binary_stream = build_stream(True, args.messages, args.info_every)
+    text_chunks = split_chunks(text_stream, args.max_chunk)
+    binary_chunks = split_chunks(binary_stream, args.max_chunk)
+
+    print(f"{args.messages} messages, chunks up to {args.max_chunk} bytes, best of {args.repeat}")
+    bench('legacy', run_legacy, text_chunks, len(text_stream), args.repeat)
+    bench('text', run_parser, text_chunks, len(text_stream), args.repeat)
+    bench('binary', run_parser, binary_chunks, len(binary_stream), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python', 'v1'))
+
+import numpy as np
+from camera_client_handler import register_camera
+from camera_manager import CameraManager
+from frame_source import SyntheticSource
+from worker_pool import RtspWorkerPool
+
+'''
+RTSP worker pool 的註冊 -> 第一張 frame 延遲 benchmark
+
+以合成 camera 反覆註冊 / 重連，量測 register_camera() 呼叫到該 camera 的 FrameRing 出現第一張 frame 的時間:
+- cold: 每次註冊都建立新的 multiprocessing.Process (launch_rtsp_process，原本的行為)
+- pool: RtspWorkerPool 預先啟動的 worker，註冊時只經由 pipe 交付工作
+
+--start-method spawn 讓 cold 模擬 Windows，子進程需要重新 import cv2 與 main module，差異最明顯；pool 的 worker
+一律由 forkserver 建立 (見 worker_pool.py)，不受 --start-method 影響。
+合成 source 沒有 RTSP handshake，所以量到的是進程本身的成本。
+
+Example:
+    python python-test/bench_worker_pool.py --cameras 4 --rounds 5 --start-method spawn
+'''
+
+
+def first_frame_latency(camera_manager, ip, start, timeout):
+    """Seconds from `start` until the camera's ring holds a frame written after it, None on timeout."""
+    ring = camera_manager.get_camera(ip)['frame_ring']
+    # a reconnect reuses the ring and restarts the sequence numbers, so look at the write time
+    started = time.time() - (time.perf_counter() - start)
+    while time.perf_counter() - start < timeout:
+        entry = ring.latest()
+        if entry is not None and entry[1] >= started:
+            return time.perf_counter() - start
+        time.sleep(0.001)
+    return None
+
+
+def run(mode, args):
+    camera_manager = CameraManager(client_threads={})
+    pool = None
+    if mode == 'pool':
+        pool = RtspWorkerPool(frame_callback=None, size=args.cameras)
+        pool.start()
+    launcher = pool.launch if pool else None
+    options = {'frame_source': SyntheticSource(args.width, args.height, fps=args.fps, decode=False, stamp=False)}
+
+    latencies, misses = [], 0
+    for _ in range(args.rounds):
+        # every round re-registers each camera, like a board reconnecting
+        for i in range(args.cameras):
+            ip = f'10.1.0.{i + 1}'
+            start = time.perf_counter()
+            register_camera(camera_manager, ip, f'00:00:00:00:01:{i:02X}', ip, '554', None,
+                            show_stream=False, rtsp_options=options, rtsp_launcher=launcher)
+            latency = first_frame_latency(camera_manager, ip, start, args.timeout)
+            if latency is None:
+                misses += 1
+            else:
+                latencies.append(latency)
+        time.sleep(args.settle)  # let the pool top itself up
+
+    for ip in list(camera_manager.connected_cameras):
+        camera_manager.remove_camera(ip)
+    if pool:
+        print(pool.stats())
+        pool.stop()
+    return latencies, misses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registration to first frame, new process vs warm worker pool")
+    parser.add_argument('--cameras', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=5, help="registrations per camera")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--start-method', choices=multiprocessing.get_all_start_methods(), default=None)
+    parser.add_argument('--settle', type=float, default=1.0, help="seconds between rounds")
+    parser.add_argument('--timeout', type=float, default=30.0, help="seconds to wait for a first frame")
+    args = parser.parse_args()
+
+    if args.start_method:
+        multiprocessing.set_start_method(args.start_method)
+
+    results = {mode: run(mode, args) for mode in ('cold', 'pool')}
+
+    print(f"\n=== Registration -> first frame ({args.cameras} camera(s) x {args.rounds} rounds, "
+          f"start method {multiprocessing.get_start_method()}) ===")
+    print(f"{'Mode':<6} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'Missed':>7}")
+    for mode, (latencies, misses) in results.items():
+        values = np.array(latencies) * 1000 if latencies else np.zeros(1)
+        print(f"{mode:<6} {np.percentile(values, 50):>8.1f} {np.percentile(values, 95):>8.1f} "
+              f"{values.max():>8.1f} {misses:>7}")
+
+
+if __name__ == "__main__":
+    main()
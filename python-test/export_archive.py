@@ -0,0 +1,108 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python', 'v1'))
+
+from frame_archive import FrameArchiveReader, list_segments
+
+'''
+將 FrameArchive (frame_archive.py) 的 frame 匯出成 JPEG 檔
+
+不加 --out 時只列出 archive 的摘要 (segment 數、frame 數、seq 與時間範圍、大小)；--archive 可以是一台
+camera 的目錄 (archive/<ip>) 或上層的 archive 目錄 (每台 camera 一行)。
+加上 --out 時把 [--start, --end) 時間範圍內、每 --every 張中的 1 張寫成 <out>/<archive seq>.jpg，
+檔名依 seq 排序，可以直接給 replay_frames.py --images 使用。時間為 unix time 或 'YYYY-mm-dd HH:MM:SS' (local time)。
+
+Example:
+    python python-test/export_archive.py --archive archive
+    python python-test/export_archive.py --archive archive/192.168.1.10 --out export/192.168.1.10 --every 2
+    python python-test/export_archive.py --archive archive/192.168.1.10 --out export/192.168.1.10 \\
+        --start "2024-05-01 12:00:00" --end "2024-05-01 12:05:00"
+'''
+
+
+def parse_time(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return time.mktime(time.strptime(value, '%Y-%m-%d %H:%M:%S'))
+
+
+def format_time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+
+def camera_dirs(path):
+    """The archive directories under `path`, or `path` itself when it is one."""
+    if list_segments(path):
+        return [path]
+    return sorted(os.path.join(path, name) for name in os.listdir(path)
+                  if list_segments(os.path.join(path, name)))
+
+
+def print_summary(directories):
+    print("\n=== Frame archives ===")
+    print(f"{'Archive':<32} {'Segments':>8} {'Frames':>8} {'First seq':>10} {'Last seq':>10}"
+          f" {'First frame':>20} {'Last frame':>20} {'MB':>9}")
+    print("-" * 124)
+    for directory in directories:
+        with FrameArchiveReader(directory) as reader:
+            if not len(reader):
+                print(f"{directory:<32} {len(list_segments(directory)):>8} {0:>8}")
+                continue
+            first = reader.record(reader.first_seq)
+            last = reader.record(reader.last_seq)
+            size = sum(record.length for record in reader.records())
+            print(f"{directory:<32} {len(list_segments(directory)):>8} {len(reader):>8} {first.seq:>10}"
+                  f" {last.seq:>10} {format_time(first.timestamp):>20} {format_time(last.timestamp):>20}"
+                  f" {size / 1e6:>9.1f}")
+    print("==========================\n")
+
+
+def export(directory, out, start=None, end=None, every=1):
+    """
+    Writes the frames of one archive taken in [start, end) to `out` as <seq>.jpg.
+
+    Returns:
+        int: Number of files written.
+    """
+    os.makedirs(out, exist_ok=True)
+    written = 0
+    with FrameArchiveReader(directory) as reader:
+        for i, record in enumerate(reader.records(start, end)):
+            if i % every:
+                continue
+            with open(os.path.join(out, f"{record.seq:012d}.jpg"), 'wb') as f:
+                f.write(reader.read(record.seq))
+            written += 1
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List a frame archive or export its frames as JPEG files")
+    parser.add_argument('--archive', required=True, help="archive/<ip> directory, or archive/ for all cameras")
+    parser.add_argument('--out', help="directory for the JPEG files, only the summary is printed without it")
+    parser.add_argument('--start', help="first capture time to export, unix time or 'YYYY-mm-dd HH:MM:SS'")
+    parser.add_argument('--end', help="capture time to stop at (exclusive)")
+    parser.add_argument('--every', type=int, default=1, help="export one frame in n")
+    args = parser.parse_args()
+
+    directories = camera_dirs(args.archive)
+    if not directories:
+        parser.error(f"No frame archive in {args.archive}")
+    if args.out is None:
+        print_summary(directories)
+        return
+    start, end = parse_time(args.start), parse_time(args.end)
+    for directory in directories:
+        out = args.out if len(directories) == 1 else os.path.join(args.out, os.path.basename(directory))
+        written = export(directory, out, start, end, max(1, args.every))
+        print(f"{directory}: {written} frames written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import cProfile
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python', 'v1'))
+
+from frame_source import ImageDirSource, SyntheticSource, VideoFileSource
+from main import FrameCallback
+from rtsp_client import RTSPClient, RTSPClientOptions
+
+'''
+以固定的輸入重播 RTSPClient -> FrameCallback，不需要 camera
+
+在同一個進程中執行一個 RTSPClient (不開子進程，方便 profile)，frame 來源可以是影片檔 / 錄影目錄、
+圖片目錄或合成的 pattern。預設不等待、盡可能快地播放 (不是 live source，所以每張 frame 都會交給 callback)，
+--realtime 則以原本的速度播放。結束時印出 frame 數、FPS 與 callback 耗時，--profile 會印出 cProfile 結果。
+
+Example:
+    python python-test/replay_frames.py --video recordings/192.168.1.10 --profile
+    python python-test/replay_frames.py --images img/192.168.1.10 --save-every 1
+    python python-test/replay_frames.py --synthetic 1920x1080 --frames 600
+'''
+
+
+class TimedCallback:
+    """Wraps the real FrameCallback and measures the time spent in it."""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.frames = 0
+        self.elapsed = 0.0
+
+    def __call__(self, frame, other_info):
+        start = time.perf_counter()
+        self.callback(frame, other_info)
+        self.elapsed += time.perf_counter() - start
+        self.frames += 1
+
+    def stop(self):
+        self.callback.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a file, image or synthetic source through RTSPClient")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--video', help="video file or directory of recorded segments")
+    group.add_argument('--images', help="directory of images, e.g. img/<ip>")
+    group.add_argument('--synthetic', metavar='WxH', help="generated pattern of this size")
+    parser.add_argument('--frames', type=int, default=300, help="frames of the synthetic source")
+    parser.add_argument('--fps', type=float, default=30.0, help="rate of image and synthetic sources")
+    parser.add_argument('--realtime', action='store_true', help="play at the source frame rate")
+    parser.add_argument('--save-every', type=int, default=15, help="SAVE_EVERY_N_FRAME")
+    parser.add_argument('--decode-mode', choices=('full', 'sampled'), default='full')
+    parser.add_argument('--profile', action='store_true', help="print the top cProfile entries")
+    parser.add_argument('--out', default=None, help="directory the JPEGs are saved to, temporary if omitted")
+    args = parser.parse_args()
+
+    realtime = args.realtime
+    if args.video:
+        source = VideoFileSource(os.path.abspath(args.video), realtime=realtime)
+    elif args.images:
+        source = ImageDirSource(os.path.abspath(args.images), fps=args.fps, realtime=realtime)
+    else:
+        width, height = (int(v) for v in args.synthetic.lower().split('x'))
+        source = SyntheticSource(width=width, height=height, fps=args.fps, realtime=realtime, stamp=False,
+                                 frames=args.frames)
+
+    out_dir = args.out or tempfile.mkdtemp(prefix='replay_frames_')
+    os.makedirs(out_dir, exist_ok=True)
+    os.chdir(out_dir)  # FrameCallback saves to ./img/<ip>
+
+    callback = TimedCallback(FrameCallback(n=args.save_every))
+    options = RTSPClientOptions(display_window=False, show_fps=False, frame_source=source,
+                                decode_mode=args.decode_mode, sample_every=args.save_every)
+    client = RTSPClient('127.0.0.1', '554', 'replay', options=options, frame_callback=callback)
+
+    profiler = cProfile.Profile() if args.profile else None
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    # run the client loop in this thread so cProfile sees it; it returns when the source finishes
+    client._run()
+    if profiler:
+        profiler.disable()
+    elapsed = time.perf_counter() - start
+    callback.stop()
+
+    print(f"\n=== Replay of {source!r} ===")
+    print(f"frames {callback.frames} in {elapsed:.2f} s -> {callback.frames / elapsed:.1f} FPS, "
+          f"callback {callback.elapsed / max(callback.frames, 1) * 1000:.3f} ms per frame")
+    if args.decode_mode == 'sampled':
+        print(f"decode: {client.decode_stats.summary()}")
+    if profiler:
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
+    if args.out is None:
+        os.chdir(os.path.dirname(out_dir))
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
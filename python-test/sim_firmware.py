@@ -0,0 +1,462 @@
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python', 'v1'))
+
+import numpy as np
+from protocol import (ControlParser, ProtocolError, decode_command, encode_ack, encode_device_info, encode_heartbeat,
+                      MSG_COMMAND, MODE_BINARY, MODE_TEXT, PARAMS, PARAM_FPS, PARAM_BITRATE, ACK_OK, ACK_CLAMPED,
+                      ACK_INVALID, ACK_STATUSES as ACK_STATUS_NAMES)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+'''
+模擬 AMB82-MINI 上的 RTSP.ino，對 server 做 control plane 壓力測試
+
+每台模擬 camera 是一個 asyncio task，行為與 RTSP.ino 相同:
+- 連線後送出 sendDeviceInfo 的註冊訊息 (`mac,ip,port\\r\\n`，--binary 則使用 protocol.py 的 binary frame)
+- 每 --heartbeat 秒送一次 AliveHeartBeat
+- 每台 camera 使用不同的來源 IP (127.x.y.z，Linux 上整個 127.0.0.0/8 都是 loopback)，
+  因為 server 以來源 IP 當作 camera 的 key
+
+可注入的故障 (每次 heartbeat 時依機率觸發):
+- --disconnect: 關閉連線，--reconnect-delay 秒後重新連線並註冊
+- --duplicate: 舊連線不關閉，直接從同一個 IP 再開一條新連線 (板子重開機、舊 socket 還沒斷)
+- --stall: 連線不斷，但 --stall-time 秒內不送 heartbeat
+
+--in-process: 在同一個進程中啟動 Server / AsyncServer (不會真的開 RTSP 子進程，改用 SimulatedLauncher)，
+量測 server 端的數據:
+- registration latency: 送出註冊訊息 -> server 啟動該 camera 的 RTSP client
+- heartbeat latency: 送出 heartbeat -> CameraManager.update_heartbeat 被呼叫
+- camera_lock: 取得 lock 的等待時間與持有時間 (lock contention)
+- thread 數量 (threaded Server 每台 camera 一個 thread)
+否則只連到 --host:--port 上已在執行的 server，只能量測 client 端的連線時間與錯誤數。
+
+--rtsp-host / --rtsp-port: 註冊訊息中回報的 RTSP 位址，可指向本機的 RTSP 替身 (例如 mediamtx 轉播一個檔案)，
+不指定則回報來源 IP。
+
+Rate command (protocol.py 的 COMMAND / ACK): 每台模擬 camera 與 RTSP.ino 相同，從 30 fps、4 Mbps、1920x1080 開始，
+收到 command 後 --apply-delay 秒 (重新設定 video channel) 回覆 ACK，超出 FPS_LIMITS / BITRATE_LIMITS 的值會被 clamp，
+不在 RESOLUTIONS 中的解析度回覆 invalid；--legacy 比例的 camera 像舊版 RTSP.ino 一樣不讀取 command。
+--in-process --rate-control 同時啟動 rate_control.RateController，負載由模擬 camera 目前的速率計算:
+CPU = 所有 camera 的 fps (以 1080p 換算) / --decode-capacity，throughput = bitrate 總和 (最多 --link-mbps)，
+印出負載、fps 與 bitrate 隨時間的變化，以及 command / ACK 的數量。
+
+Example:
+    python python-test/sim_firmware.py --in-process --server async --cameras 2000 --duration 60
+    python python-test/sim_firmware.py --host 192.168.1.2 --cameras 50 --rtsp-host 192.168.1.2 --rtsp-port 8554
+    python python-test/sim_firmware.py --in-process --rate-control --cameras 12 --duration 120 --link-mbps 30
+'''
+
+# limits of the firmware, the same as RTSP.ino
+FPS_LIMITS = (1, 30)
+BITRATE_LIMITS = (256 * 1024, 8 * 1024 * 1024)
+RESOLUTIONS = ((1920, 1080), (1280, 720), (640, 480))
+DEFAULT_RATES = {'fps': 30, 'bitrate': 4 * 1024 * 1024, 'resolution': (1920, 1080)}
+
+
+class SimStats:
+    """Counters and latency samples shared by the simulated cameras and the instrumented server."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connect_latency = []
+        self.registration_latency = []
+        self.heartbeat_latency = []
+        self.registration_sent = {}  # mac -> send time
+        self.heartbeat_sent = {}  # source ip -> send time
+        self.connections = 0
+        self.disconnects = 0
+        self.duplicates = 0
+        self.stalls = 0
+        self.errors = 0
+        self.heartbeats = 0
+        self.max_threads = threading.active_count()
+        self.max_registered = 0
+        self.rates = {}  # source ip -> rates the simulated camera runs at, see DEFAULT_RATES
+        self.commands = 0
+        self.acks = {}  # status -> count
+        self.rate_samples = []  # (seconds, cpu percent, throughput bit/s, mean fps), with --rate-control
+        self.rate_report = None  # last RateController report before the cameras disconnect
+
+
+class SimulatedLoad:
+    """RateController load computed from the rates the simulated cameras run at."""
+
+    def __init__(self, stats, decode_capacity, link_capacity):
+        self.stats = stats
+        self.decode_capacity = decode_capacity  # 1080p frames/s the server decodes with every core busy
+        self.link_capacity = link_capacity
+
+    def __call__(self):
+        with self.stats.lock:
+            rates = [dict(rate) for rate in self.stats.rates.values()]
+        frames = sum(rate['fps'] * rate['resolution'][0] * rate['resolution'][1] / (1920 * 1080) for rate in rates)
+        bits = sum(rate['bitrate'] for rate in rates)
+        # a saturated link carries no more than its capacity
+        return {'cpu': min(100.0, frames / self.decode_capacity * 100), 'throughput': min(bits, self.link_capacity)}
+
+
+class InstrumentedLock:
+    """Drop-in for threading.Lock that records wait and hold times."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.waits = []
+        self.holds = []
+        self._acquired_at = None
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            now = time.perf_counter()
+            self.waits.append(now - start)
+            self._acquired_at = now
+        return acquired
+
+    def release(self):
+        self.holds.append(time.perf_counter() - self._acquired_at)
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SimulatedProcess:
+    """Process handle of a camera whose RTSP client is not actually started."""
+
+    pid = 'sim'
+
+    def __init__(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def terminate(self):
+        self.alive = False
+
+    def join(self, timeout=None):
+        pass
+
+
+class SimulatedLauncher:
+    """rtsp_launcher for the in-process server: records the registration latency."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __call__(self, cam_ip, port, mac, frame_callback, show_stream, frame_ring, rtsp_options):
+        now = time.perf_counter()
+        with self.stats.lock:
+            sent = self.stats.registration_sent.pop(mac, None)
+            if sent is not None:
+                self.stats.registration_latency.append(now - sent)
+        return SimulatedProcess()
+
+
+def instrument_camera_manager(camera_manager, stats):
+    """Swaps camera_lock for an InstrumentedLock and times update_heartbeat."""
+    camera_manager.camera_lock = InstrumentedLock()
+    update_heartbeat = camera_manager.update_heartbeat
+
+    def timed_update_heartbeat(ip_address):
+        now = time.perf_counter()
+        with stats.lock:
+            sent = stats.heartbeat_sent.pop(ip_address, None)
+            if sent is not None:
+                stats.heartbeat_latency.append(now - sent)
+        update_heartbeat(ip_address)
+
+    camera_manager.update_heartbeat = timed_update_heartbeat
+
+
+def apply_command(rates, command):
+    """Applies a rate command like RTSP.ino does. Returns (ack status, applied value)."""
+    name = PARAMS[command.param]
+    if command.param == PARAM_FPS:
+        applied = min(max(command.value, FPS_LIMITS[0]), FPS_LIMITS[1])
+    elif command.param == PARAM_BITRATE:
+        applied = min(max(command.value, BITRATE_LIMITS[0]), BITRATE_LIMITS[1])
+    elif command.value in RESOLUTIONS:
+        applied = command.value
+    else:
+        return ACK_INVALID, rates[name]
+    rates[name] = applied
+    return (ACK_OK if applied == command.value else ACK_CLAMPED), applied
+
+
+async def serve_rate_commands(reader, writer, ip, args, stats):
+    """Answers the server's rate commands on one connection until it closes."""
+    parser = ControlParser()
+    mode = MODE_BINARY if args.binary else MODE_TEXT
+    while True:
+        data = await reader.read(4096)
+        if not data:
+            return
+        try:
+            messages = parser.feed(data)
+        except ProtocolError as e:
+            if args.verbose:
+                print(f"{ip}: {e}", file=sys.__stdout__)
+            return
+        for msg in messages:
+            if msg.msg_type != MSG_COMMAND:
+                continue
+            command = decode_command(msg)
+            await asyncio.sleep(args.apply_delay)  # the board restarts its video channel
+            with stats.lock:
+                status, applied = apply_command(stats.rates[ip], command)
+                stats.commands += 1
+                stats.acks[status] = stats.acks.get(status, 0) + 1
+            writer.write(encode_ack(command.command_id, command.param, status, applied, mode))
+            await writer.drain()
+
+
+def source_ip(index):
+    """127.1.0.1, 127.1.0.2, ... one loopback address per simulated camera."""
+    n = index + 1
+    return f'127.{1 + (n >> 16) % 254}.{(n >> 8) & 255}.{n & 255}'
+
+
+async def simulated_camera(index, args, stats, stop_time):
+    ip = source_ip(index)
+    mac = f'AA:BB:{(index >> 24) & 255:02X}:{(index >> 16) & 255:02X}:{(index >> 8) & 255:02X}:{index & 255:02X}'
+    rtsp_ip = args.rtsp_host or ip
+    if args.binary:
+        registration = encode_device_info(mac, rtsp_ip, args.rtsp_port)
+        heartbeat = encode_heartbeat()
+    else:
+        registration = f'{mac},{rtsp_ip},{args.rtsp_port}\r\n'.encode()
+        heartbeat = b'AliveHeartBeat\r\n'
+    rng = random.Random(index)
+    stale = []  # connections left open by --duplicate
+    legacy = rng.random() < args.legacy  # ignores commands like the RTSP.ino without rate control
+    with stats.lock:
+        stats.rates[ip] = dict(DEFAULT_RATES)
+
+    # boards do not boot in the same millisecond
+    await asyncio.sleep(rng.uniform(0, args.ramp))
+    while time.time() < stop_time:
+        try:
+            start = time.perf_counter()
+            reader, writer = await asyncio.open_connection(
+                args.host, args.port, local_addr=(ip, 0) if args.source_ips else None)
+            connected = time.perf_counter()
+            with stats.lock:
+                stats.connect_latency.append(connected - start)
+                stats.connections += 1
+                stats.registration_sent[mac] = time.perf_counter()
+            writer.write(registration)
+            await writer.drain()
+            commands = None if legacy else asyncio.create_task(serve_rate_commands(reader, writer, ip, args, stats))
+
+            reconnect = False
+            await asyncio.sleep(rng.uniform(0, args.heartbeat))
+            while time.time() < stop_time:
+                roll = rng.random()
+                if roll < args.disconnect:
+                    with stats.lock:
+                        stats.disconnects += 1
+                    reconnect = True
+                    break
+                roll -= args.disconnect
+                if roll < args.duplicate:
+                    with stats.lock:
+                        stats.duplicates += 1
+                    stale.append(writer)
+                    break
+                roll -= args.duplicate
+                if roll < args.stall:
+                    with stats.lock:
+                        stats.stalls += 1
+                    await asyncio.sleep(args.stall_time)
+                    continue
+                with stats.lock:
+                    stats.heartbeat_sent[ip] = time.perf_counter()
+                    stats.heartbeats += 1
+                writer.write(heartbeat)
+                await writer.drain()
+                await asyncio.sleep(args.heartbeat)
+
+            if commands is not None and writer not in stale:
+                commands.cancel()
+            if writer not in stale:
+                writer.close()
+            if reconnect:
+                await asyncio.sleep(args.reconnect_delay)
+        except (OSError, asyncio.IncompleteReadError) as e:
+            with stats.lock:
+                stats.errors += 1
+            if args.verbose:
+                print(f"{ip}: {e}", file=sys.__stdout__)
+            await asyncio.sleep(args.reconnect_delay)
+    for writer in stale:
+        writer.close()
+
+
+async def run_cameras(args, stats, camera_manager=None, controller=None):
+    start = time.time()
+    stop_time = start + args.duration
+    tasks = [asyncio.create_task(simulated_camera(i, args, stats, stop_time)) for i in range(args.cameras)]
+    while not all(task.done() for task in tasks):
+        stats.max_threads = max(stats.max_threads, threading.active_count())
+        if camera_manager is not None:
+            stats.max_registered = max(stats.max_registered, len(camera_manager.connected_cameras))
+        if controller is not None:
+            sample = controller.load()
+            with stats.lock:
+                mean_fps = float(np.mean([rate['fps'] for rate in stats.rates.values()])) if stats.rates else 0.0
+            stats.rate_samples.append((time.time() - start, sample['cpu'], sample['throughput'], mean_fps))
+            if time.time() < stop_time:  # before the cameras disconnect
+                stats.rate_report = controller.report()
+        await asyncio.sleep(0.5)
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def raise_fd_limit(needed):
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        if target < needed:
+            print(f"Open file limit is {target}, fewer than the {needed} sockets needed")
+
+
+def _ms(values, q):
+    return float(np.percentile(values, q)) * 1000 if values else 0.0
+
+
+def print_latency(name, values):
+    if not values:
+        print(f"{name:<24} no samples")
+        return
+    print(f"{name:<24} n={len(values):<8} p50 {_ms(values, 50):8.2f}  p95 {_ms(values, 95):8.2f}  "
+          f"p99 {_ms(values, 99):8.2f}  max {max(values) * 1000:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated RTSP.ino clients for control-plane load tests")
+    parser.add_argument('--cameras', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds to run")
+    parser.add_argument('--ramp', type=float, default=5.0, help="cameras connect over this many seconds")
+    parser.add_argument('--heartbeat', type=float, default=10.0, help="heartbeat interval (RTSP.ino: 10 s)")
+    parser.add_argument('--binary', action='store_true', help="use the binary control protocol")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12345)
+    parser.add_argument('--no-source-ips', dest='source_ips', action='store_false',
+                        help="connect from the default address instead of one 127.x address per camera")
+    parser.add_argument('--rtsp-host', default=None, help="RTSP address reported at registration")
+    parser.add_argument('--rtsp-port', type=int, default=554)
+    parser.add_argument('--disconnect', type=float, default=0.0, help="disconnect probability per heartbeat")
+    parser.add_argument('--reconnect-delay', type=float, default=1.0)
+    parser.add_argument('--duplicate', type=float, default=0.0,
+                        help="probability per heartbeat of reconnecting from the same IP without closing")
+    parser.add_argument('--stall', type=float, default=0.0, help="heartbeat stall probability per heartbeat")
+    parser.add_argument('--stall-time', type=float, default=40.0, help="seconds a stall lasts")
+    parser.add_argument('--in-process', action='store_true', help="start an instrumented server in this process")
+    parser.add_argument('--server', choices=('async', 'threaded'), default='async',
+                        help="server started with --in-process")
+    parser.add_argument('--legacy', type=float, default=0.0,
+                        help="fraction of cameras that ignore rate commands (RTSP.ino without rate control)")
+    parser.add_argument('--apply-delay', type=float, default=0.2, help="seconds a camera takes to apply a command")
+    parser.add_argument('--rate-control', action='store_true',
+                        help="with --in-process, run the RateController against the simulated load")
+    parser.add_argument('--decode-capacity', type=float, default=200.0,
+                        help="1080p frames/s the simulated server decodes at 100%% CPU")
+    parser.add_argument('--link-mbps', type=float, default=50.0, help="simulated Wi-Fi capacity")
+    parser.add_argument('--rate-interval', type=float, default=2.0, help="RateController interval")
+    parser.add_argument('--verbose', action='store_true', help="keep the server output")
+    args = parser.parse_args()
+
+    raise_fd_limit(args.cameras * 3 + 256)
+    stats = SimStats()
+    server = server_thread = None
+    devnull = open(os.devnull, 'w')
+    quiet = contextlib.redirect_stdout(devnull) if not args.verbose else contextlib.nullcontext()
+
+    controller = None
+    with quiet:
+        if args.in_process:
+            from async_server import AsyncServer
+            from server import Server
+            server_cls = AsyncServer if args.server == 'async' else Server
+            server = server_cls(host=args.host, port=args.port, frame_callback=None, show_stream=False,
+                                rtsp_launcher=SimulatedLauncher(stats))
+            instrument_camera_manager(server.camera_manager, stats)
+            server_thread = threading.Thread(target=server.start, name='SimServer', daemon=True)
+            server_thread.start()
+            time.sleep(1.0)  # let it bind
+            if args.rate_control:
+                from rate_control import RateController
+                controller = RateController(server.camera_manager, link_capacity=args.link_mbps * 1e6,
+                                            interval=args.rate_interval,
+                                            load=SimulatedLoad(stats, args.decode_capacity, args.link_mbps * 1e6))
+                controller.start()
+
+        start = time.time()
+        asyncio.run(run_cameras(args, stats, server.camera_manager if server else None, controller))
+        elapsed = time.time() - start
+
+        if controller is not None:
+            controller.stop()
+        if server is not None:
+            server.camera_manager.stop_event.set()
+            server_thread.join(timeout=30)
+    devnull.close()
+
+    print(f"\n=== Simulated firmware: {args.cameras} cameras, {elapsed:.0f} s, "
+          f"{'binary' if args.binary else 'text'} protocol ===")
+    print(f"connections {stats.connections}  heartbeats {stats.heartbeats}  disconnects {stats.disconnects}  "
+          f"duplicates {stats.duplicates}  stalls {stats.stalls}  errors {stats.errors}")
+    print_latency("connect", stats.connect_latency)
+    if server is None:
+        print("Registration and heartbeat latency need --in-process")
+        return
+    print(f"server: {args.server}, max cameras registered {stats.max_registered}/{args.cameras}, "
+          f"max threads {stats.max_threads}")
+    print_latency("registration", stats.registration_latency)
+    print_latency("heartbeat", stats.heartbeat_latency)
+    lock = server.camera_manager.camera_lock
+    print_latency("camera_lock wait", lock.waits)
+    print_latency("camera_lock hold", lock.holds)
+    if lock.holds:
+        print(f"camera_lock held {sum(lock.holds):.3f} s in total ({sum(lock.holds) / elapsed * 100:.2f}% of the run)")
+    if controller is None:
+        return
+
+    print(f"\n=== Rate control: decode capacity {args.decode_capacity:.0f} 1080p frames/s, link {args.link_mbps} Mbps,"
+          f" {args.legacy * 100:.0f}% legacy cameras ===")
+    print(f"{'Time s':>7} {'CPU %':>7} {'Mbps':>8} {'Mean fps':>9}")
+    print("-" * 34)
+    step = max(1, len(stats.rate_samples) // 12)
+    for t, cpu, throughput, mean_fps in stats.rate_samples[::step] + stats.rate_samples[-1:]:
+        print(f"{t:>7.0f} {cpu:>7.1f} {throughput / 1e6:>8.1f} {mean_fps:>9.1f}")
+    fps = [rate['fps'] for rate in stats.rates.values()]
+    bitrate = [rate['bitrate'] / 1e6 for rate in stats.rates.values()]
+    print(f"final fps min {min(fps)} / mean {np.mean(fps):.1f} / max {max(fps)}, "
+          f"Mbps min {min(bitrate):.2f} / mean {np.mean(bitrate):.2f} / max {max(bitrate):.2f}")
+    print(f"commands answered {stats.commands}: " + ', '.join(f"{ACK_STATUS_NAMES[status]} {count}"
+                                                         for status, count in sorted(stats.acks.items())))
+    print(stats.rate_report or '')
+
+
+if __name__ == "__main__":
+    main()
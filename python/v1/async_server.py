@@ -0,0 +1,189 @@
+# async_server.py
+
+import asyncio
+import threading
+from utils import get_local_ip, DEBUG, LISTEN_BACKLOG
+from camera_manager import CameraManager
+from camera_client_handler import register_camera
+from protocol import ControlParser, decode_device_info, decode_ack, MSG_DEVICE_INFO, MSG_HEARTBEAT, MSG_ACK
+from camera_commands import CommandChannel
+from log import get_logger
+
+'''
+AsyncServer
+
+與 Server 相同的對外介面 (start / shutdown)，但所有 camera 的控制連線都在同一個 asyncio event loop 中處理:
+- 不再為每台 camera 建立一個 CameraClientHandler thread，也不需要 1 s timeout 的 accept 輪詢
+- 註冊 (device info) 與 heartbeat 的語意與 CameraClientHandler 相同，訊息格式見 protocol.py，仍透過 CameraManager 管理
+- 會 block 的操作 (terminate/join RTSP process) 交給 worker thread 執行，避免卡住 event loop
+- 送給 camera 的 command (camera_commands.py) 可以從任何 thread 送出，寫入交給 event loop 執行
+'''
+
+log = get_logger('server')
+
+
+class AsyncServer:
+    """Asyncio control-plane server handling every camera connection in a single thread."""
+
+    def __init__(self, host='0.0.0.0', port=12345, frame_callback=None, show_stream=True, rtsp_options=None,
+                 display=None, rtsp_launcher=None, failure_detector='fixed', heartbeat_timeout=30):
+        self.host = host
+        self.port = port
+        self.client_tasks = {}  # ip -> asyncio.Task serving that camera's connection
+        self._connections = set()  # every connection task, including ones still closing an older connection
+        self.camera_manager = CameraManager(client_threads=self.client_tasks, display=display,
+                                            timeout=heartbeat_timeout, failure_detector=failure_detector)
+        self.heartbeat_thread = None
+        self.camera_table_thread = None
+        self.frame_callback = frame_callback
+        self.show_stream = show_stream
+        self.rtsp_options = rtsp_options  # extra RTSPClientOptions for every camera
+        self.rtsp_launcher = rtsp_launcher  # starts the RTSP client of a camera, see register_camera
+
+    def start(self):
+        # Start heartbeat checking thread
+        self.heartbeat_thread = threading.Thread(
+            target=self.camera_manager.check_heartbeats)
+        self.heartbeat_thread.daemon = True
+        self.heartbeat_thread.start()
+
+        # Start camera table update thread
+        self.camera_table_thread = threading.Thread(
+            target=self.camera_manager.update_camera_table)
+        self.camera_table_thread.daemon = True
+        self.camera_table_thread.start()
+
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            print("\nKeyboardInterrupt received. Shutting down server...")
+            self.camera_manager.stop_event.set()
+        finally:
+            self.shutdown()
+
+    async def _serve(self):
+        server = await asyncio.start_server(
+            self._accept, self.host, self.port, backlog=LISTEN_BACKLOG)
+
+        if self.host == '0.0.0.0':
+            print(
+                f"Server started, waiting for connections on {get_local_ip()}:{self.port}")
+        else:
+            print(
+                f"Server started, waiting for connections on {self.host}:{self.port}")
+
+        async with server:
+            stop_waiter = asyncio.create_task(
+                asyncio.to_thread(self.camera_manager.stop_event.wait))
+            serve_task = asyncio.create_task(server.serve_forever())
+            try:
+                await asyncio.wait({stop_waiter, serve_task},
+                                   return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                serve_task.cancel()
+                # Unblock the waiter thread so asyncio.run() can shut its executor down
+                self.camera_manager.stop_event.set()
+                await self._close_clients()
+
+    async def _close_clients(self):
+        tasks = [task for task in self._connections if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        print("All client connections have been closed.")
+
+    def _accept(self, reader, writer):
+        # a plain callback: the task start_server wraps a coroutine in logs every cancelled connection (3.11)
+        task = asyncio.create_task(self._handle_client(reader, writer))
+        self._connections.add(task)
+        task.add_done_callback(self._connections.discard)
+
+    async def _handle_client(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        ip_address = addr[0]
+        log.info('A connection from %s:%s was accepted.', addr[0], addr[1])
+
+        # check if there is already a running connection from this ip
+        existing_task = self.client_tasks.get(ip_address)
+        if existing_task and not existing_task.done():
+            print(f'Closing client connection: {ip_address} ...')
+            existing_task.cancel()
+            await asyncio.gather(existing_task, return_exceptions=True)
+            print(f'Closed client connection: {ip_address} .')
+        self.client_tasks[ip_address] = asyncio.current_task()
+
+        mac = None
+        control = None
+        registration = None  # register_camera running in a worker thread
+        loop = asyncio.get_running_loop()
+        parser = ControlParser()
+        log.info("New connection from %s", addr)
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break  # peer closed the connection
+
+                for msg in parser.feed(data):
+                    if msg.msg_type == MSG_HEARTBEAT:
+                        self.camera_manager.update_heartbeat(ip_address)
+                        if DEBUG:
+                            log.debug("Heartbeat received from %s at %s", mac, ip_address)
+                    elif msg.msg_type == MSG_DEVICE_INFO:
+                        try:
+                            mac, cam_ip, port = decode_device_info(msg)
+                        except ValueError as e:
+                            log.warning("Invalid data format from %s: %s", addr, e)
+                            continue
+                        log.info("Received from %s (%s): %s,%s,%s", addr, parser.mode, mac, cam_ip, port)
+                        if control is None:
+                            control = CommandChannel(
+                                lambda data: loop.call_soon_threadsafe(writer.write, data), parser.mode,
+                                name=ip_address)
+                        registration = asyncio.ensure_future(asyncio.to_thread(
+                            register_camera, self.camera_manager, ip_address, mac, cam_ip, port,
+                            self.frame_callback, self.show_stream, self.rtsp_options, self.rtsp_launcher, control))
+                        # the thread cannot be cancelled, a cancelled connection waits for it in finally
+                        await asyncio.shield(registration)
+                    elif msg.msg_type == MSG_ACK and control is not None:
+                        try:
+                            control.on_ack(decode_ack(msg))
+                        except ValueError as e:
+                            log.warning("Invalid ack from %s: %s", addr, e)
+                    elif DEBUG:
+                        log.debug("Unhandled message 0x%02X from %s", msg.msg_type, addr)
+        except Exception as e:
+            log.error("Error with client %s: %s", addr, e)
+        finally:
+            if registration is not None and not registration.done():
+                # removing the camera before the registration finished would orphan the RTSP process it starts
+                await asyncio.wait({registration})
+            if control is not None:
+                control.close()
+            # a newer connection from the same ip owns the camera entry now
+            if self.client_tasks.get(ip_address) is asyncio.current_task():
+                del self.client_tasks[ip_address]
+                await asyncio.to_thread(self.camera_manager.remove_camera, ip_address)
+            writer.close()
+            log.info("Disconnected from %s", addr)
+
+    def shutdown(self):
+        # Terminate all RTSP client processes
+        with self.camera_manager.camera_lock:
+            for ip_address, info in self.camera_manager.connected_cameras.items():
+                process = info['process']
+                mac = info['mac']
+                if process and process.is_alive():
+                    print(
+                        f"Terminating RTSP client for {mac} at {info['ip']}:{info['port']}")
+                self.camera_manager.release_camera(info)
+            self.camera_manager.connected_cameras.clear()
+        print("All RTSP client processes have been terminated.")
+
+        # Ensure the heartbeat and camera table threads are also terminated
+        self.camera_manager.stop()
+        self.heartbeat_thread.join()
+        self.camera_table_thread.join()
+        print("Heartbeat checking and camera table update threads have been terminated.")
+
+        print("Server shutdown complete.")
@@ -0,0 +1,218 @@
+# batch_callback.py
+
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+from log import get_logger
+from profiling import StageTimer
+
+'''
+Batch callback
+
+frame_callback(frame, other_info) 每台 camera 每張 frame 呼叫一次 Python 函式並建立一個新的 dict；分析模型處理
+一整批 (N, H, W, 3) 比分開呼叫 N 次快得多。FrameBatcher 在主進程從所有 camera 的 FrameRing 收集 frame:
+- 預先配置 buffers 組 batch buffer: frames (batch_size, H, W, 3) uint8 與 meta (batch_size,) META_DTYPE
+  (camera index, seq, timestamp, 原始 height / width)，每張 frame 直接從 shared memory 複製 (或以 INTER_AREA
+  縮放) 到 buffer 的下一格，不配置新的記憶體
+- 湊滿 batch_size 張，或第一張進入 batch 後已過 timeout 秒，就把 buffer 交給 consumer thread 呼叫
+  consumer(frames[:n], meta[:n], cameras)，cameras[meta['camera']] 為 camera 的 ip；consumer 返回後 buffer 才會
+  再被使用，所以 consumer 要保留資料時必須自己複製
+- consumer 比 camera 慢、所有 buffer 都在使用中時，新的 frame 直接丟掉並計數，不會讓 ring reader 落後
+- every = n 時每台 camera 每 n 張只收 1 張
+- 複製後以 is_valid() 檢查 writer 沒有在複製時覆寫該 slot，被覆寫的 frame 不放進 batch
+'''
+
+META_DTYPE = np.dtype([('camera', '<u2'), ('seq', '<i8'), ('timestamp', '<f8'), ('height', '<u2'),
+                       ('width', '<u2')])
+
+log = get_logger('batch_callback')
+
+
+class _BatchTrack:
+    """Read position in one camera's ring."""
+
+    __slots__ = ('index', 'ring', 'last_seq', 'skip')
+
+    def __init__(self, index, ring):
+        self.index = index
+        self.ring = ring
+        self.last_seq = ring.latest_seq  # frames written before the batcher saw the ring are skipped
+        self.skip = 0
+
+
+class FrameBatcher(threading.Thread):
+    """Collects the frames of every camera into preallocated batches for one consumer call per batch."""
+
+    def __init__(self, camera_manager, consumer, batch_size=12, timeout=0.05, shape=(720, 1280, 3), buffers=2,
+                 every=1, poll_interval=0.002):
+        """
+        Initializes the FrameBatcher.
+
+        Args:
+            camera_manager (CameraManager): Source of the cameras' FrameRings.
+            consumer (callable): consumer(frames, meta, cameras), called from the consumer thread with a
+                (n, H, W, 3) uint8 view, its (n,) META_DTYPE view and the camera ip list.
+            batch_size (int): Frames per batch.
+            timeout (float): Seconds after the first frame of a batch at which it is handed over anyway.
+            shape (tuple): (H, W, 3) of a batch frame, other sizes are scaled to it.
+            buffers (int): Preallocated batches, one is filled while the consumer works on another.
+            every (int): Batch one frame in n of each camera.
+            poll_interval (float): Seconds between reads of the rings.
+        """
+        super().__init__(name='FrameBatcher', daemon=True)
+        self.camera_manager = camera_manager
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.shape = tuple(shape)
+        self.every = max(1, every)
+        self.poll_interval = poll_interval
+        self.cameras = []  # ip of each camera index, only appended to
+        self._frames = [np.zeros((batch_size,) + self.shape, dtype=np.uint8) for _ in range(buffers)]
+        self._meta = [np.zeros(batch_size, dtype=META_DTYPE) for _ in range(buffers)]
+        self._free = queue.Queue()
+        for i in range(buffers):
+            self._free.put(i)
+        self._ready = queue.Queue()
+        self._tracks = {}
+        self._camera_index = {}
+        self._stop_event = threading.Event()
+        self._consumer_thread = threading.Thread(target=self._consume, name='BatchConsumer', daemon=True)
+        self.batches = 0
+        self.frames = 0
+        self.dropped = 0  # every buffer busy in the consumer
+        self.overwritten = 0
+        self.scaled = 0
+        self.consumer_time = StageTimer('batch')
+
+    def _refresh_cameras(self):
+        tracks = {}
+        for camera, ring in self.camera_manager.get_frame_rings().items():
+            track = self._tracks.get(camera)
+            if track is None or track.ring.name != ring.name:
+                index = self._camera_index.get(camera)
+                if index is None:
+                    index = self._camera_index[camera] = len(self.cameras)
+                    self.cameras.append(camera)
+                track = _BatchTrack(index, ring)
+            tracks[camera] = track
+        self._tracks = tracks
+
+    def _put(self, slot, view):
+        """Copies or scales a ring view into a batch slot. Returns False for an unsupported frame."""
+        if view.shape == slot.shape:
+            np.copyto(slot, view)
+        elif view.ndim == 3 and view.shape[2] == slot.shape[2]:
+            cv2.resize(view, (slot.shape[1], slot.shape[0]), dst=slot, interpolation=cv2.INTER_AREA)
+            self.scaled += 1
+        else:
+            return False
+        return True
+
+    def run(self):
+        self._consumer_thread.start()
+        buffer = None
+        count = 0
+        first = 0.0
+        refreshed = 0.0
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            if now - refreshed >= 0.5:
+                self._refresh_cameras()
+                refreshed = now
+            for track in self._tracks.values():
+                ring = track.ring
+                latest = ring.latest_seq
+                if latest < track.last_seq:
+                    track.last_seq = 0  # a new writer numbering from 1
+                for seq in range(max(track.last_seq + 1, latest - ring.slots + 1), latest + 1):
+                    track.skip += 1
+                    if track.skip < self.every:
+                        continue
+                    track.skip = 0
+                    if buffer is None:
+                        try:
+                            buffer = self._free.get_nowait()
+                        except queue.Empty:
+                            self.dropped += 1
+                            continue
+                    entry = ring.read(seq)
+                    if entry is None:
+                        self.overwritten += 1
+                        continue
+                    _, timestamp, view = entry
+                    if not self._put(self._frames[buffer][count], view):
+                        continue
+                    if not ring.is_valid(seq):
+                        self.overwritten += 1
+                        continue
+                    meta = self._meta[buffer][count]
+                    meta['camera'] = track.index
+                    meta['seq'] = seq
+                    meta['timestamp'] = timestamp
+                    meta['height'] = view.shape[0]
+                    meta['width'] = view.shape[1]
+                    count += 1
+                    if count == 1:
+                        first = time.monotonic()
+                    if count == self.batch_size:
+                        self._ready.put((buffer, count))
+                        buffer, count = None, 0
+                track.last_seq = latest
+            if count and time.monotonic() - first >= self.timeout:
+                self._ready.put((buffer, count))
+                buffer, count = None, 0
+            self._stop_event.wait(self.poll_interval)
+        if count:
+            self._ready.put((buffer, count))
+        self._ready.put(None)
+        self._consumer_thread.join()
+
+    def _consume(self):
+        while True:
+            item = self._ready.get()
+            if item is None:
+                break
+            buffer, count = item
+            start = time.perf_counter()
+            try:
+                self.consumer(self._frames[buffer][:count], self._meta[buffer][:count], self.cameras)
+            except Exception:
+                log.exception("Batch consumer failed")
+            self.consumer_time.record(time.perf_counter() - start)
+            self.batches += 1
+            self.frames += count
+            self._free.put(buffer)
+
+    def stats(self):
+        """
+        Returns:
+            dict: 'batches', 'frames', 'dropped', 'overwritten', 'scaled', 'avg_batch' and 'consumer'
+                (StageTimer.summary() of the consumer calls).
+        """
+        return {
+            'batches': self.batches,
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'overwritten': self.overwritten,
+            'scaled': self.scaled,
+            'avg_batch': self.frames / self.batches if self.batches else 0.0,
+            'consumer': self.consumer_time.summary(),
+        }
+
+    def report(self):
+        s = self.stats()
+        c = s['consumer']
+        return (f"\n=== Frame batches ({self.batch_size} x {self.shape}, timeout {self.timeout * 1000:.0f} ms) ===\n"
+                f"Batches {s['batches']}, frames {s['frames']} (avg {s['avg_batch']:.1f} per batch), "
+                f"dropped {s['dropped']}, overwritten {s['overwritten']}, scaled {s['scaled']}\n"
+                f"Consumer p50 {c[0.5] * 1000:.1f} / p99 {c[0.99] * 1000:.1f} / max {c['max'] * 1000:.1f} ms\n"
+                f"==========================\n")
+
+    def stop(self):
+        """Hands the partial batch to the consumer, waits for it, then stops both threads."""
+        self._stop_event.set()
+        self.join()
+        print(self.report())
@@ -5,7 +5,12 @@ import socket
 import time
 from process_wrapper import run_rtsp_client
 import multiprocessing
-from utils import DEBUG, SOCKET_TIMEOUT
+from utils import DEBUG, SOCKET_TIMEOUT, FRAME_RING_SLOTS, FRAME_RING_MAX_SHAPE
+from frame_ring import FrameRing
+from protocol import ControlParser, decode_device_info, decode_ack, MSG_DEVICE_INFO, MSG_HEARTBEAT, MSG_ACK
+from camera_commands import CommandChannel
+from stream_control import RtspProcess
+from log import get_logger
 
 '''
 CameraClientHandler
@@ -20,10 +25,82 @@ CameraClientHandler
 負責以下事項:
 1. 
 '''
+
+log = get_logger('control')
+
+
+def launch_rtsp_process(cam_ip, port, mac, frame_callback, show_stream, frame_ring, rtsp_options):
+    """
+    Starts run_rtsp_client in a new process, the default `rtsp_launcher` of register_camera.
+
+    Returns:
+        RtspProcess: Handle of the started process and its command pipe.
+    """
+    parent_conn, child_conn = multiprocessing.Pipe()
+    p = multiprocessing.Process(
+        target=run_rtsp_client, args=(cam_ip, port, mac, frame_callback, show_stream),
+        kwargs={'frame_ring': frame_ring, 'options': rtsp_options, 'control': child_conn})
+    p.start()
+    child_conn.close()
+    return RtspProcess(p, parent_conn)
+
+
+def register_camera(camera_manager, ip_address, mac, cam_ip, port, frame_callback, show_stream=True,
+                    rtsp_options=None, rtsp_launcher=None, control=None):
+    """
+    Starts an RTSP client process for a newly registered camera and records it in the manager.
+
+    A board reconnecting from the same IP never ends up with two RTSP clients: a running process
+    that takes stream commands (see stream_control.py) is switched to the reported URL and kept,
+    any other one is terminated first. Every camera gets a FrameRing so the
+    main process can read its frames without pickling them. Shared by the threaded and asyncio
+    control planes; it blocks on `join()`, so async callers should run it in a worker thread.
+
+    Args:
+        camera_manager (CameraManager): Manager that owns the camera table.
+        ip_address (str): Source IP of the control connection (camera table key).
+        mac (str): MAC address reported by the camera.
+        cam_ip (str): Camera IP reported by the camera.
+        port (str): RTSP port reported by the camera.
+        frame_callback: User's callback, pickled into the RTSP process.
+        show_stream (bool): Whether the RTSP process opens a display window.
+        rtsp_options (dict, optional): Extra RTSPClientOptions arguments for the RTSP process.
+        rtsp_launcher (callable, optional): Replaces launch_rtsp_process, called with the same
+            arguments; it must return an object with is_alive(), terminate(), join() and pid.
+        control (CommandChannel, optional): Commands to the camera over its control connection.
+    """
+    # Reuse or terminate the existing process if any, its frame ring is reused by the new process
+    frame_ring = None
+    existing_camera = camera_manager.get_camera(ip_address)
+    if existing_camera:
+        existing_process = existing_camera['process']
+        if existing_process and existing_process.is_alive():
+            if hasattr(existing_process, 'switch') and existing_process.switch(cam_ip, port, mac):
+                camera_manager.add_camera(ip_address, mac, cam_ip, port, existing_process,
+                                          existing_camera.get('frame_ring'), control)
+                log.info("RTSP client of %s switched to %s:%s", mac, cam_ip, port)
+                return
+            existing_process.terminate()
+            existing_process.join()
+        frame_ring = existing_camera.get('frame_ring')
+
+    if frame_ring is None and FRAME_RING_SLOTS > 0:
+        frame_ring = FrameRing.create(slots=FRAME_RING_SLOTS, max_shape=FRAME_RING_MAX_SHAPE)
+
+    # Start RTSP client in a new process
+    launcher = rtsp_launcher or launch_rtsp_process
+    p = launcher(cam_ip, port, mac, frame_callback, show_stream, frame_ring, rtsp_options)
+
+    # Add camera to manager
+    camera_manager.add_camera(ip_address, mac, cam_ip, port, p, frame_ring, control)
+    log.info("RTSP client started for %s (%s:%s)", mac, cam_ip, port)
+
+
 class CameraClientHandler(threading.Thread):
     """Handles communication with a connected camera client."""
 
-    def __init__(self, client_socket, addr, camera_manager, frame_callback, show_stream=True):
+    def __init__(self, client_socket, addr, camera_manager, frame_callback, show_stream=True, rtsp_options=None,
+                 rtsp_launcher=None):
         super().__init__()
         self.client_socket = client_socket
         self.addr = addr
@@ -33,69 +110,66 @@ class CameraClientHandler(threading.Thread):
         self.mac = None
         self.frame_callback = frame_callback
         self.show_stream = show_stream
+        self.rtsp_options = rtsp_options
+        self.rtsp_launcher = rtsp_launcher
+        self.control = None  # CommandChannel, created with the first device info
+        self._send_lock = threading.Lock()
+
+    def _write(self, data):
+        with self._send_lock:
+            self.client_socket.sendall(data)
 
     def run(self):
-        print(f"New connection from {self.addr}")
+        log.info("New connection from %s", self.addr)
         self.client_socket.settimeout(SOCKET_TIMEOUT)
-        buffer = ''
+        parser = ControlParser()
 
         try:
             while not self.stop_event.is_set():
                 try:
-                    ## TODO: 未來應定義 message frame 使訊息不會被 cut
-                    data = self.client_socket.recv(1024).decode()
+                    data = self.client_socket.recv(1024)
                     if not data:
-                        continue
-
-                    buffer += data
-
-                    while '\r\n' in buffer:
-                        line, buffer = buffer.split('\r\n', 1)
-                        line = line.strip()
-                        if not line:
-                            continue
+                        break  # peer closed the connection
 
-                        if line == "AliveHeartBeat":
+                    for msg in parser.feed(data):
+                        if msg.msg_type == MSG_HEARTBEAT:
                             self.camera_manager.update_heartbeat(self.ip_address)
                             if DEBUG:
-                              print(f"Heartbeat received from {self.mac} at {self.ip_address}")
-                        else:
-                            print(f"Received from {self.addr}: {line}")
-                            parts = line.split(',')
-                            if len(parts) == 3:
-                                mac, cam_ip, port = parts
-
-                                # Terminate existing process if any
-                                existing_camera = self.camera_manager.get_camera(self.ip_address)
-                                if existing_camera:
-                                    existing_process = existing_camera['process']
-                                    if existing_process and existing_process.is_alive():
-                                        existing_process.terminate()
-                                        existing_process.join()
-
-                                # Start RTSP client in a new process
-                                p = multiprocessing.Process(
-                                    target=run_rtsp_client, args=(cam_ip, port, mac, self.frame_callback, self.show_stream))
-                                p.start()
-
-                                # Add camera to manager
-                                self.camera_manager.add_camera(
-                                    self.ip_address, mac, cam_ip, port, p)
-                                print(f"RTSP client started for {mac} ({cam_ip}:{port})")
-                            else:
-                                print(f"Invalid data format from {self.addr}: {line}")
+                              log.debug("Heartbeat received from %s at %s", self.mac, self.ip_address)
+                        elif msg.msg_type == MSG_DEVICE_INFO:
+                            try:
+                                mac, cam_ip, port = decode_device_info(msg)
+                            except ValueError as e:
+                                log.warning("Invalid data format from %s: %s", self.addr, e)
+                                continue
+                            log.info("Received from %s (%s): %s,%s,%s", self.addr, parser.mode, mac, cam_ip, port)
+                            self.mac = mac
+                            if self.control is None:
+                                self.control = CommandChannel(self._write, parser.mode, name=self.ip_address)
+                            register_camera(self.camera_manager, self.ip_address, mac, cam_ip, port,
+                                            self.frame_callback, self.show_stream, self.rtsp_options,
+                                            self.rtsp_launcher, self.control)
+                        elif msg.msg_type == MSG_ACK and self.control is not None:
+                            try:
+                                self.control.on_ack(decode_ack(msg))
+                            except ValueError as e:
+                                log.warning("Invalid ack from %s: %s", self.addr, e)
+                        elif DEBUG:
+                            log.debug("Unhandled message 0x%02X from %s", msg.msg_type, self.addr)
 
                 except socket.timeout:
                     continue
                 except Exception as e:
-                    print(f"Receive error from {self.addr}: {e}")
+                    log.warning("Receive error from %s: %s", self.addr, e)
                     break
         except Exception as e:
-            print(f"Error with client {self.addr}: {e}")
+            log.error("Error with client %s: %s", self.addr, e)
         finally:
+            if self.control is not None:
+                self.control.close()
             self.camera_manager.remove_camera(self.ip_address)
             self.client_socket.close()
-            print(f"Disconnected from {self.addr}")
+            log.info("Disconnected from %s", self.addr)
 
     def stop(self):
         self.stop_event.set()
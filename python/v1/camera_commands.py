@@ -0,0 +1,192 @@
+# camera_commands.py
+
+import threading
+import time
+from collections import OrderedDict
+from protocol import encode_command, PARAM_IDS, ACK_OK, ACK_CLAMPED, ACK_STATUSES, MODE_BINARY
+from log import get_logger
+
+'''
+Camera commands
+
+server 與 camera 的控制連線原本只有 camera -> server 的方向 (註冊與 heartbeat)。CommandChannel 在同一條連線上
+送出 COMMAND (protocol.py: fps、bitrate、resolution)，並以 command id 對應 camera 回覆的 ACK:
+- 每條連線一個 channel，收到 device info 時由 CameraClientHandler / AsyncServer 建立，存在 CameraManager 的
+  camera entry ('control')，連線的 ControlParser.mode 決定送 binary frame 還是文字行
+- send() 由任何 thread 呼叫: 實際的寫入由 server 提供的 write 函式負責 (threaded server 以 lock 保護 sendall，
+  asyncio server 交給 event loop 的 writer.write)，不等 ACK
+- on_ack() 由收到 ACK 的 handler 呼叫，記錄 camera 實際套用的值 (settings) 並喚醒 wait()
+- timeout 秒內沒有 ACK 的 command 記為 timeout；連續 MAX_UNANSWERED 個都沒有回覆時視為不支援 command 的舊版
+  RTSP.ino (supported 為 False)，rate_control.py 不再送 command 給它
+'''
+
+COMMAND_TIMEOUT = 5.0
+MAX_UNANSWERED = 3
+RESULTS = ('acked', 'clamped', 'rejected', 'timeout')
+KEEP_ACKS = 64  # answered commands wait() still finds
+
+log = get_logger('control')
+
+
+class _PendingCommand:
+    """A command waiting for its ACK."""
+
+    __slots__ = ('param', 'value', 'sent', 'event', 'ack')
+
+    def __init__(self, param, value, sent):
+        self.param = param
+        self.value = value
+        self.sent = sent
+        self.event = threading.Event()
+        self.ack = None
+
+
+class CommandChannel:
+    """Commands to one camera over its control connection, matched with the camera's acknowledgements."""
+
+    def __init__(self, write, mode=MODE_BINARY, timeout=COMMAND_TIMEOUT, max_unanswered=MAX_UNANSWERED, name=''):
+        """
+        Initializes the CommandChannel.
+
+        Args:
+            write (callable): write(data) queues bytes on the connection, callable from any thread. It may
+                raise OSError or RuntimeError once the connection is gone.
+            mode (str): protocol.MODE_BINARY or MODE_TEXT, the ControlParser.mode of the connection.
+            timeout (float): Seconds after which a command without ACK counts as unanswered.
+            max_unanswered (int): Consecutive unanswered commands after which the camera is taken
+                to not support commands.
+            name (str): Camera name in log messages.
+        """
+        self._write = write
+        self.mode = mode
+        self.timeout = timeout
+        self.max_unanswered = max_unanswered
+        self.name = name
+        self.settings = {}  # param name -> value the camera acknowledged
+        self.counts = dict.fromkeys(RESULTS, 0)
+        self.sent = 0
+        self.unanswered = 0  # consecutive timeouts
+        self.closed = False
+        self._lock = threading.Lock()
+        self._pending = {}  # command id -> _PendingCommand
+        self._acks = OrderedDict()  # command id -> CommandAck of the last KEEP_ACKS answered commands
+        self._next_id = 1
+
+    @property
+    def supported(self):
+        """False once max_unanswered commands in a row got no ACK (firmware without command support)."""
+        return self.unanswered < self.max_unanswered
+
+    def send(self, param, value):
+        """
+        Sends a command without waiting for its ACK.
+
+        Args:
+            param (str): 'fps', 'bitrate' (bit/s) or 'resolution'.
+            value (int | tuple): The new value, (width, height) for 'resolution'.
+
+        Returns:
+            int: The command id to wait() for, or None if the connection is closed.
+
+        Raises:
+            ValueError: If the param is unknown.
+        """
+        if param not in PARAM_IDS:
+            raise ValueError(f"Unknown command param {param!r}, expected one of {tuple(PARAM_IDS)}")
+        with self._lock:
+            if self.closed:
+                return None
+            self._expire(time.monotonic())
+            command_id = self._next_id
+            self._next_id = command_id % 0xFFFF + 1
+            self._pending[command_id] = _PendingCommand(param, value, time.monotonic())
+            self._acks.pop(command_id, None)  # ids wrap around after 65535 commands
+            self.sent += 1
+        try:
+            self._write(encode_command(command_id, PARAM_IDS[param], value, self.mode))
+        except (OSError, RuntimeError) as e:
+            log.warning("Cannot send %s=%s to %s: %s", param, value, self.name, e)
+            with self._lock:
+                self._pending.pop(command_id, None)
+            self.close()
+            return None
+        log.debug("Sent command %d %s=%s to %s", command_id, param, value, self.name)
+        return command_id
+
+    def on_ack(self, ack):
+        """Completes the command an ACK (protocol.CommandAck) answers."""
+        with self._lock:
+            pending = self._pending.pop(ack.command_id, None)
+            if pending is None or PARAM_IDS[pending.param] != ack.param:
+                log.debug("Unexpected ack %s from %s", ack, self.name)
+                return
+            self.unanswered = 0
+            if ack.status == ACK_OK:
+                self.counts['acked'] += 1
+            elif ack.status == ACK_CLAMPED:
+                self.counts['clamped'] += 1
+            else:
+                self.counts['rejected'] += 1
+            if ack.status in (ACK_OK, ACK_CLAMPED):
+                self.settings[pending.param] = ack.value
+            self._acks[ack.command_id] = ack
+            if len(self._acks) > KEEP_ACKS:
+                self._acks.popitem(last=False)
+        if ack.status not in (ACK_OK, ACK_CLAMPED):
+            log.warning("%s rejected %s=%s: %s", self.name, pending.param, pending.value, ACK_STATUSES[ack.status])
+        pending.ack = ack
+        pending.event.set()
+
+    def wait(self, command_id, timeout=None):
+        """
+        Waits for the ACK of a command.
+
+        Args:
+            command_id (int): Returned by send().
+            timeout (float, optional): Seconds to wait, the channel's timeout when None.
+
+        Returns:
+            protocol.CommandAck: The ACK, or None without one in time.
+        """
+        with self._lock:
+            pending = self._pending.get(command_id)
+            if pending is None:
+                return self._acks.get(command_id)
+        pending.event.wait(self.timeout if timeout is None else timeout)
+        return pending.ack
+
+    def pending(self, param=None):
+        """Whether a command (for `param`) is still waiting for its ACK."""
+        with self._lock:
+            self._expire(time.monotonic())
+            return any(param is None or pending.param == param for pending in self._pending.values())
+
+    def _expire(self, now):
+        """Counts commands older than timeout as unanswered, the lock must be held."""
+        for command_id, pending in list(self._pending.items()):
+            if now - pending.sent >= self.timeout:
+                del self._pending[command_id]
+                self.counts['timeout'] += 1
+                self.unanswered += 1
+                pending.event.set()
+                if self.unanswered == self.max_unanswered:
+                    log.warning("%s answered none of the last %d commands, taking it as not supporting them",
+                                self.name, self.unanswered)
+
+    def close(self):
+        """Marks the connection as gone and wakes up every wait()."""
+        with self._lock:
+            self.closed = True
+            pending, self._pending = list(self._pending.values()), {}
+        for command in pending:
+            command.event.set()
+
+    def stats(self):
+        """
+        Returns:
+            dict: 'sent', 'pending', the RESULTS counts, 'supported' and 'settings' (acknowledged values).
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+            return dict(self.counts, sent=self.sent, pending=len(self._pending), supported=self.supported,
+                        settings=dict(self.settings))
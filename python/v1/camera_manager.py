@@ -1,98 +1,240 @@
 # camera_manager.py
 
+import heapq
 import threading
 import time
 from datetime import datetime
+from failure_detector import make_detector_factory, FIXED
+from log import get_logger
+
+'''
+CameraManager
+
+Heartbeat 逾時以 deadline heap 處理:
+- 每台 camera 有一個 failure detector (failure_detector.py)，每次 heartbeat 只重新計算自己的 deadline，
+  並把 (deadline, ip) 推進 heap，O(log n)；舊的 entry 不移除，取出時發現 deadline 已經不是最新的就略過
+- check_heartbeats 只睡到 heap 中最早的 deadline，不再每 10 秒在 lock 內掃描所有 camera，
+  逾時的 camera 最多晚幾毫秒就會被發現
+- terminate()/join() RTSP 進程在 camera_lock 之外執行，不會擋住其他 camera 的 heartbeat；逾時的 camera 在各自的
+  thread 中釋放，同時斷線的多台 camera 不會讓 check_heartbeats 晚發現其他 camera 逾時
+- 逾時的 camera 連控制連線一起關閉 (disconnect_client)，RTSP.ino 發現斷線後會重新連線並註冊
+'''
+
+log = get_logger('camera_manager')
+
 
 class CameraManager:
     """Manages connected cameras and their heartbeats."""
 
-    def __init__(self, client_threads, timeout=30):
+    def __init__(self, client_threads, timeout=30, display=None, failure_detector=FIXED):
+        """
+        Initializes the CameraManager.
+
+        Args:
+            client_threads (dict): Control connections of the server, keyed by ip.
+            timeout (float): Heartbeat timeout of the 'fixed' detector, fallback of 'phi'.
+            display (MosaicDisplay, optional): Preview showing every camera's frame ring.
+            failure_detector (str | callable): 'fixed', 'phi' (see failure_detector.py) or a
+                function returning a detector for each camera.
+        """
         self.connected_cameras = {}
         self.camera_lock = threading.Lock()
         self.timeout = timeout  # Heartbeat timeout
         self.stop_event = threading.Event()
         self.client_threads = client_threads
+        self.display = display  # MosaicDisplay showing every camera's frame ring, optional
+        self.detector_factory = make_detector_factory(failure_detector, timeout)
+        self._deadlines = []  # heap of (deadline, ip), entries are stale once the camera moved on
+        self._reschedule = threading.Event()  # an earlier deadline than the checker waits for
+
+    def add_camera(self, ip_address, mac, cam_ip, port, process, frame_ring=None, control=None):
+        """
+        Adds or updates a camera in the connected_cameras dictionary.
 
-    def add_camera(self, ip_address, mac, cam_ip, port, process):
-        """Adds or updates a camera in the connected_cameras dictionary."""
+        `control` is the CommandChannel (camera_commands.py) of the camera's control connection.
+        """
+        detector = self.detector_factory()
+        detector.heartbeat(time.monotonic())
         with self.camera_lock:
-            self.connected_cameras[ip_address] = {
+            info = self.connected_cameras[ip_address] = {
                 'mac': mac,
                 'ip': cam_ip,
                 'port': port,
                 'last_heartbeat': time.time(),
-                'process': process  # RTSP process handle
+                'process': process,  # RTSP process handle
+                'frame_ring': frame_ring,  # FrameRing shared with the RTSP process
+                'control': control,  # CommandChannel to the camera's firmware
+                'detector': detector,  # failure detector fed by the heartbeats
+                'deadline': None
             }
+            self._schedule(ip_address, info)
+        if self.display and frame_ring:
+            self.display.add_camera(ip_address, frame_ring.name, f"{mac} {cam_ip}")
+
+    @staticmethod
+    def release_camera(info):
+        """
+        Stops the RTSP process of a camera entry and frees its frame ring.
+
+        terminate() of the stream_control.py handles is a graceful stop that saves queued frames
+        within STREAM_DRAIN_TIMEOUT; plain processes are terminated.
+        """
+        process = info['process']
+        if process and process.is_alive():
+            process.terminate()
+            process.join()
+        if info.get('frame_ring'):
+            info['frame_ring'].close()
+
+    def _schedule(self, ip_address, info):
+        """Pushes the camera's next deadline, camera_lock must be held."""
+        deadline = info['detector'].deadline()
+        info['deadline'] = deadline
+        heapq.heappush(self._deadlines, (deadline, ip_address))
+        if self._deadlines[0][1] == ip_address and self._deadlines[0][0] == deadline:
+            self._reschedule.set()  # earlier than what the checker sleeps until
 
     def remove_camera(self, ip_address):
         """Removes a camera from the connected_cameras dictionary."""
         with self.camera_lock:
-            if ip_address in self.connected_cameras:
-                mac = self.connected_cameras[ip_address]['mac']
-                process = self.connected_cameras[ip_address]['process']
-                if process and process.is_alive():
-                    process.terminate()
-                    process.join()
-                del self.connected_cameras[ip_address]
-                print(f"Camera {mac} at {ip_address} removed.")
+            info = self.connected_cameras.pop(ip_address, None)
+        if info is not None:
+            # outside the lock, joining the process must not hold up other cameras' heartbeats
+            self.release_camera(info)
+            if self.display:
+                self.display.remove_camera(ip_address)
+            log.info("Camera %s at %s removed.", info['mac'], ip_address)
 
     def update_heartbeat(self, ip_address):
-        """Updates the last heartbeat time of a camera."""
+        """Updates the last heartbeat time of a camera and reschedules its deadline."""
+        now = time.monotonic()
         with self.camera_lock:
-            if ip_address in self.connected_cameras:
-                self.connected_cameras[ip_address]['last_heartbeat'] = time.time()
+            info = self.connected_cameras.get(ip_address)
+            if info is not None:
+                info['last_heartbeat'] = time.time()
+                info['detector'].heartbeat(now)
+                self._schedule(ip_address, info)
+
+    def control_camera(self, ip_address, command, **kwargs):
+        """
+        Sends a stream command (stream_control.COMMANDS) to a camera's RTSP process, e.g.
+        control_camera(ip, 'set_options', show_fps=False) or control_camera(ip, 'pause').
+
+        Returns:
+            bool: False if the camera is unknown, its process takes no commands, or it is gone.
+        """
+        camera = self.get_camera(ip_address)
+        process = camera['process'] if camera else None
+        if process is None or not hasattr(process, 'send'):
+            return False
+        return process.send(command, **kwargs)
+
+    def command_camera(self, ip_address, param, value):
+        """
+        Sends a rate command to a camera's firmware over its control connection, e.g.
+        command_camera(ip, 'fps', 15), command_camera(ip, 'bitrate', 2_000_000) or
+        command_camera(ip, 'resolution', (1280, 720)).
+
+        Returns:
+            int: Command id, wait for the ACK with get_camera(ip)['control'].wait(id); None if the
+                camera is unknown or its connection is gone.
+        """
+        camera = self.get_camera(ip_address)
+        control = camera.get('control') if camera else None
+        if control is None:
+            return None
+        return control.send(param, value)
 
     def get_camera(self, ip_address):
         """Retrieves camera information."""
         with self.camera_lock:
             return self.connected_cameras.get(ip_address)
 
+    def get_cameras(self):
+        """Returns {ip_address: copy of the camera entry} without holding the lock afterwards."""
+        with self.camera_lock:
+            return {ip: dict(info) for ip, info in self.connected_cameras.items()}
+
+    def get_frame_rings(self):
+        """Returns {ip_address: FrameRing} for every camera that shares frames."""
+        with self.camera_lock:
+            return {ip: info['frame_ring'] for ip, info in self.connected_cameras.items()
+                    if info.get('frame_ring')}
+
     def check_heartbeats(self):
-        """Checks the heartbeats of connected cameras and removes inactive ones."""
+        """Removes cameras whose heartbeat deadline passed, sleeping until the earliest deadline."""
         while not self.stop_event.is_set():
-            current_time = time.time()
+            # cleared before looking at the heap, so a deadline scheduled meanwhile wakes us again
+            self._reschedule.clear()
+            expired = []
             with self.camera_lock:
-                for ip_address in list(self.connected_cameras.keys()):
-                    last_heartbeat = self.connected_cameras[ip_address]['last_heartbeat']
-                    if current_time - last_heartbeat > self.timeout:
-                        # No heartbeat received within the timeout period
-                        mac = self.connected_cameras[ip_address]['mac']
-                        print(f"[{mac}] at {ip_address} timed out. Terminating RTSP process.")
-                        process = self.connected_cameras[ip_address]['process']
-                        # FIXME: should call stop instead of terminate -> cause jpeg losing
-                        if process and process.is_alive():
-                            process.terminate()
-                            process.join()
-                        del self.connected_cameras[ip_address]
-                        
-                        ## XXX: currently stuck here, remove thread also
-                        # if ip_address in self.client_threads:
-                        #     self.client_threads[ip_address].stop()
-                        #     self.client_threads[ip_address].join()
-                            
-            if self.stop_event.wait(10):
-                break  # stop_event is set, exit the loop
+                now = time.monotonic()
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    deadline, ip_address = heapq.heappop(self._deadlines)
+                    info = self.connected_cameras.get(ip_address)
+                    if info is not None and info['deadline'] == deadline:
+                        expired.append((ip_address, self.connected_cameras.pop(ip_address)))
+                # drop stale entries once they outnumber the live ones
+                if len(self._deadlines) > 4 * len(self.connected_cameras) + 64:
+                    self._deadlines = [(info['deadline'], ip) for ip, info in self.connected_cameras.items()]
+                    heapq.heapify(self._deadlines)
+                next_deadline = self._deadlines[0][0] if self._deadlines else None
+
+            for ip_address, info in expired:
+                # No heartbeat received within the deadline
+                log.warning("[%s] at %s timed out after %.1f s without heartbeat (%s). Terminating RTSP process.",
+                            info['mac'], ip_address, now - info['detector'].last, info['detector'].describe())
+                # a graceful stop takes up to STREAM_DRAIN_TIMEOUT, the other deadlines must not wait for it
+                threading.Thread(target=self._release_expired, args=(ip_address, info),
+                                 name=f'Release-{ip_address}', daemon=True).start()
+
+            wait = None if next_deadline is None else max(0.0, next_deadline - time.monotonic())
+            self._reschedule.wait(wait)
         print('Heartbeat checking thread terminated!')
 
+    def _release_expired(self, ip_address, info):
+        """Releases a camera that timed out and closes its control connection."""
+        # RtspProcess / PooledRtspProcess stop gracefully and save the queued frames first
+        self.release_camera(info)
+        if self.display:
+            self.display.remove_camera(ip_address)
+
+        # heartbeats of the old connection are ignored from now on, the firmware only
+        # registers again once it sees the connection closed
+        self.disconnect_client(ip_address)
+
+    def disconnect_client(self, ip_address):
+        """
+        Closes the control connection of a camera without waiting for it: a CameraClientHandler
+        stops within SOCKET_TIMEOUT, an AsyncServer connection task is cancelled on its event loop.
+        """
+        client = self.client_threads.get(ip_address)
+        if client is None:
+            return
+        if hasattr(client, 'stop'):
+            client.stop()
+        else:
+            client.get_loop().call_soon_threadsafe(client.cancel)
+
     def update_camera_table(self, update_interval=5):
         """Periodically updates and prints the camera table."""
         while not self.stop_event.is_set():
-            with self.camera_lock:
-                if self.connected_cameras:
-                    print("\n=== Connected Cameras ===")
-                    print(f"{'Process ID':<12} {'IP':<15} {'RTSP URL':<30} {'Heartbeat':<20} {'MAC':<20}")
-                    print("-" * 100)
-                    for ip, info in self.connected_cameras.items():
-                        process_id = info['process'].pid if info['process'] else 'N/A'
-                        ip_addr = info['ip']
-                        rtsp_url = f"rtsp://{info['ip']}:{info['port']}"
-                        heartbeat_time = datetime.fromtimestamp(info['last_heartbeat']).strftime('%Y-%m-%d %H:%M:%S')
-                        mac = info['mac']
-                        print(f"{process_id:<12} {ip_addr:<15} {rtsp_url:<30} {heartbeat_time:<20} {mac:<20}")
-                    print("==========================\n")
-                else:
-                    print("\nNo cameras connected.\n")
+            # printing happens on a snapshot, heartbeats are not held up by a slow console
+            cameras = self.get_cameras()
+            if cameras:
+                print("\n=== Connected Cameras ===")
+                print(f"{'Process ID':<12} {'IP':<15} {'RTSP URL':<30} {'Heartbeat':<20} {'MAC':<20}")
+                print("-" * 100)
+                for ip, info in cameras.items():
+                    process_id = info['process'].pid if info['process'] else 'N/A'
+                    ip_addr = info['ip']
+                    rtsp_url = f"rtsp://{info['ip']}:{info['port']}"
+                    heartbeat_time = datetime.fromtimestamp(info['last_heartbeat']).strftime('%Y-%m-%d %H:%M:%S')
+                    mac = info['mac']
+                    print(f"{process_id:<12} {ip_addr:<15} {rtsp_url:<30} {heartbeat_time:<20} {mac:<20}")
+                print("==========================\n")
+            else:
+                print("\nNo cameras connected.\n")
             if self.stop_event.wait(update_interval):
                 break
         print('Camera table update thread terminated!')
@@ -100,3 +242,4 @@ class CameraManager:
     def stop(self):
         """Signals all threads to stop."""
         self.stop_event.set()
+        self._reschedule.set()
@@ -0,0 +1,369 @@
+# encoder_pool.py
+
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+import cv2
+from frame_archive import FrameArchiveWriter, SEGMENT_BYTES
+from frame_queue import BoundedFrameQueue, DROP_OLDEST
+from log import get_logger
+from profiling import get_profiler
+
+'''
+EncoderPool
+
+所有 camera 共用的 JPEG encode + 寫檔 worker pool:
+- encoder threads: 呼叫 cv2.imencode (會釋放 GIL，可以真正平行)，任何 camera 的 job 都可以被任一 worker 處理
+- job queue: 每台 camera 有上限的 BoundedFrameQueue，encoder 落後時依 policy 丟 frame，記憶體用量有上限
+- writer thread: 將 encode 好的 bytes 批次寫入檔案，目錄只建立一次；設定 archive_dir 時改為追加到每台 camera
+  的 FrameArchive (frame_archive.py)，不再每張 frame 建立一個檔案，每批寫完 flush 一次
+- frame_index: 寫完的 frame 交給 FrameIndexWriter (frame_index.py) 記錄到 SQLite，可依 camera / 時間查詢
+- stats(): 每台 camera 的 encode latency 與 throughput，用來依照 CPU 核心數調整 worker 數量
+
+SaveRequestDispatcher 則在主進程接收 RTSP 子進程送來的 save request (ring name, seq, filepath)，
+從 FrameRing 複製該 frame 後交給 EncoderPool，frame 本身不需要經過 pickle。
+'''
+
+log = get_logger('encoder')
+
+# what is known about a submitted frame besides its pixels, for the archive and the frame index
+FrameMeta = namedtuple('FrameMeta', ['seq', 'timestamp', 'mac', 'session', 'scores'])
+
+
+class CameraEncodeStats:
+    """Encode counters of one camera."""
+
+    def __init__(self):
+        self.frames = 0
+        self.failed = 0
+        self.bytes = 0
+        self.encode_total = 0.0
+        self.encode_max = 0.0
+        self.first_time = None
+        self.last_time = None
+
+    def as_dict(self):
+        elapsed = (self.last_time - self.first_time) if self.frames > 1 else 0.0
+        return {
+            'frames': self.frames,
+            'failed': self.failed,
+            'bytes': self.bytes,
+            'encode_avg_ms': self.encode_total / self.frames * 1000 if self.frames else 0.0,
+            'encode_max_ms': self.encode_max * 1000,
+            'fps': (self.frames - 1) / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+class EncoderPool:
+    """JPEG encoder threads and a batching file writer shared by every camera."""
+
+    def __init__(self, num_workers=None, jpeg_quality=95, write_batch=16, flush_interval=0.5,
+                 queue_size=8, queue_policy=DROP_OLDEST, queue_timeout=0.1, archive_dir=None,
+                 archive_segment_bytes=SEGMENT_BYTES, frame_index=None):
+        """
+        Initializes the EncoderPool.
+
+        Args:
+            num_workers (int, optional): Encoder threads, defaults to the CPU core count.
+            jpeg_quality (int): cv2.IMWRITE_JPEG_QUALITY, 95 is the cv2.imwrite default.
+            write_batch (int): Encoded frames written per batch.
+            flush_interval (float): Seconds before a partial batch is written anyway.
+            queue_size (int): Frames waiting for an encoder, per camera.
+            queue_policy (str): What to drop when a camera's queue is full, see frame_queue.POLICIES.
+            queue_timeout (float): Seconds submit() may wait under the 'block' policy.
+            archive_dir (str, optional): Append frames to a FrameArchive in archive_dir/<camera>
+                instead of writing each one to its filepath.
+            archive_segment_bytes (int): Segment size of the archives.
+            frame_index (FrameIndexWriter, optional): Records every saved frame; started and stopped
+                by the caller.
+        """
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), int(jpeg_quality)]
+        self.write_batch = write_batch
+        self.flush_interval = flush_interval
+        self.jobs = BoundedFrameQueue(maxsize=queue_size, policy=queue_policy, timeout=queue_timeout)
+        # bounded too: when the disk falls behind, encoders block here and the job queue policy kicks in
+        self.writes = queue.Queue(maxsize=write_batch * 4)
+        self.workers = []
+        self.writer_thread = None
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        self._created_dirs = set()
+        self.archive_dir = archive_dir
+        self.archive_segment_bytes = archive_segment_bytes
+        self._archives = {}  # camera -> FrameArchiveWriter, only used by the writer thread
+        self.frame_index = frame_index
+        self._start_time = None
+        self.profiler = get_profiler()
+
+    def start(self):
+        """Starts the encoder and writer threads."""
+        self._start_time = time.time()
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._encode_worker, name=f'Encoder-{i}', daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        self.writer_thread = threading.Thread(target=self._write_worker, name='EncoderWriter',
+                                              daemon=True)
+        self.writer_thread.start()
+
+    def submit(self, frame, filepath, camera, seq=None, timestamp=None, mac=None, session=None, scores=None):
+        """
+        Queues a frame to be encoded and written to `filepath`, or appended to the camera's archive.
+
+        Args:
+            frame (numpy.ndarray): Frame owned by the pool from now on, do not modify it.
+            filepath (str): Destination .jpg path, unused in archive mode.
+            camera (str): Camera key of the queue and the statistics (ip address).
+            seq (int, optional): The frame's seq, kept in the archive index.
+            timestamp (float, optional): Capture time kept in the archive index, now when None.
+            mac (str, optional): Camera MAC address, for the frame index.
+            session (int, optional): Connection the frame came from, for the frame index.
+            scores (dict, optional): Per-frame scores, for the frame index.
+
+        Returns:
+            bool: False if the queue policy dropped this frame.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        return self.jobs.put((frame, filepath, camera, FrameMeta(seq, timestamp, mac, session, scores)), key=camera)
+
+    def _encode_worker(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break  # closed and drained
+            frame, filepath, camera, meta = job
+            try:
+                start = time.perf_counter()
+                success, encoded = cv2.imencode('.jpg', frame, self.encode_params)
+                elapsed = time.perf_counter() - start
+                self._record(camera, elapsed, len(encoded) if success else None)
+                if success:
+                    self.writes.put((filepath, encoded, camera, meta))
+                else:
+                    log.warning("Failed to encode frame for %s", filepath)
+            except Exception:
+                # e.g. a channel count or dtype JPEG cannot take, the worker must live on for stop()'s join
+                log.exception("Failed to encode frame for %s", filepath)
+                self._record(camera, 0.0, None)
+            finally:
+                self.jobs.task_done()
+
+    def _record(self, camera, elapsed, size):
+        with self._stats_lock:
+            stats = self._stats.get(camera)
+            if stats is None:
+                stats = self._stats[camera] = CameraEncodeStats()
+            if size is None:
+                stats.failed += 1
+                return
+            prof_encode = self.profiler.stage('encode', camera)  # shared by the encoder threads
+            if prof_encode.sample():
+                prof_encode.record(elapsed)
+            now = time.time()
+            if stats.first_time is None:
+                stats.first_time = now
+            stats.last_time = now
+            stats.frames += 1
+            stats.bytes += size
+            stats.encode_total += elapsed
+            stats.encode_max = max(stats.encode_max, elapsed)
+
+    def _write_worker(self):
+        batch = []
+        running = True
+        while running:
+            try:
+                item = self.writes.get(timeout=self.flush_interval)
+                if item is None:
+                    running = False
+                else:
+                    batch.append(item)
+                    # drain whatever is already waiting, without blocking
+                    while len(batch) < self.write_batch:
+                        item = self.writes.get_nowait()
+                        if item is None:
+                            running = False
+                            break
+                        batch.append(item)
+            except queue.Empty:
+                pass
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception:
+                    # the encoders block on the bounded writes queue once this thread is gone
+                    log.exception("Failed to write a batch of %d frame(s)", len(batch))
+                batch = []
+
+    def _write_batch(self, batch):
+        if self.archive_dir is not None:
+            self._append_batch(batch)
+            return
+        for filepath, encoded, camera, meta in batch:
+            save_dir = os.path.dirname(filepath)
+            prof_write = self.profiler.stage('write', camera)
+            timed = prof_write.start()
+            try:
+                if save_dir not in self._created_dirs:
+                    os.makedirs(save_dir, exist_ok=True)
+                    self._created_dirs.add(save_dir)
+                with open(filepath, 'wb') as f:
+                    f.write(encoded)
+            except OSError as e:
+                log.warning("Failed to save frame to %s: %s", filepath, e)
+                continue
+            finally:
+                prof_write.stop(timed)
+            if self.frame_index is not None:
+                self.frame_index.add(meta.mac, camera, meta.session, meta.seq, meta.timestamp, filepath,
+                                     size=len(encoded), scores=meta.scores)
+
+    def _append_batch(self, batch):
+        touched = set()
+        for _, encoded, camera, meta in batch:
+            prof_write = self.profiler.stage('write', camera)
+            timed = prof_write.start()
+            try:
+                archive = self._archives.get(camera)
+                if archive is None:
+                    archive = self._archives[camera] = FrameArchiveWriter(
+                        os.path.join(self.archive_dir, camera), self.archive_segment_bytes)
+                archive_seq = archive.append(encoded, meta.timestamp, meta.seq)
+                touched.add(archive)
+            except OSError as e:
+                log.warning("Failed to append frame of %s to its archive: %s", camera, e)
+                continue
+            finally:
+                prof_write.stop(timed)
+            if self.frame_index is not None:
+                self.frame_index.add(meta.mac, camera, meta.session, meta.seq, meta.timestamp, archive.data_path,
+                                     archive.last_offset, len(encoded), archive_seq, meta.scores)
+        for archive in touched:
+            try:
+                archive.flush()
+            except OSError as e:
+                log.warning("Failed to flush archive %s: %s", archive.directory, e)
+
+    def stats(self):
+        """Returns {camera: stats dict} plus a 'total' entry."""
+        with self._stats_lock:
+            result = {camera: stats.as_dict() for camera, stats in self._stats.items()}
+        for camera, queue_stats in self.jobs.stats().items():
+            result.setdefault(camera, CameraEncodeStats().as_dict()).update(queue_stats)
+        frames = sum(s['frames'] for s in result.values())
+        elapsed = time.time() - self._start_time if self._start_time else 0.0
+        result['total'] = {
+            'frames': frames,
+            'failed': sum(s['failed'] for s in result.values()),
+            'bytes': sum(s['bytes'] for s in result.values()),
+            'encode_avg_ms': (sum(s['encode_avg_ms'] * s['frames'] for s in result.values()) / frames
+                              if frames else 0.0),
+            'encode_max_ms': max((s['encode_max_ms'] for s in result.values()), default=0.0),
+            'fps': frames / elapsed if elapsed > 0 else 0.0,
+        }
+        for key in ('enqueued', 'dropped', 'depth'):
+            result['total'][key] = sum(s.get(key, 0) for s in result.values())
+        result['total']['max_depth'] = max((s.get('max_depth', 0) for s in result.values()), default=0)
+        return result
+
+    def print_stats(self):
+        """Prints the per-camera encode table."""
+        stats = self.stats()
+        print(f"\n=== Encoder Pool ({self.num_workers} workers) ===")
+        print(f"{'Camera':<16} {'Frames':>8} {'Failed':>7} {'FPS':>7} {'Avg ms':>8} {'Max ms':>8} {'MB':>9}"
+              f" {'Queued':>8} {'Dropped':>8} {'MaxQ':>5}")
+        print("-" * 95)
+        for camera, s in stats.items():
+            print(f"{camera:<16} {s['frames']:>8} {s['failed']:>7} {s['fps']:>7.1f} "
+                  f"{s['encode_avg_ms']:>8.2f} {s['encode_max_ms']:>8.2f} {s['bytes'] / 1e6:>9.1f}"
+                  f" {s.get('enqueued', 0):>8} {s.get('dropped', 0):>8} {s.get('max_depth', 0):>5}")
+        print("==========================\n")
+
+    def stop(self, timeout=None):
+        """
+        Encodes and writes the queued frames, then stops the threads.
+
+        Args:
+            timeout (float, optional): Seconds to wait for the queue to drain; frames still queued
+                after that are dropped. None waits for all of them.
+
+        Returns:
+            int: Number of frames dropped because of the timeout.
+        """
+        discarded = 0
+        if not self.jobs.join(timeout):
+            discarded = self.jobs.discard()
+            log.warning("Encoder queue not drained within %s s, %d frame(s) dropped.", timeout, discarded)
+            self.jobs.join()  # frames already taken by an encoder
+        self.jobs.close()
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        if self.writer_thread is not None:
+            self.writes.put(None)
+            self.writer_thread.join()
+            self.writer_thread = None
+        for archive in self._archives.values():
+            archive.close()
+        self._archives = {}
+        return discarded
+
+
+class SaveRequestDispatcher(threading.Thread):
+    """Turns save requests from RTSP processes into EncoderPool jobs, reading frames from their rings."""
+
+    def __init__(self, save_queue, encoder_pool, camera_manager):
+        """
+        Initializes the SaveRequestDispatcher.
+
+        Args:
+            save_queue (multiprocessing.Queue): Receives (ring name, seq, filepath, camera, mac, session,
+                scores) tuples.
+            encoder_pool (EncoderPool): Pool the copied frames are submitted to.
+            camera_manager (CameraManager): Source of the FrameRing of each camera.
+        """
+        super().__init__(name='SaveRequestDispatcher', daemon=True)
+        self.save_queue = save_queue
+        self.encoder_pool = encoder_pool
+        self.camera_manager = camera_manager
+        self.missed = 0  # frames overwritten in the ring before they could be copied
+        self._rings = {}
+        self.profiler = get_profiler()
+
+    def _find_ring(self, name):
+        ring = self._rings.get(name)
+        if ring is None:
+            self._rings = {ring.name: ring for ring in self.camera_manager.get_frame_rings().values()}
+            ring = self._rings.get(name)
+        return ring
+
+    def run(self):
+        while True:
+            request = self.save_queue.get()
+            if request is None:
+                break
+            ring_name, seq, filepath, camera, mac, session, scores = request
+            ring = self._find_ring(ring_name)
+            entry = ring.read(seq) if ring else None
+            if entry is None:
+                self.missed += 1
+                continue
+            prof_copy = self.profiler.stage('ring_copy', camera)
+            timed = prof_copy.start()
+            frame = entry[2].copy()
+            prof_copy.stop(timed)
+            if not ring.is_valid(seq):
+                self.missed += 1
+                continue
+            self.encoder_pool.submit(frame, filepath, camera, seq, entry[1], mac, session, scores)
+
+    def stop(self):
+        """Dispatches the requests already queued, then stops the thread."""
+        self.save_queue.put(None)
+        self.join()
+        if self.missed:
+            print(f"SaveRequestDispatcher: {self.missed} frames were overwritten before saving")
@@ -0,0 +1,132 @@
+# failure_detector.py
+
+import math
+from collections import deque
+from statistics import NormalDist
+
+'''
+Heartbeat failure detectors
+
+CameraManager 為每台 camera 建立一個 detector，每收到一次 heartbeat 呼叫 heartbeat(now)，
+再以 deadline() 取得「超過這個時間還沒有下一個 heartbeat 就視為斷線」的時間點，放進 deadline heap。
+- FixedTimeoutDetector: 固定 timeout (原本的 30 秒)
+- PhiAccrualDetector: phi accrual failure detector (Hayashibara et al.)，學習每台 camera heartbeat 間隔的
+  平均值與標準差，phi = -log10(P(下一個 heartbeat 比現在還晚))，phi 超過 threshold 即視為斷線。
+  在常態分布的假設下 phi 到達 threshold 的時間點可以直接算出來，因此同樣只需要一個 deadline:
+      deadline = last + mean + acceptable_pause + z * std,  z = Φ^-1(1 - 10^-threshold)
+  RTSP.ino 每 10 秒送一次 heartbeat，預設參數下約在漏掉一次 heartbeat 後 4 秒內就會判定斷線，
+  收集到 min_samples 個間隔之前則使用 fallback_timeout。
+
+時間都使用 time.monotonic()。
+'''
+
+FIXED = 'fixed'
+PHI = 'phi'
+DETECTORS = (FIXED, PHI)
+
+
+class FixedTimeoutDetector:
+    """Fails a camera `timeout` seconds after its last heartbeat."""
+
+    def __init__(self, timeout=30.0):
+        self.timeout = timeout
+        self.last = None
+
+    def heartbeat(self, now):
+        self.last = now
+
+    def deadline(self):
+        return self.last + self.timeout
+
+    def phi(self, now):
+        """Suspicion level on the phi scale: 0 until the timeout, infinite after it."""
+        return 0.0 if now < self.deadline() else math.inf
+
+    def describe(self):
+        return f"timeout {self.timeout:.0f} s"
+
+
+class PhiAccrualDetector:
+    """Phi accrual failure detector learning the heartbeat interval of one camera."""
+
+    def __init__(self, threshold=8.0, window=100, min_std=0.5, acceptable_pause=1.0, min_samples=3,
+                 fallback_timeout=30.0):
+        """
+        Initializes the PhiAccrualDetector.
+
+        Args:
+            threshold (float): Phi at which the camera is considered failed, 8 means a 1e-8 chance
+                that the heartbeat is only late.
+            window (int): Heartbeat intervals kept to estimate the distribution.
+            min_std (float): Lower bound of the standard deviation in seconds, so a very regular
+                camera is not failed by the first bit of network jitter.
+            acceptable_pause (float): Seconds added to the mean interval before suspicion starts.
+            min_samples (int): Intervals needed before the learned distribution is used.
+            fallback_timeout (float): Timeout used until then.
+        """
+        self.threshold = threshold
+        self.min_std = min_std
+        self.acceptable_pause = acceptable_pause
+        self.min_samples = min_samples
+        self.fallback_timeout = fallback_timeout
+        self.intervals = deque(maxlen=window)
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.last = None
+        self._z = NormalDist().inv_cdf(1.0 - 10.0 ** -threshold)
+
+    def heartbeat(self, now):
+        if self.last is not None:
+            interval = now - self.last
+            if len(self.intervals) == self.intervals.maxlen:
+                old = self.intervals[0]
+                self.total -= old
+                self.total_sq -= old * old
+            self.intervals.append(interval)
+            self.total += interval
+            self.total_sq += interval * interval
+        self.last = now
+
+    def _distribution(self):
+        n = len(self.intervals)
+        mean = self.total / n
+        variance = max(0.0, self.total_sq / n - mean * mean)
+        return mean + self.acceptable_pause, max(math.sqrt(variance), self.min_std)
+
+    def deadline(self):
+        if len(self.intervals) < self.min_samples:
+            return self.last + self.fallback_timeout
+        mean, std = self._distribution()
+        return self.last + mean + self._z * std
+
+    def phi(self, now):
+        """Current suspicion level, 0 right after a heartbeat."""
+        if len(self.intervals) < self.min_samples:
+            return 0.0 if now < self.deadline() else math.inf
+        mean, std = self._distribution()
+        p_later = 1.0 - NormalDist(mean, std).cdf(now - self.last)
+        return -math.log10(p_later) if p_later > 0 else math.inf
+
+    def describe(self):
+        if len(self.intervals) < self.min_samples:
+            return f"learning, timeout {self.fallback_timeout:.0f} s"
+        mean, std = self._distribution()
+        return f"interval {mean - self.acceptable_pause:.1f} s, std {std:.2f} s"
+
+
+def make_detector_factory(kind=FIXED, timeout=30.0, **kwargs):
+    """
+    Returns a function creating one detector per camera.
+
+    Args:
+        kind (str | callable): 'fixed', 'phi', or a factory returned as is.
+        timeout (float): Timeout of 'fixed', fallback timeout of 'phi'.
+        **kwargs: Extra PhiAccrualDetector arguments.
+    """
+    if callable(kind):
+        return kind
+    if kind == FIXED:
+        return lambda: FixedTimeoutDetector(timeout)
+    if kind == PHI:
+        return lambda: PhiAccrualDetector(fallback_timeout=timeout, **kwargs)
+    raise ValueError(f"Unknown failure detector {kind!r}, expected one of {DETECTORS}")
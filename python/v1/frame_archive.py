@@ -0,0 +1,242 @@
+# frame_archive.py
+
+import bisect
+import glob
+import os
+import struct
+import time
+from collections import namedtuple
+import numpy as np
+
+'''
+FrameArchive
+
+取代一張 frame 一個 JPEG 檔 (img/<ip>/<seq>.jpg): 每台 camera 一個目錄，encode 好的 frame 依序追加到
+segment 檔，另有固定長度的 index:
+- <first seq>.frames: JPEG bytes 直接相接，只做循序、有 buffer 的寫入，到 segment_bytes 時換下一個 segment
+- <first seq>.idx: 每張 frame 一筆 RECORD (archive seq, source seq, timestamp, offset, length)，36 bytes
+- archive seq 由 writer 連續編號，重新開啟時從最後一筆接續，不會因為 FreshestFrame 重建 (seq 從 1 開始)
+  而覆蓋舊的 frame；camera 的原始 seq 保留在 source seq
+- 讀取: 依 seq 找 segment (segment 數量的 bisect) 後直接算出 index 位置，O(1) 讀出 frame；
+  依 timestamp 在 index 上二分搜尋 (timestamp 依寫入順序遞增)
+- writer 重新開啟時會截掉寫到一半的尾端 (程式中斷時 index 或 data 的 buffer 只寫出一部分)
+
+匯出成 JPEG 檔: python-test/export_archive.py
+'''
+
+RECORD = struct.Struct('<QQdQI')  # seq, source seq, timestamp, offset, length
+RECORD_DTYPE = np.dtype([('seq', '<u8'), ('source_seq', '<u8'), ('timestamp', '<f8'), ('offset', '<u8'),
+                         ('length', '<u4')])  # packed like RECORD, to read a whole index at once
+DATA_SUFFIX = '.frames'
+INDEX_SUFFIX = '.idx'
+SEGMENT_BYTES = 256 * 1024 * 1024
+
+FrameRecord = namedtuple('FrameRecord', ['seq', 'source_seq', 'timestamp', 'offset', 'length'])
+
+
+def list_segments(directory):
+    """Returns the first seq of every segment of an archive directory, in order."""
+    return sorted(int(os.path.basename(path)[:-len(INDEX_SUFFIX)])
+                  for path in glob.glob(os.path.join(directory, '*' + INDEX_SUFFIX)))
+
+
+def _segment_path(directory, first_seq, suffix):
+    return os.path.join(directory, f"{first_seq:012d}{suffix}")
+
+
+class FrameArchiveWriter:
+    """Appends encoded frames of one camera to its archive directory."""
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, buffer_size=1024 * 1024):
+        """
+        Opens an archive for appending, continuing after its last complete frame.
+
+        Args:
+            directory (str): Archive directory of the camera, created when missing.
+            segment_bytes (int): Size at which the next frame starts a new segment.
+            buffer_size (int): Write buffer of the data file.
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.buffer_size = buffer_size
+        self.frames = 0  # appended since opening
+        self.bytes = 0
+        self._data = None
+        self._index = None
+        self._data_size = 0
+        self.data_path = None  # segment file of the last appended frame
+        self.last_offset = None  # and its position in that file
+        os.makedirs(directory, exist_ok=True)
+        self.next_seq = self._recover()
+
+    def _recover(self):
+        """Drops a torn tail of the last segment, reopens it and returns the next seq."""
+        segments = list_segments(self.directory)
+        if not segments:
+            return 1
+        first = segments[-1]
+        index_path = _segment_path(self.directory, first, INDEX_SUFFIX)
+        data_path = _segment_path(self.directory, first, DATA_SUFFIX)
+        data_size = os.path.getsize(data_path) if os.path.exists(data_path) else 0
+        count = os.path.getsize(index_path) // RECORD.size
+        last = None
+        with open(index_path, 'rb') as f:
+            # the index buffer may have been written out before the data it points to
+            while count:
+                f.seek((count - 1) * RECORD.size)
+                last = FrameRecord(*RECORD.unpack(f.read(RECORD.size)))
+                if last.offset + last.length <= data_size:
+                    break
+                count -= 1
+                last = None
+        end = last.offset + last.length if last else 0
+        os.truncate(index_path, count * RECORD.size)
+        with open(data_path, 'ab') as f:
+            f.truncate(end)
+        self._open_segment(first, end)
+        return last.seq + 1 if last else first
+
+    def _open_segment(self, first_seq, size=0):
+        self._close_files()
+        self.data_path = _segment_path(self.directory, first_seq, DATA_SUFFIX)
+        self._data = open(self.data_path, 'ab', buffering=self.buffer_size)
+        self._index = open(_segment_path(self.directory, first_seq, INDEX_SUFFIX), 'ab')
+        self._data_size = size
+
+    def append(self, data, timestamp=None, source_seq=0):
+        """
+        Appends one encoded frame.
+
+        Args:
+            data (bytes | numpy.ndarray): The encoded frame, e.g. from cv2.imencode.
+            timestamp (float, optional): Capture time, now when None.
+            source_seq (int): The frame's seq in the RTSP client.
+
+        Returns:
+            int: The frame's archive seq.
+        """
+        if self._data is None or (self._data_size >= self.segment_bytes):
+            self._open_segment(self.next_seq)
+        seq = self.next_seq
+        length = len(data)
+        self._data.write(data)
+        self._index.write(RECORD.pack(seq, source_seq or 0, time.time() if timestamp is None else timestamp,
+                                      self._data_size, length))
+        self.last_offset = self._data_size
+        self._data_size += length
+        self.next_seq += 1
+        self.frames += 1
+        self.bytes += length
+        return seq
+
+    def flush(self):
+        """Hands the buffered frames to the OS, data before index."""
+        if self._data is not None:
+            self._data.flush()
+            self._index.flush()
+
+    def _close_files(self):
+        if self._data is not None:
+            self.flush()
+            self._data.close()
+            self._index.close()
+            self._data = self._index = None
+
+    def close(self):
+        self._close_files()
+
+
+class FrameArchiveReader:
+    """Random access to the frames of one camera's archive, also while it is being written."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._firsts = []
+        self._indexes = []  # RECORD_DTYPE array per segment
+        self._files = {}  # data files opened by read()
+        self.refresh()
+
+    def refresh(self):
+        """Picks up frames and segments appended since the last refresh."""
+        firsts = list_segments(self.directory)
+        indexes = self._indexes[:max(0, len(self._indexes) - 1)]  # older segments no longer change
+        for first in firsts[len(indexes):]:
+            with open(_segment_path(self.directory, first, INDEX_SUFFIX), 'rb') as f:
+                raw = f.read()
+            indexes.append(np.frombuffer(raw[:len(raw) - len(raw) % RECORD.size], dtype=RECORD_DTYPE))
+        self._firsts = firsts
+        self._indexes = indexes
+
+    def __len__(self):
+        return sum(len(index) for index in self._indexes)
+
+    @property
+    def first_seq(self):
+        return next((int(index['seq'][0]) for index in self._indexes if len(index)), None)
+
+    @property
+    def last_seq(self):
+        return next((int(index['seq'][-1]) for index in reversed(self._indexes) if len(index)), None)
+
+    def _locate(self, seq):
+        segment = bisect.bisect_right(self._firsts, seq) - 1
+        if segment < 0:
+            return None, None
+        position = seq - self._firsts[segment]
+        if position >= len(self._indexes[segment]):
+            return None, None
+        return segment, position
+
+    def record(self, seq):
+        """Returns the FrameRecord of an archive seq, None when it is not in the archive."""
+        segment, position = self._locate(seq)
+        if segment is None:
+            return None
+        return FrameRecord(*(item.item() for item in self._indexes[segment][position]))
+
+    def read(self, seq):
+        """Returns the encoded bytes of a frame, None when it is not in the archive."""
+        segment, position = self._locate(seq)
+        if segment is None:
+            return None
+        entry = self._indexes[segment][position]
+        f = self._files.get(segment)
+        if f is None:
+            f = self._files[segment] = open(_segment_path(self.directory, self._firsts[segment], DATA_SUFFIX), 'rb')
+        f.seek(int(entry['offset']))
+        return f.read(int(entry['length']))
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def seq_at(self, timestamp):
+        """Returns the seq of the first frame taken at or after `timestamp`, None when there is none."""
+        for first, index in zip(self._firsts, self._indexes):
+            if len(index) and index['timestamp'][-1] >= timestamp:
+                return first + int(np.searchsorted(index['timestamp'], timestamp))
+        return None
+
+    def records(self, start=None, end=None):
+        """
+        Yields the FrameRecords taken in [start, end).
+
+        Args:
+            start (float, optional): Unix time, from the first frame when None.
+            end (float, optional): Unix time, to the last frame when None.
+        """
+        for index in self._indexes:
+            if not len(index):
+                continue
+            timestamps = index['timestamp']
+            lo = 0 if start is None else int(np.searchsorted(timestamps, start))
+            hi = len(index) if end is None else int(np.searchsorted(timestamps, end))
+            for entry in index[lo:hi]:
+                yield FrameRecord(*(item.item() for item in entry))
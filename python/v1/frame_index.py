@@ -0,0 +1,264 @@
+# frame_index.py
+
+import json
+import queue
+import sqlite3
+import threading
+from collections import namedtuple
+from log import get_logger
+
+'''
+FrameIndex
+
+每張存下來的 frame 都記錄在一個 SQLite 資料庫 (WAL mode)，不需要列目錄就能依 camera、時間範圍或
+連線 session 找到 frame:
+- cameras: 每組 (mac, ip) 一列，frames 只存整數的 camera id
+- frames: camera, session (RTSP 連線開始的 unix ms，每次重新連線都不同), seq, timestamp_ms (拍攝時間),
+  path (JPEG 檔或 archive 的 segment 檔), offset (在 segment 檔中的位置，JPEG 檔為 NULL), size,
+  archive_seq (frame_archive.py 的 seq), scores (每張 frame 的分數，JSON)
+- (camera, timestamp_ms) index: 查詢一台 camera 的一段時間只需 index 上的一次範圍搜尋，
+  與資料庫大小 (數千萬張 frame) 無關
+
+寫入: FrameIndexWriter 是唯一的 writer thread，EncoderPool 寫完 frame 後只把一個 tuple 放入 queue，
+writer 每 batch_size 筆或每 flush_interval 秒以一個 transaction executemany()，synchronous=NORMAL
+(WAL 下只在 checkpoint 時 fsync)。queue 滿時丟掉 index 記錄 (frame 本身已經存好)，不會拖慢存圖。
+RTSP 子進程使用自己的 EncoderPool 時各自有一個 writer，SQLite 以 busy_timeout 排隊。
+
+查詢: FrameIndex(path).query(camera, start_ms, end_ms) 回傳 FrameRef list，可在寫入的同時讀取。
+'''
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cameras (
+    id INTEGER PRIMARY KEY,
+    mac TEXT NOT NULL,
+    ip TEXT NOT NULL,
+    UNIQUE (mac, ip)
+);
+CREATE TABLE IF NOT EXISTS frames (
+    camera INTEGER NOT NULL REFERENCES cameras (id),
+    session INTEGER,
+    seq INTEGER,
+    timestamp_ms INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    offset INTEGER,
+    size INTEGER,
+    archive_seq INTEGER,
+    scores TEXT
+);
+CREATE INDEX IF NOT EXISTS frames_camera_time ON frames (camera, timestamp_ms);
+'''
+BUSY_TIMEOUT = 10.0
+
+FrameRef = namedtuple('FrameRef', ['mac', 'ip', 'session', 'seq', 'timestamp_ms', 'path', 'offset', 'size',
+                                   'archive_seq', 'scores'])
+
+log = get_logger('frame_index')
+
+
+def connect(path):
+    """Opens the index database in WAL mode, creating its tables when missing."""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class FrameIndex:
+    """Queries the frames recorded in an index database."""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = connect(path)
+
+    def _camera_ids(self, camera):
+        if camera is None:
+            return None
+        return [row[0] for row in self.conn.execute('SELECT id FROM cameras WHERE mac = ? OR ip = ?',
+                                                    (camera, camera))]
+
+    def query(self, camera=None, start_ms=None, end_ms=None, session=None, limit=None):
+        """
+        Returns the frames of a camera taken in [start_ms, end_ms), oldest first.
+
+        Args:
+            camera (str, optional): MAC or IP address, every camera when None.
+            start_ms (int, optional): Unix time in milliseconds, from the first frame when None.
+            end_ms (int, optional): Unix time in milliseconds, to the last frame when None.
+            session (int, optional): Only frames of this connection.
+            limit (int, optional): Most frames returned.
+
+        Returns:
+            list[FrameRef]: The matching frames.
+        """
+        where, params = [], []
+        ids = self._camera_ids(camera)
+        if ids is not None:
+            if not ids:
+                return []
+            where.append(f"f.camera IN ({','.join('?' * len(ids))})")
+            params += ids
+        if start_ms is not None:
+            where.append('f.timestamp_ms >= ?')
+            params.append(int(start_ms))
+        if end_ms is not None:
+            where.append('f.timestamp_ms < ?')
+            params.append(int(end_ms))
+        if session is not None:
+            where.append('f.session = ?')
+            params.append(session)
+        sql = ('SELECT c.mac, c.ip, f.session, f.seq, f.timestamp_ms, f.path, f.offset, f.size, f.archive_seq,'
+               ' f.scores FROM frames f JOIN cameras c ON c.id = f.camera')
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY f.timestamp_ms'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        return [FrameRef(*row[:9], json.loads(row[9]) if row[9] else None)
+                for row in self.conn.execute(sql, params)]
+
+    def sessions(self, camera):
+        """
+        Returns:
+            list[tuple]: (session, first timestamp_ms, last timestamp_ms, frames) of every connection
+                of a camera (MAC or IP address).
+        """
+        ids = self._camera_ids(camera)
+        if not ids:
+            return []
+        return self.conn.execute(
+            f"SELECT session, MIN(timestamp_ms), MAX(timestamp_ms), COUNT(*) FROM frames"
+            f" WHERE camera IN ({','.join('?' * len(ids))}) GROUP BY session ORDER BY MIN(timestamp_ms)",
+            ids).fetchall()
+
+    def cameras(self):
+        """Returns the (mac, ip) pairs that saved frames."""
+        return self.conn.execute('SELECT mac, ip FROM cameras ORDER BY mac, ip').fetchall()
+
+    def count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM frames').fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FrameIndexWriter(threading.Thread):
+    """The single thread inserting saved frames into the index database, in batches."""
+
+    def __init__(self, path, batch_size=256, flush_interval=1.0, queue_size=10000):
+        """
+        Initializes the FrameIndexWriter.
+
+        Args:
+            path (str): Index database file.
+            batch_size (int): Frames inserted per transaction.
+            flush_interval (float): Seconds before a partial batch is inserted anyway.
+            queue_size (int): Frames waiting to be inserted; more are dropped and counted.
+        """
+        super().__init__(name='FrameIndexWriter', daemon=True)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rows = queue.Queue(maxsize=queue_size)
+        self.inserted = 0
+        self.dropped = 0
+        self._camera_ids = {}
+        self._conn = None
+
+    def add(self, mac, ip, session, seq, timestamp, path, offset=None, size=None, archive_seq=None, scores=None):
+        """
+        Queues one saved frame, never blocking the caller.
+
+        Args:
+            mac (str): Camera MAC address.
+            ip (str): Camera IP address.
+            session (int): Connection the frame came from.
+            seq (int): The frame's seq in the RTSP client.
+            timestamp (float): Capture time, unix seconds.
+            path (str): JPEG file, or archive segment file the frame is in.
+            offset (int, optional): Position in the segment file.
+            size (int, optional): Encoded size in bytes.
+            archive_seq (int, optional): The frame's seq in its FrameArchive.
+            scores (dict, optional): Per-frame scores, stored as JSON.
+
+        Returns:
+            bool: False if the queue was full and the frame is not indexed.
+        """
+        try:
+            self.rows.put_nowait((mac or '', ip or '', session, seq, int(timestamp * 1000), path, offset, size,
+                                  archive_seq, json.dumps(scores) if scores else None))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _camera_id(self, conn, mac, ip):
+        key = (mac, ip)
+        camera_id = self._camera_ids.get(key)
+        if camera_id is None:
+            conn.execute('INSERT OR IGNORE INTO cameras (mac, ip) VALUES (?, ?)', key)
+            camera_id = conn.execute('SELECT id FROM cameras WHERE mac = ? AND ip = ?', key).fetchone()[0]
+            self._camera_ids[key] = camera_id
+        return camera_id
+
+    def _insert(self, conn, batch):
+        try:
+            with conn:
+                conn.executemany(
+                    'INSERT INTO frames (camera, session, seq, timestamp_ms, path, offset, size, archive_seq, scores)'
+                    ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(self._camera_id(conn, row[0], row[1]),) + row[2:] for row in batch])
+            self.inserted += len(batch)
+        except sqlite3.Error as e:
+            self._camera_ids = {}  # may name ids of the rolled back transaction
+            self.dropped += len(batch)
+            log.warning("Failed to index %d frame(s): %s", len(batch), e)
+
+    def start(self):
+        """
+        Opens the database, then starts the thread.
+
+        Raises:
+            sqlite3.Error: If the database cannot be opened, before any frame is queued for it.
+        """
+        self._conn = connect(self.path)
+        super().start()
+
+    def run(self):
+        conn = self._conn
+        batch = []
+        running = True
+        while running:
+            try:
+                row = self.rows.get(timeout=self.flush_interval)
+                if row is None:
+                    running = False
+                else:
+                    batch.append(row)
+                    while len(batch) < self.batch_size:
+                        row = self.rows.get_nowait()
+                        if row is None:
+                            running = False
+                            break
+                        batch.append(row)
+            except queue.Empty:
+                pass
+            if batch:
+                self._insert(conn, batch)
+                batch = []
+        conn.close()
+
+    def stop(self):
+        """Inserts the frames already queued, then stops the thread."""
+        if self.is_alive():  # nothing would ever take the sentinel off a full queue
+            self.rows.put(None)
+            self.join()
+        if self.dropped:
+            log.warning("%d saved frame(s) were not indexed.", self.dropped)
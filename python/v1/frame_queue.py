@@ -0,0 +1,199 @@
+# frame_queue.py
+
+import threading
+import time
+from collections import deque
+
+'''
+BoundedFrameQueue
+
+取代 queue.Queue + threading.Condition 的組合 (每張 frame 需要取兩把 lock)，
+所有操作只使用一把 lock。每個 key (camera) 有自己的上限，get() 以 round-robin 方式輪流取出，
+因此單一 camera 塞滿時不會佔用其他 camera 的額度，記憶體用量有明確上限。
+
+滿載時的處理策略 (policy):
+- drop-oldest: 丟掉該 camera 最舊的 frame，保留最新的
+- drop-newest: 丟掉新進來的 frame
+- block: 最多等待 timeout 秒，仍然滿載就丟掉新進來的 frame
+- sample-down: 深度超過一半時只接受每 sample_every 張中的一張，滿載時丟掉新進來的 frame
+'''
+
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+BLOCK = 'block'
+SAMPLE_DOWN = 'sample-down'
+POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK, SAMPLE_DOWN)
+
+
+class _KeyQueue:
+    """Items and counters of one key."""
+
+    __slots__ = ('items', 'enqueued', 'dropped', 'max_depth', 'puts')
+
+    def __init__(self):
+        self.items = deque()
+        self.enqueued = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.puts = 0
+
+
+class BoundedFrameQueue:
+    """Per-key bounded queue with a drop policy, served round-robin across keys."""
+
+    def __init__(self, maxsize=8, policy=DROP_OLDEST, timeout=0.1, sample_every=2):
+        """
+        Initializes the BoundedFrameQueue.
+
+        Args:
+            maxsize (int): Maximum queued items per key.
+            policy (str): One of POLICIES, applied when a key's queue is full.
+            timeout (float): Seconds a put may wait under the 'block' policy.
+            sample_every (int): Keep one in n puts once 'sample-down' passes half of maxsize.
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy {policy!r}, expected one of {POLICIES}")
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.timeout = timeout
+        self.sample_every = max(1, sample_every)
+
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._all_done = threading.Condition(self._lock)
+        self._queues = {}
+        self._ready = deque()  # keys with queued items, in service order
+        self._unfinished = 0
+        self._closed = False
+
+    def put(self, item, key=None):
+        """
+        Queues an item for `key`, applying the policy when that key is full.
+
+        Returns:
+            bool: Whether the item was queued (an older item may have been dropped instead).
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            q = self._queues.get(key)
+            if q is None:
+                q = self._queues[key] = _KeyQueue()
+            q.puts += 1
+            items = q.items
+
+            if self.policy == SAMPLE_DOWN and len(items) * 2 >= self.maxsize \
+                    and q.puts % self.sample_every:
+                q.dropped += 1
+                return False
+
+            if len(items) >= self.maxsize:
+                if self.policy == DROP_OLDEST:
+                    items.popleft()
+                    q.dropped += 1
+                    self._unfinished -= 1
+                elif self.policy == BLOCK:
+                    deadline = time.monotonic() + self.timeout
+                    while len(items) >= self.maxsize and not self._closed:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or not self._not_full.wait(remaining):
+                            break
+                    if len(items) >= self.maxsize or self._closed:
+                        q.dropped += 1
+                        return False
+                else:
+                    q.dropped += 1
+                    return False
+
+            if not items:
+                self._ready.append(key)
+            items.append(item)
+            q.enqueued += 1
+            if len(items) > q.max_depth:
+                q.max_depth = len(items)
+            self._unfinished += 1
+            self._not_empty.notify()
+            return True
+
+    def get(self, timeout=None):
+        """
+        Removes the next item, taking keys in turn.
+
+        Returns:
+            The item, or None once the queue is closed and empty (or on timeout).
+        """
+        with self._lock:
+            if not self._ready:
+                if self._closed:
+                    return None
+                self._not_empty.wait_for(lambda: self._ready or self._closed, timeout)
+                if not self._ready:
+                    return None
+            key = self._ready.popleft()
+            items = self._queues[key].items
+            item = items.popleft()
+            if items:
+                self._ready.append(key)
+            if self.policy == BLOCK:
+                self._not_full.notify_all()
+            return item
+
+    def task_done(self):
+        """Marks an item returned by get() as processed."""
+        with self._lock:
+            self._unfinished -= 1
+            if self._unfinished <= 0:
+                self._unfinished = 0
+                self._all_done.notify_all()
+
+    def join(self, timeout=None):
+        """
+        Waits until every queued item has been processed.
+
+        Returns:
+            bool: False if the timeout expired first.
+        """
+        with self._lock:
+            return self._all_done.wait_for(lambda: self._unfinished == 0, timeout)
+
+    def discard(self, key=None):
+        """
+        Drops the queued items of `key`, or of every key when None, counting them as dropped.
+
+        Returns:
+            int: Number of items dropped.
+        """
+        with self._lock:
+            keys = list(self._queues) if key is None else [key]
+            dropped = 0
+            for k in keys:
+                q = self._queues.get(k)
+                if q is None or not q.items:
+                    continue
+                dropped += len(q.items)
+                q.dropped += len(q.items)
+                q.items.clear()
+                self._ready.remove(k)
+            self._unfinished -= dropped
+            if self._unfinished <= 0:
+                self._unfinished = 0
+                self._all_done.notify_all()
+            self._not_full.notify_all()
+            return dropped
+
+    def close(self):
+        """Rejects further puts and wakes up every waiting getter."""
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    def stats(self):
+        """Returns {key: {'enqueued', 'dropped', 'max_depth', 'depth'}}."""
+        with self._lock:
+            return {key: {'enqueued': q.enqueued, 'dropped': q.dropped,
+                          'max_depth': q.max_depth, 'depth': len(q.items)}
+                    for key, q in self._queues.items()}
@@ -0,0 +1,197 @@
+# frame_ring.py
+
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+'''
+FrameRing
+
+每台 camera 一個 shared memory ring buffer，讓 RTSP 子進程 (writer) 與主進程 (reader) 共享 frame，
+不需要 pickle 整張 1080p 影像。
+
+Layout (單一 SharedMemory block):
+- header: int64[HEADER_LEN]，包含 slot 數、slot 最大 shape 與最新 seq
+- slot meta: seq (int64) / timestamp (float64) / shape (int64 x 3)，每個 slot 一筆
+- slot data: slots x (max_h * max_w * max_c) bytes，每個 slot 以 64 bytes 對齊
+
+同步方式 (single writer, lock-free):
+- writer 寫入前把 slot seq 設為 -seq，寫完資料與 meta 後再設回 seq，最後更新 header 的 latest seq
+- reader 取得 view 後可用 is_valid(seq) 確認該 slot 在使用期間沒有被覆寫 (seqlock)
+'''
+
+_HEADER_LEN = 8
+_H_VERSION, _H_SLOTS, _H_MAX_H, _H_MAX_W, _H_MAX_C, _H_LATEST = range(6)
+_VERSION = 1
+_ALIGN = 64
+
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class FrameRing:
+    """Per-camera ring of preallocated frame slots in shared memory."""
+
+    def __init__(self, shm, owner):
+        """
+        Use FrameRing.create() in the main process and FrameRing.attach() elsewhere.
+
+        Args:
+            shm (SharedMemory): The backing shared memory block.
+            owner (bool): Whether this instance created the block and must unlink it.
+        """
+        self.shm = shm
+        self.owner = owner
+        self.name = shm.name
+
+        buf = shm.buf
+        self._header = np.ndarray((_HEADER_LEN,), dtype=np.int64, buffer=buf)
+        if self._header[_H_VERSION] != _VERSION:
+            raise ValueError(f"Shared memory {self.name} is not a FrameRing")
+        self.slots = int(self._header[_H_SLOTS])
+        self.max_shape = tuple(int(v) for v in self._header[_H_MAX_H:_H_MAX_C + 1])
+        self.slot_size = _align(int(np.prod(self.max_shape)))
+
+        offset = self._header.nbytes
+        self._seq = np.ndarray((self.slots,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += self._seq.nbytes
+        self._ts = np.ndarray((self.slots,), dtype=np.float64, buffer=buf, offset=offset)
+        offset += self._ts.nbytes
+        self._shape = np.ndarray((self.slots, 3), dtype=np.int64, buffer=buf, offset=offset)
+        offset += self._shape.nbytes
+        self._data_offset = _align(offset)
+        self._data = np.ndarray((self.slots, self.slot_size), dtype=np.uint8,
+                                buffer=buf, offset=self._data_offset)
+        self.oversized = 0  # frames larger than max_shape, dropped by this writer
+
+    @classmethod
+    def create(cls, slots=4, max_shape=(1080, 1920, 3), name=None):
+        """
+        Allocates a new ring.
+
+        Args:
+            slots (int): Number of frame slots.
+            max_shape (tuple): Largest (height, width, channels) a slot can hold.
+            name (str, optional): Shared memory name, generated when omitted.
+
+        Returns:
+            FrameRing: The owning instance.
+        """
+        meta_size = _HEADER_LEN * 8 + slots * (8 + 8 + 3 * 8)
+        slot_size = _align(int(np.prod(max_shape)))
+        shm = shared_memory.SharedMemory(
+            name=name, create=True, size=_align(meta_size) + slots * slot_size)
+
+        header = np.ndarray((_HEADER_LEN,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[_H_SLOTS] = slots
+        header[_H_MAX_H:_H_MAX_C + 1] = max_shape
+        header[_H_VERSION] = _VERSION
+        del header  # release the export before handing shm over
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Attaches to an existing ring by shared memory name."""
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    def __reduce__(self):
+        # processes receive the name and attach, the frames themselves are never pickled
+        return (FrameRing.attach, (self.name,))
+
+    @property
+    def latest_seq(self):
+        """Sequence number of the newest complete frame, 0 when empty or closed."""
+        return int(self._header[_H_LATEST]) if self._header is not None else 0
+
+    def write(self, frame, seq, timestamp=None):
+        """
+        Copies a frame into the slot for `seq`. Only one process may write to a ring.
+
+        Args:
+            frame (numpy.ndarray): uint8 frame, (h, w) or (h, w, c) within max_shape.
+            seq (int): Positive, increasing sequence number.
+            timestamp (float, optional): Capture time, defaults to time.time().
+
+        Returns:
+            bool: False if the frame does not fit in a slot.
+        """
+        shape = frame.shape if frame.ndim == 3 else (frame.shape[0], frame.shape[1], 1)
+        if shape[0] > self.max_shape[0] or shape[1] > self.max_shape[1] \
+                or shape[2] > self.max_shape[2]:
+            self.oversized += 1
+            return False
+
+        slot = seq % self.slots
+        self._seq[slot] = -seq  # mark as being written
+        dst = self._data[slot, :frame.size].reshape(frame.shape)
+        np.copyto(dst, frame)
+        self._shape[slot] = shape
+        self._ts[slot] = time.time() if timestamp is None else timestamp
+        self._seq[slot] = seq
+        self._header[_H_LATEST] = seq
+        return True
+
+    def read(self, seq):
+        """
+        Returns a zero-copy view of frame `seq` if it is still in the ring.
+
+        The view aliases shared memory, so call is_valid(seq) after using it (or copy it)
+        to make sure the writer did not reuse the slot meanwhile.
+
+        Returns:
+            tuple: (seq, timestamp, frame view), or None if the frame was overwritten.
+        """
+        if seq <= 0 or self._seq is None:
+            return None
+        slot = seq % self.slots
+        if self._seq[slot] != seq:
+            return None
+        h, w, c = (int(v) for v in self._shape[slot])
+        view = self._data[slot, :h * w * c].reshape((h, w, c) if c > 1 else (h, w))
+        timestamp = float(self._ts[slot])
+        if self._seq[slot] != seq:
+            return None
+        return seq, timestamp, view
+
+    def latest(self, copy=False):
+        """
+        Returns the newest frame.
+
+        Args:
+            copy (bool): Return a private copy instead of a shared memory view.
+
+        Returns:
+            tuple: (seq, timestamp, frame), or None if no frame is available.
+        """
+        for _ in range(3):  # the writer may lap us between reading latest and the slot
+            entry = self.read(self.latest_seq)
+            if entry is None:
+                if self.latest_seq == 0:
+                    return None
+                continue
+            if not copy:
+                return entry
+            seq, timestamp, view = entry
+            frame = view.copy()
+            if self.is_valid(seq):
+                return seq, timestamp, frame
+        return None
+
+    def is_valid(self, seq):
+        """Whether the slot for `seq` still holds that frame."""
+        return self._seq is not None and self._seq[seq % self.slots] == seq
+
+    def close(self):
+        """Detaches from the shared memory; the owner also unlinks it."""
+        self._header = self._seq = self._ts = self._shape = self._data = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # a consumer still holds a view; the mapping goes away with it
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,362 @@
+# frame_source.py
+
+import glob
+import os
+import struct
+import time
+import cv2
+import numpy as np
+from ingest_profile import get_ingest_profile
+
+'''
+FrameSource
+
+RTSPClient / FreshestFrame 取得 frame 的來源。source.open(url) 回傳一個與 cv2.VideoCapture 相同介面的
+capture 物件 (isOpened / grab / retrieve / read / get / release)，所以 FreshestFrame 不需要知道 frame 從哪裡來:
+- RtspSource: 以 IngestProfile 開啟 camera 的 RTSP stream (預設，與原本的行為相同)
+- VideoFileSource: 播放單一影片檔，或依檔名順序播放整個目錄的錄影片段
+- ImageDirSource: 依檔名順序播放一個目錄的圖片 (例如 FrameCallback 存下來的 img/<ip>)
+- SyntheticSource: 產生測試用的 color bar，可模擬 decode 的 CPU 成本
+
+檔案與合成的 source 可以用原本的速度播放 (realtime=True)，或不等待、盡可能快地播放 (realtime=False)，
+讓 pipeline 的修改可以在沒有 camera 的筆電上以固定的輸入重複量測。
+stamp=True 時，每張 frame 左上角的 16 個 pixel 會寫入產生時間與序號，可用 read_stamp() 讀回來計算延遲。
+
+Source 物件會被 pickle 到 RTSP 子進程，因此只保存設定，capture 在 open() 時才建立。
+'''
+
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov', '.ts', '.h264', '.mjpeg')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+_STAMP = struct.Struct('<dq')  # production time, frame number
+STAMP_PIXELS = _STAMP.size
+
+
+def _stamp_pixels(frame):
+    return frame[0, :STAMP_PIXELS, 0] if frame.ndim == 3 else frame[0, :STAMP_PIXELS]
+
+
+def stamp_frame(frame, timestamp, number):
+    """Writes `timestamp` and `number` into the first pixels of the frame's first channel."""
+    _stamp_pixels(frame)[:] = np.frombuffer(_STAMP.pack(timestamp, number), dtype=np.uint8)
+
+
+def read_stamp(frame):
+    """
+    Reads the stamp written by a source opened with stamp=True.
+
+    Returns:
+        tuple: (production time, frame number).
+    """
+    return _STAMP.unpack(_stamp_pixels(frame).tobytes())
+
+
+class PacedCapture:
+    """VideoCapture-like base of the file, image and synthetic sources: paces, loops and stamps frames."""
+
+    def __init__(self, fps, realtime=True, loop=False, stamp=False):
+        """
+        Args:
+            fps (float): Playback rate when realtime is set.
+            realtime (bool): Deliver frames at `fps`, otherwise as fast as they are read.
+            loop (bool): Start over at the end instead of finishing.
+            stamp (bool): Write the production time and frame number into each frame.
+        """
+        self.fps = fps if fps and fps > 0 else 30.0
+        self.realtime = realtime
+        self.loop = loop
+        self.stamp = stamp
+        self.opened = True
+        self.finished = False  # the source ended; RTSPClient stops instead of reconnecting
+        self.count = 0
+        self.start = None
+        self.due = None
+
+    def _grab_frame(self):
+        """Advances to the next frame. Returns False at the end of the source."""
+        raise NotImplementedError
+
+    def _retrieve_frame(self):
+        """Returns (ret, frame) for the frame selected by _grab_frame()."""
+        raise NotImplementedError
+
+    def _rewind(self):
+        """Goes back to the first frame. Returns False if that is not possible."""
+        return False
+
+    def _close(self):
+        pass
+
+    def isOpened(self):
+        return self.opened
+
+    def grab(self):
+        if not self.opened:
+            return False
+        if not self._grab_frame():
+            if not (self.loop and self._rewind() and self._grab_frame()):
+                self.finished = True
+                self.release()
+                return False
+        if self.start is None:
+            self.start = time.time()
+        self.count += 1
+        if self.realtime:
+            self.due = self.start + (self.count - 1) / self.fps
+            delay = self.due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            # a late reader gets the frame at once, like a stream that buffered it
+        else:
+            self.due = time.time()
+        return True
+
+    def retrieve(self):
+        ret, frame = self._retrieve_frame()
+        if ret and self.stamp:
+            stamp_frame(frame, self.due, self.count)
+        return ret, frame
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.count)
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self.count / self.fps * 1000
+        return 0.0
+
+    def release(self):
+        if self.opened:
+            self.opened = False
+            self._close()
+
+
+class _VideoFilesCapture(PacedCapture):
+    """Plays video files one after another."""
+
+    def __init__(self, paths, fps, **kwargs):
+        self.paths = paths
+        self.index = 0
+        self.capture = cv2.VideoCapture(paths[0])
+        if fps is None:
+            fps = self.capture.get(cv2.CAP_PROP_FPS)
+        super().__init__(fps, **kwargs)
+        if not self.capture.isOpened():
+            self.opened = False
+
+    def _grab_frame(self):
+        while not self.capture.grab():
+            if self.index + 1 >= len(self.paths):
+                return False
+            self.capture.release()
+            self.index += 1
+            self.capture = cv2.VideoCapture(self.paths[self.index])
+        return True
+
+    def _retrieve_frame(self):
+        return self.capture.retrieve()
+
+    def _rewind(self):
+        self.capture.release()
+        self.index = 0
+        self.capture = cv2.VideoCapture(self.paths[0])
+        return self.capture.isOpened()
+
+    def _close(self):
+        self.capture.release()
+
+
+class _ImageFilesCapture(PacedCapture):
+    """Plays image files one after another."""
+
+    def __init__(self, paths, fps, **kwargs):
+        super().__init__(fps, **kwargs)
+        self.paths = paths
+        self.index = -1
+        self.frame = None
+
+    def _grab_frame(self):
+        # decode here, like grab() decodes a video frame
+        while self.index + 1 < len(self.paths):
+            self.index += 1
+            self.frame = cv2.imread(self.paths[self.index], cv2.IMREAD_COLOR)
+            if self.frame is not None:
+                return True
+        return False
+
+    def _retrieve_frame(self):
+        if self.frame is None:
+            return False, None
+        frame, self.frame = self.frame, None
+        return True, frame
+
+    def _rewind(self):
+        self.index = -1
+        return bool(self.paths)
+
+
+class SyntheticCapture(PacedCapture):
+    """Colour bars with a little noise, optionally decoded from a JPEG per frame to cost real CPU."""
+
+    def __init__(self, url, width, height, fps, decode=True, frames=None, **kwargs):
+        super().__init__(fps, **kwargs)
+        self.decode = decode
+        self.frames = frames
+        # a different bar offset per url, so cameras can be told apart
+        offset = sum(url.encode()) % 8
+        bars = np.array([(255, 255, 255), (0, 255, 255), (255, 255, 0), (0, 255, 0),
+                         (255, 0, 255), (0, 0, 255), (255, 0, 0), (0, 0, 0)], dtype=np.uint8)
+        columns = np.arange(width) * 8 // width
+        pattern = np.ascontiguousarray(np.broadcast_to(bars[(columns + offset) % 8], (height, width, 3)))
+        noise = np.random.default_rng(offset).integers(0, 32, (height, width, 3), dtype=np.uint8)
+        self.pattern = cv2.add(pattern, noise)  # gives the JPEG decoder real work
+        self.encoded = cv2.imencode('.jpg', self.pattern)[1] if decode else None
+        self.frame = None
+
+    def _grab_frame(self):
+        if self.frames is not None and self.count >= self.frames:
+            return False
+        if self.decode:
+            self.frame = cv2.imdecode(self.encoded, cv2.IMREAD_COLOR)
+        else:
+            self.frame = self.pattern.copy()
+        return True
+
+    def _retrieve_frame(self):
+        if self.frame is None:
+            return False, None
+        frame, self.frame = self.frame, None
+        return True, frame
+
+
+class FrameSource:
+    """Where an RTSPClient reads frames from. Subclasses only hold settings and must stay picklable."""
+
+    def open(self, url):
+        """
+        Opens a capture for the camera at `url`.
+
+        Returns:
+            A cv2.VideoCapture or an object with the same isOpened/grab/retrieve/read/get/release methods.
+        """
+        raise NotImplementedError
+
+
+class RtspSource(FrameSource):
+    """The camera's RTSP stream, opened with an IngestProfile."""
+
+    def __init__(self, ingest_profile='default'):
+        self.ingest_profile = ingest_profile
+
+    def open(self, url):
+        return get_ingest_profile(self.ingest_profile).open(url)
+
+    def __repr__(self):
+        return f"RtspSource({self.ingest_profile!r})"
+
+
+class VideoFileSource(FrameSource):
+    """A video file, or every video file of a directory in name order (recorded segments)."""
+
+    def __init__(self, path, realtime=True, loop=False, stamp=False, fps=None):
+        """
+        Args:
+            path (str): Video file or directory.
+            realtime (bool): Play at the file's frame rate, otherwise as fast as possible.
+            loop (bool): Start over at the end.
+            stamp (bool): Stamp frames, see read_stamp().
+            fps (float, optional): Overrides the frame rate reported by the file.
+        """
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.stamp = stamp
+        self.fps = fps
+
+    def open(self, url):
+        if os.path.isdir(self.path):
+            paths = sorted(p for p in glob.glob(os.path.join(self.path, '*'))
+                           if p.lower().endswith(VIDEO_EXTENSIONS))
+        else:
+            paths = [self.path]
+        if not paths:
+            raise FileNotFoundError(f"No video files in {self.path}")
+        return _VideoFilesCapture(paths, self.fps, realtime=self.realtime, loop=self.loop, stamp=self.stamp)
+
+    def __repr__(self):
+        return f"VideoFileSource({self.path!r}, realtime={self.realtime}, loop={self.loop})"
+
+
+class ImageDirSource(FrameSource):
+    """Every image of a directory in name order, e.g. the img/<ip> folder written by FrameCallback."""
+
+    def __init__(self, path, fps=30.0, realtime=True, loop=False, stamp=False):
+        self.path = path
+        self.fps = fps
+        self.realtime = realtime
+        self.loop = loop
+        self.stamp = stamp
+
+    def open(self, url):
+        paths = sorted(p for p in glob.glob(os.path.join(self.path, '*'))
+                       if p.lower().endswith(IMAGE_EXTENSIONS))
+        if not paths:
+            raise FileNotFoundError(f"No images in {self.path}")
+        return _ImageFilesCapture(paths, self.fps, realtime=self.realtime, loop=self.loop, stamp=self.stamp)
+
+    def __repr__(self):
+        return f"ImageDirSource({self.path!r}, fps={self.fps}, realtime={self.realtime})"
+
+
+class SyntheticSource(FrameSource):
+    """Generated test pattern, different for every camera url."""
+
+    def __init__(self, width=1920, height=1080, fps=30.0, decode=True, realtime=True, stamp=True, frames=None):
+        """
+        Args:
+            width (int): Frame width.
+            height (int): Frame height.
+            fps (float): Frame rate when realtime is set.
+            decode (bool): Decode a JPEG for every frame to stand in for H.264 decoding cost.
+            realtime (bool): Deliver frames at `fps`, otherwise as fast as possible.
+            stamp (bool): Stamp frames, see read_stamp().
+            frames (int, optional): Finish after this many frames, endless when None.
+        """
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.decode = decode
+        self.realtime = realtime
+        self.stamp = stamp
+        self.frames = frames
+
+    def open(self, url):
+        return SyntheticCapture(url, self.width, self.height, self.fps, decode=self.decode,
+                                frames=self.frames, realtime=self.realtime, stamp=self.stamp)
+
+    def __repr__(self):
+        return f"SyntheticSource({self.width}x{self.height} @ {self.fps}, decode={self.decode})"
+
+
+def get_frame_source(source=None, ingest_profile='default'):
+    """
+    Resolves the frame source of an RTSPClient.
+
+    Args:
+        source (FrameSource | None): The source, None for the camera's RTSP stream.
+        ingest_profile (str | IngestProfile): Profile of the default RtspSource.
+
+    Returns:
+        FrameSource: The source to open.
+    """
+    if source is None:
+        return RtspSource(ingest_profile)
+    if not isinstance(source, FrameSource):
+        raise TypeError(f"Expected a FrameSource, got {type(source).__name__}")
+    return source
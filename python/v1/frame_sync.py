@@ -0,0 +1,298 @@
+# frame_sync.py
+
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from log import get_logger
+from profiling import StageTimer
+
+'''
+FrameSync
+
+多視角的應用需要所有 camera 在同一時間拍到的 frame。每個 RTSPClient 各自在自己的進程中以自己的 seq 編號，
+FrameSync 則在主進程把它們依時間對齊成 frame set:
+- 時鐘: 每台 camera 的 FrameRing 在寫入時以 time.time() 記錄 timestamp，所有 RTSP 進程都在同一台機器上，
+  共用同一個系統時鐘
+- 每 poll_interval 秒讀一次每個 ring 的新 seq，只記錄 (seq, timestamp)，不複製 frame
+- 對齊: anchor 為每台 camera 最舊的待處理 frame 中最晚的那一個 timestamp，每台 camera 取最接近 anchor 的 frame，
+  差距在 tolerance 內才算對上；對上的 frame 與更舊的 frame 都會被消耗，所以 anchor 一定往前推進
+- 某台 camera 還沒有 anchor 之後的 frame 時最多等到 anchor 的 frame 已經 max_wait 秒舊，之後視為缺少；
+  等待期間 frame 仍在 ring 中，所以 max_wait 應小於 ring 能保留的時間 (FRAME_RING_SLOTS / FPS)
+- 缺少 camera (沒有 tolerance 內的 frame、等待逾時或已被 ring 覆寫) 時的 policy:
+  wait: 等待每台 camera，仍缺少時整組丟棄；skip: 輸出不含該 camera 的 set；
+  pad: 以該 camera 在 anchor 之前最新的 frame 補上 (SyncedFrame.padded)
+- 組成 set 時才從 ring 複製被選中的 frame，交給 on_set(FrameSet)，在 FrameSync thread 中呼叫，應盡快返回
+- stats() / report(): set 數、部分 set、補上與丟棄的數量，set 內 timestamp 差距 (skew) 與每台 camera 相對 anchor
+  的偏移的 percentile (profiling.StageTimer 的 histogram)
+
+FrameSetSaver 是一個 on_set 範例: 每 every 秒將一組 set 以 <directory>/<set ms>/<ip>.jpg 交給 EncoderPool 存檔。
+'''
+
+WAIT = 'wait'
+SKIP = 'skip'
+PAD = 'pad'
+POLICIES = (WAIT, SKIP, PAD)
+
+SyncedFrame = namedtuple('SyncedFrame', ['seq', 'timestamp', 'frame', 'padded'])
+# timestamp: anchor time; frames: {camera: SyncedFrame}; skew: seconds between the first and the last synced
+# (not padded) frame; missing: cameras neither synced nor padded; macs: {camera: MAC address}
+FrameSet = namedtuple('FrameSet', ['timestamp', 'frames', 'skew', 'missing', 'macs'])
+
+log = get_logger('frame_sync')
+
+
+class _CameraTrack:
+    """Frames of one camera waiting to be synced."""
+
+    def __init__(self, camera, ring, mac, history):
+        self.camera = camera
+        self.ring = ring
+        self.mac = mac
+        self.last_seq = ring.latest_seq  # frames older than the sync stage are not synced
+        self.pending = deque(maxlen=history)  # (seq, timestamp), oldest first
+        self.previous = None  # newest (seq, timestamp) consumed, for padding
+        self.offset = StageTimer('offset', camera)  # |frame timestamp - anchor| of synced frames
+        self.synced = 0
+        self.missing = 0
+        self.padded = 0
+        self.overwritten = 0
+
+    def poll(self):
+        latest = self.ring.latest_seq
+        if latest < self.last_seq:
+            self.last_seq = 0  # a new writer numbering from 1
+        # frames lapped by the writer before this poll are gone already
+        for seq in range(max(self.last_seq + 1, latest - self.ring.slots + 1), latest + 1):
+            entry = self.ring.read(seq)
+            if entry is not None:
+                self.pending.append((seq, entry[1]))
+        self.last_seq = latest
+
+    def closest(self, anchor):
+        """The pending frame closest to `anchor`, None while no frame at or after it arrived yet."""
+        before = None
+        for item in self.pending:
+            if item[1] >= anchor:
+                if before is not None and anchor - before[1] < item[1] - anchor:
+                    return before
+                return item
+            before = item
+        return None
+
+    def consume(self, until):
+        """Drops the pending frames taken at or before `until`."""
+        while self.pending and self.pending[0][1] <= until:
+            self.previous = self.pending.popleft()
+
+    def copy(self, seq):
+        """A private copy of frame `seq`, None when the writer overwrote it."""
+        entry = self.ring.read(seq)
+        if entry is None:
+            return None
+        frame = entry[2].copy()
+        return frame if self.ring.is_valid(seq) else None
+
+
+class FrameSync(threading.Thread):
+    """Assembles frames of every camera taken within a tolerance of each other into FrameSets."""
+
+    def __init__(self, camera_manager, on_set, tolerance=0.02, policy=WAIT, max_wait=0.1, poll_interval=0.005,
+                 history=64):
+        """
+        Initializes the FrameSync.
+
+        Args:
+            camera_manager (CameraManager): Source of the cameras and their FrameRings.
+            on_set (callable): Called with each FrameSet from the FrameSync thread.
+            tolerance (float): Most seconds between a camera's frame and the set's anchor time.
+            policy (str): What to do about a camera without a frame in the set, one of POLICIES.
+            max_wait (float): Seconds a set may wait for a camera that has not delivered a frame yet,
+                counted from the anchor capture time.
+            poll_interval (float): Seconds between reads of the rings.
+            history (int): Unsynced frames remembered per camera.
+        """
+        super().__init__(name='FrameSync', daemon=True)
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown sync policy {policy!r}, expected one of {POLICIES}")
+        self.camera_manager = camera_manager
+        self.on_set = on_set
+        self.tolerance = tolerance
+        self.policy = policy
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self.history = history
+        self.sets = 0
+        self.partial = 0  # emitted with a camera missing or padded
+        self.dropped = 0  # discarded under the wait policy
+        self.skew = StageTimer('skew')
+        self._tracks = {}
+        self._refresh_time = 0.0
+        self._stop_event = threading.Event()
+
+    def _refresh_cameras(self):
+        rings = self.camera_manager.get_frame_rings()
+        cameras = self.camera_manager.get_cameras()
+        tracks = {}
+        for camera, ring in rings.items():
+            track = self._tracks.get(camera)
+            if track is None or track.ring.name != ring.name:
+                track = _CameraTrack(camera, ring, cameras.get(camera, {}).get('mac'), self.history)
+            tracks[camera] = track
+        self._tracks = tracks  # replaced, stats() may be reading the old dict
+
+    def run(self):
+        while not self._stop_event.is_set():
+            now = time.time()
+            if now - self._refresh_time >= 0.5:
+                self._refresh_cameras()
+                self._refresh_time = now
+            for track in self._tracks.values():
+                track.poll()
+            try:
+                while self._assemble(time.time()):
+                    pass
+            except Exception:
+                log.exception("Frame set assembly failed")
+            self._stop_event.wait(self.poll_interval)
+
+    def _assemble(self, now):
+        """Emits or drops the next set when it can be decided. Returns False while it has to wait."""
+        tracks = self._tracks
+        heads = [track.pending[0][1] for track in tracks.values() if track.pending]
+        if len(tracks) < 2 or not heads:
+            return False
+        anchor = max(heads)
+        chosen, undecided = {}, []
+        for camera, track in tracks.items():
+            item = track.closest(anchor)
+            if item is None:
+                undecided.append(camera)
+            elif abs(item[1] - anchor) <= self.tolerance:
+                chosen[camera] = item
+        if undecided and now - anchor < self.max_wait:
+            return False
+
+        frames = {}
+        for camera, (seq, timestamp) in chosen.items():
+            frame = tracks[camera].copy(seq)
+            if frame is None:
+                tracks[camera].overwritten += 1
+                continue
+            frames[camera] = SyncedFrame(seq, timestamp, frame, False)
+        missing = [camera for camera in tracks if camera not in frames]
+
+        frame_set = None
+        if (missing and self.policy == WAIT) or not frames:
+            self.dropped += 1
+        else:
+            if self.policy == PAD:
+                for camera in missing:
+                    padded = self._pad(tracks[camera], anchor)
+                    if padded is not None:
+                        frames[camera] = padded
+                        tracks[camera].padded += 1
+                missing = [camera for camera in tracks if camera not in frames]
+            synced = [f.timestamp for f in frames.values() if not f.padded]
+            skew = max(synced) - min(synced) if synced else 0.0
+            for camera, frame in frames.items():
+                if not frame.padded:
+                    tracks[camera].synced += 1
+                    tracks[camera].offset.record(abs(frame.timestamp - anchor))
+            self.sets += 1
+            if len(frames) < len(tracks) or any(f.padded for f in frames.values()):
+                self.partial += 1
+            self.skew.record(skew)
+            for camera in missing:
+                tracks[camera].missing += 1
+            frame_set = FrameSet(anchor, frames, skew, tuple(missing),
+                                 {camera: track.mac for camera, track in tracks.items()})
+
+        # consumed before the callback, a failing consumer must not get the same set again
+        for camera, track in tracks.items():
+            track.consume(chosen[camera][1] if camera in chosen else anchor)
+        if frame_set is not None:
+            try:
+                self.on_set(frame_set)
+            except Exception:
+                log.exception("Frame set consumer failed")
+        return True
+
+    def _pad(self, track, anchor):
+        """The camera's newest frame taken before `anchor`, or its newest frame when that one is gone."""
+        candidates = [item for item in track.pending if item[1] < anchor]
+        item = candidates[-1] if candidates else track.previous
+        if item is not None:
+            frame = track.copy(item[0])
+            if frame is not None:
+                return SyncedFrame(item[0], item[1], frame, True)
+        entry = track.ring.latest(copy=True)
+        return SyncedFrame(entry[0], entry[1], entry[2], True) if entry is not None else None
+
+    def stats(self):
+        """
+        Returns:
+            dict: 'sets', 'partial', 'dropped', 'skew' (StageTimer.summary()) and 'cameras' with the
+                synced / missing / padded / overwritten counts and the 'offset' summary of each camera.
+        """
+        return {
+            'sets': self.sets,
+            'partial': self.partial,
+            'dropped': self.dropped,
+            'skew': self.skew.summary(),
+            'cameras': {camera: {'mac': track.mac, 'synced': track.synced, 'missing': track.missing,
+                                 'padded': track.padded, 'overwritten': track.overwritten,
+                                 'offset': track.offset.summary()}
+                        for camera, track in self._tracks.items()},
+        }
+
+    def report(self):
+        """Returns the set counts and the skew table as text."""
+        s = self.stats()
+        skew = s['skew']
+        lines = [f"\n=== Frame sync (tolerance {self.tolerance * 1000:.0f} ms, policy {self.policy}) ===",
+                 f"Sets {s['sets']} (partial {s['partial']}), dropped {s['dropped']}, skew p50 "
+                 f"{skew[0.5] * 1000:.1f} / p90 {skew[0.9] * 1000:.1f} / p99 {skew[0.99] * 1000:.1f} / max "
+                 f"{skew['max'] * 1000:.1f} ms",
+                 f"{'Camera':<16} {'Synced':>8} {'Missing':>8} {'Padded':>8} {'Lost':>6} {'Offset p50':>11}"
+                 f" {'p99 ms':>8}",
+                 "-" * 70]
+        for camera, c in sorted(s['cameras'].items()):
+            lines.append(f"{camera:<16} {c['synced']:>8} {c['missing']:>8} {c['padded']:>8} {c['overwritten']:>6}"
+                         f" {c['offset'][0.5] * 1000:>11.1f} {c['offset'][0.99] * 1000:>8.1f}")
+        lines.append("==========================\n")
+        return '\n'.join(lines)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        print(self.report())
+
+
+class FrameSetSaver:
+    """on_set consumer saving one FrameSet every `every` seconds as <directory>/<set ms>/<camera>.jpg."""
+
+    def __init__(self, encoder_pool, directory='sync', every=1.0):
+        """
+        Initializes the FrameSetSaver.
+
+        Args:
+            encoder_pool (EncoderPool): Pool writing JPEG files, not in archive mode.
+            directory (str): Parent directory of the set directories.
+            every (float): Seconds between saved sets, 0 saves all of them.
+        """
+        self.encoder_pool = encoder_pool
+        self.directory = directory
+        self.every = every
+        self._last = None
+
+    def __call__(self, frame_set):
+        if self._last is not None and frame_set.timestamp - self._last < self.every:
+            return
+        self._last = frame_set.timestamp
+        set_ms = int(frame_set.timestamp * 1000)
+        scores = {'sync_set': set_ms, 'sync_skew_ms': frame_set.skew * 1000}
+        for camera, synced in frame_set.frames.items():
+            self.encoder_pool.submit(synced.frame, os.path.join(self.directory, str(set_ms), f"{camera}.jpg"), camera,
+                                     synced.seq, synced.timestamp, frame_set.macs.get(camera),
+                                     scores=dict(scores, sync_padded=synced.padded))
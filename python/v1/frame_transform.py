@@ -0,0 +1,192 @@
+# frame_transform.py
+
+import cv2
+import numpy as np
+
+'''
+Frame transform
+
+每台 camera 的 frame 原本以 1920x1080 BGR 原樣寫入 FrameRing、交給 callback、encode 成 JPEG，但多數分析只需要
+一小塊 640 寬的灰階畫面。FrameTransform 在 RTSP 子進程讀到 frame 後只執行一次，之後的 FrameRing、callback、
+存圖與顯示都只處理轉換後的 frame:
+- crop: (x, y, w, h) ROI，以 numpy view 取出，不複製
+- decimate: 整數倍的降採樣，每 n 個像素取 1 個 (stride view，不做濾波)，例如 1080p -> 540p 幾乎不花 CPU
+- resize_width / resize_height: 以 interpolation ('nearest', 'linear', 'area', 'cubic', 'lanczos') 縮放，只給一邊時
+  另一邊依比例計算
+- color: 'bgr' (不變)、'gray'、'yuv' (YUV 4:4:4，3 channel) 或 'i420' (planar YUV 4:2:0，(h * 3 / 2, w) 的單一
+  channel 陣列，寬高會取偶數)
+順序為 crop -> decimate -> resize -> color，縮放在色彩轉換之前，所以 cvtColor 只處理縮小後的像素。
+
+結果寫入預先配置的 output buffer (cv2 的 dst 參數)，不為每張 frame 配置記憶體。buffers 組 buffer 輪流使用，
+FreshestFrame 以 3 組確保正在寫入的 buffer 不是 read() 已交出或正在發佈的那一組；callback 要在返回後保留
+frame 時必須自己複製 (other_info['reused_buffer'])。輸入解析度改變時重新配置。
+
+'yuv' / 'i420' 給分析模型使用，存成 JPEG 或顯示時看到的是原始 YUV 資料；'i420' 的高度為 1.5 倍，必須在
+FrameRing 的 max_shape 之內 (通常要同時 resize)；放不下時 FreshestFrame 會警告並停止寫入 ring，frame 改由
+RTSP 進程自己存檔。
+'''
+
+COLORS = ('bgr', 'gray', 'yuv', 'i420')
+
+INTERPOLATIONS = {
+    'nearest': cv2.INTER_NEAREST,
+    'linear': cv2.INTER_LINEAR,
+    'area': cv2.INTER_AREA,
+    'cubic': cv2.INTER_CUBIC,
+    'lanczos': cv2.INTER_LANCZOS4,
+}
+
+# RTSPClientOptions fields read by from_options()
+TRANSFORM_OPTIONS = ('crop', 'decimate', 'resize_width', 'resize_height', 'interpolation', 'color')
+
+_CONVERSIONS = {
+    'gray': cv2.COLOR_BGR2GRAY,
+    'yuv': cv2.COLOR_BGR2YUV,
+    'i420': cv2.COLOR_BGR2YUV_I420,
+}
+
+
+class FrameTransform:
+    """Crops, downsamples, resizes and converts BGR frames into preallocated output buffers."""
+
+    def __init__(self, crop=None, decimate=1, width=0, height=0, interpolation='area', color='bgr', buffers=3):
+        """
+        Initializes the FrameTransform.
+
+        Args:
+            crop (tuple, optional): (x, y, w, h) region of the frame to keep, clipped to the frame.
+            decimate (int): Keep every n-th pixel of every n-th row, before resizing.
+            width (int): Output width, 0 keeps the (cropped, decimated) width or follows the height's ratio.
+            height (int): Output height, 0 keeps the height or follows the width's ratio.
+            interpolation (str): Resize interpolation, a key of INTERPOLATIONS.
+            color (str): Output pixel format, one of COLORS.
+            buffers (int): Output buffers apply() rotates through.
+
+        Raises:
+            ValueError: If an argument is out of range.
+        """
+        if crop is not None:
+            crop = tuple(int(v) for v in crop)
+            if len(crop) != 4 or crop[0] < 0 or crop[1] < 0 or crop[2] <= 0 or crop[3] <= 0:
+                raise ValueError(f"crop must be (x, y, w, h) with a positive size, got {crop}")
+        if int(decimate) < 1:
+            raise ValueError(f"decimate must be >= 1, got {decimate}")
+        if width < 0 or height < 0:
+            raise ValueError(f"Resize size must not be negative, got {width}x{height}")
+        if interpolation not in INTERPOLATIONS:
+            raise ValueError(f"Unknown interpolation {interpolation!r}, expected one of {tuple(INTERPOLATIONS)}")
+        if color not in COLORS:
+            raise ValueError(f"Unknown color {color!r}, expected one of {COLORS}")
+        self.crop = crop
+        self.decimate = int(decimate)
+        self.width = int(width)
+        self.height = int(height)
+        self.interpolation = interpolation
+        self.color = color
+        self.buffers = max(1, buffers)
+        self._input_shape = None
+        self._outputs = []
+        self._scaled = None  # BGR resize result, converted into an output buffer
+        self._size = None  # resize target (w, h), None without resizing
+
+    @classmethod
+    def from_options(cls, options, buffers=3):
+        """
+        Builds the transform of RTSPClientOptions fields (see TRANSFORM_OPTIONS).
+
+        Args:
+            options (dict): Option values, e.g. vars(RTSPClientOptions); missing ones keep their defaults.
+            buffers (int): Output buffers apply() rotates through.
+
+        Returns:
+            FrameTransform: The transform, or None when the options leave frames unchanged.
+
+        Raises:
+            ValueError: If an option is out of range.
+        """
+        transform = cls(crop=options.get('crop'), decimate=options.get('decimate', 1) or 1,
+                        width=options.get('resize_width', 0) or 0, height=options.get('resize_height', 0) or 0,
+                        interpolation=options.get('interpolation', 'area'), color=options.get('color', 'bgr'),
+                        buffers=buffers)
+        return None if transform.is_identity else transform
+
+    @property
+    def is_identity(self):
+        return (self.crop is None and self.decimate == 1 and not self.width and not self.height
+                and self.color == 'bgr')
+
+    def _region(self, frame):
+        """The cropped, decimated view of a frame."""
+        if self.crop is not None:
+            x, y, w, h = self.crop
+            if x >= frame.shape[1] or y >= frame.shape[0]:
+                raise ValueError(f"crop {self.crop} is outside the {frame.shape[1]}x{frame.shape[0]} frame")
+            frame = frame[y:y + h, x:x + w]
+        if self.decimate > 1:
+            frame = frame[::self.decimate, ::self.decimate]
+        return frame
+
+    def _allocate(self, region):
+        height, width = region.shape[:2]
+        if self.width or self.height:
+            out_w = self.width or max(1, round(width * self.height / height))
+            out_h = self.height or max(1, round(height * self.width / width))
+        else:
+            out_w, out_h = width, height
+        if self.color == 'i420':
+            out_w, out_h = max(2, out_w & ~1), max(2, out_h & ~1)  # 4:2:0 needs even sizes
+        self._size = (out_w, out_h) if (out_w, out_h) != (width, height) else None
+        if self.color == 'bgr':
+            shape = (out_h, out_w, 3)
+        elif self.color == 'gray':
+            shape = (out_h, out_w)
+        elif self.color == 'yuv':
+            shape = (out_h, out_w, 3)
+        else:
+            shape = (out_h * 3 // 2, out_w)
+        self._scaled = np.empty((out_h, out_w, 3), dtype=np.uint8) \
+            if self._size is not None and self.color != 'bgr' else None
+        self._outputs = [np.empty(shape, dtype=np.uint8) for _ in range(self.buffers)]
+
+    def apply(self, frame, index=0):
+        """
+        Transforms a BGR frame into output buffer `index`.
+
+        Args:
+            frame (numpy.ndarray): (h, w, 3) uint8 BGR frame, only read.
+            index (int): Output buffer to write, 0 <= index < buffers. The array returned for the same
+                index is overwritten by the next call with it.
+
+        Returns:
+            numpy.ndarray: The output buffer.
+
+        Raises:
+            ValueError: If the crop lies outside the frame.
+        """
+        region = self._region(frame)
+        if frame.shape != self._input_shape:
+            self._allocate(region)  # new buffers, arrays handed out before stay valid
+            self._input_shape = frame.shape
+        out = self._outputs[index]
+        if self._size is not None:
+            scaled = out if self._scaled is None else self._scaled
+            cv2.resize(region, self._size, dst=scaled, interpolation=INTERPOLATIONS[self.interpolation])
+            region = scaled
+        if self.color == 'bgr':
+            if region is not out:
+                np.copyto(out, region)
+        else:
+            cv2.cvtColor(region, _CONVERSIONS[self.color], dst=out)
+        return out
+
+    def __repr__(self):
+        parts = []
+        if self.crop is not None:
+            parts.append(f"crop={self.crop}")
+        if self.decimate > 1:
+            parts.append(f"decimate={self.decimate}")
+        if self.width or self.height:
+            parts.append(f"resize={self.width or '-'}x{self.height or '-'} {self.interpolation}")
+        if self.color != 'bgr':
+            parts.append(self.color)
+        return f"FrameTransform({', '.join(parts)})"
@@ -0,0 +1,164 @@
+# ingest_profile.py
+
+import os
+import cv2
+
+'''
+IngestProfile
+
+RTSP ingest 的 FFmpeg 參數組合。OpenCV 的 FFmpeg backend 在每次開啟 VideoCapture 時讀取
+環境變數 OPENCV_FFMPEG_CAPTURE_OPTIONS (格式: "key;value|key;value")，每台 camera 都在獨立的
+進程中執行，所以可以對每個進程設定不同的 profile。open/read timeout 則透過 VideoCapture 參數設定。
+
+內建 preset:
+- default: 不設定任何參數，與原本 cv2.VideoCapture(rtsp_url) 相同 (OpenCV 預設使用 TCP)；使用者自己設定的
+  OPENCV_FFMPEG_CAPTURE_OPTIONS 維持不變
+- lowest-latency: UDP、最小 probe、關閉 FFmpeg 的 buffer 與 reorder，延遲最低但掉封包時會花屏
+- most-robust: TCP、較大的 probe 與 socket buffer、較長的 timeout，適合訊號不穩的 Wi-Fi
+
+各 preset 的延遲可以用 python-test/bench_ingest_latency.py 量測。
+'''
+
+ENV_CAPTURE_OPTIONS = 'OPENCV_FFMPEG_CAPTURE_OPTIONS'
+_OPERATOR_CAPTURE_OPTIONS = os.environ.get(ENV_CAPTURE_OPTIONS)  # restored by profiles without options
+
+
+class IngestProfile:
+    """FFmpeg capture options used to open an RTSP stream."""
+
+    def __init__(self,
+                 rtsp_transport=None,
+                 probesize=None,
+                 analyzeduration=None,
+                 nobuffer=False,
+                 low_delay=False,
+                 buffer_size=None,
+                 max_delay=None,
+                 reorder_queue_size=None,
+                 open_timeout_ms=None,
+                 read_timeout_ms=None):
+        """
+        Initializes the IngestProfile. Options left as None keep the FFmpeg/OpenCV default.
+
+        Args:
+            rtsp_transport (str, optional): 'tcp' or 'udp'.
+            probesize (int, optional): Bytes probed to detect the stream, FFmpeg minimum is 32.
+            analyzeduration (int, optional): Microseconds analysed to detect the stream.
+            nobuffer (bool): Set fflags=nobuffer, do not buffer packets during probing.
+            low_delay (bool): Set flags=low_delay on the decoder.
+            buffer_size (int, optional): Socket receive buffer size in bytes.
+            max_delay (int, optional): Maximum demuxer delay in microseconds.
+            reorder_queue_size (int, optional): Packets buffered to reorder RTP (UDP only).
+            open_timeout_ms (int, optional): cv2.CAP_PROP_OPEN_TIMEOUT_MSEC.
+            read_timeout_ms (int, optional): cv2.CAP_PROP_READ_TIMEOUT_MSEC.
+        """
+        if rtsp_transport not in (None, 'tcp', 'udp'):
+            raise ValueError(f"rtsp_transport must be 'tcp' or 'udp', got {rtsp_transport!r}")
+        self.rtsp_transport = rtsp_transport
+        self.probesize = probesize
+        self.analyzeduration = analyzeduration
+        self.nobuffer = nobuffer
+        self.low_delay = low_delay
+        self.buffer_size = buffer_size
+        self.max_delay = max_delay
+        self.reorder_queue_size = reorder_queue_size
+        self.open_timeout_ms = open_timeout_ms
+        self.read_timeout_ms = read_timeout_ms
+
+    def ffmpeg_options(self):
+        """Returns the OPENCV_FFMPEG_CAPTURE_OPTIONS string, empty for FFmpeg defaults."""
+        options = []
+        if self.rtsp_transport:
+            options.append(('rtsp_transport', self.rtsp_transport))
+        if self.probesize is not None:
+            options.append(('probesize', self.probesize))
+        if self.analyzeduration is not None:
+            options.append(('analyzeduration', self.analyzeduration))
+        if self.nobuffer:
+            options.append(('fflags', 'nobuffer'))
+        if self.low_delay:
+            options.append(('flags', 'low_delay'))
+        if self.buffer_size is not None:
+            options.append(('buffer_size', self.buffer_size))
+        if self.max_delay is not None:
+            options.append(('max_delay', self.max_delay))
+        if self.reorder_queue_size is not None:
+            options.append(('reorder_queue_size', self.reorder_queue_size))
+        return '|'.join(f'{key};{value}' for key, value in options)
+
+    def capture_params(self):
+        """Returns the VideoCapture open parameters (timeouts)."""
+        params = []
+        if self.open_timeout_ms is not None:
+            params += [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(self.open_timeout_ms)]
+        if self.read_timeout_ms is not None:
+            params += [cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(self.read_timeout_ms)]
+        return params
+
+    def open(self, url):
+        """
+        Opens `url` with this profile. The environment variable is process wide, which is fine
+        because every RTSP client runs in its own process.
+
+        Returns:
+            cv2.VideoCapture: The capture, check isOpened().
+        """
+        options = self.ffmpeg_options()
+        if options:
+            os.environ[ENV_CAPTURE_OPTIONS] = options
+        elif _OPERATOR_CAPTURE_OPTIONS is not None:
+            os.environ[ENV_CAPTURE_OPTIONS] = _OPERATOR_CAPTURE_OPTIONS
+        else:
+            # only set by an earlier profile of this process
+            os.environ.pop(ENV_CAPTURE_OPTIONS, None)
+
+        params = self.capture_params()
+        if params:
+            return cv2.VideoCapture(url, cv2.CAP_FFMPEG, params)
+        return cv2.VideoCapture(url)
+
+    def __repr__(self):
+        return f"IngestProfile({self.ffmpeg_options() or 'defaults'}, params={self.capture_params()})"
+
+
+INGEST_PRESETS = {
+    'default': IngestProfile(),
+    'lowest-latency': IngestProfile(
+        rtsp_transport='udp',
+        probesize=32,
+        analyzeduration=0,
+        nobuffer=True,
+        low_delay=True,
+        buffer_size=1024 * 1024,
+        max_delay=0,
+        reorder_queue_size=0,
+        open_timeout_ms=5000,
+        read_timeout_ms=2000),
+    'most-robust': IngestProfile(
+        rtsp_transport='tcp',
+        probesize=5 * 1000 * 1000,
+        analyzeduration=5 * 1000 * 1000,
+        buffer_size=4 * 1024 * 1024,
+        max_delay=500 * 1000,
+        open_timeout_ms=15000,
+        read_timeout_ms=10000),
+}
+
+
+def get_ingest_profile(profile):
+    """
+    Resolves a preset name or an IngestProfile instance.
+
+    Args:
+        profile (str | IngestProfile | None): Preset name, profile, or None for 'default'.
+
+    Returns:
+        IngestProfile: The profile to open streams with.
+    """
+    if profile is None:
+        return INGEST_PRESETS['default']
+    if isinstance(profile, IngestProfile):
+        return profile
+    if profile not in INGEST_PRESETS:
+        raise ValueError(f"Unknown ingest profile {profile!r}, expected one of {list(INGEST_PRESETS)}")
+    return INGEST_PRESETS[profile]
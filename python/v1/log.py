@@ -0,0 +1,185 @@
+# log.py
+
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+'''
+Logging
+
+取代熱路徑上的 print:
+- setup_logging(): 'ameba' logger 只掛一個 QueueHandler，呼叫端只把 record 放進 queue 就返回，
+  由 QueueListener thread 寫到 stdout，console 慢或被重導時不會拖慢 RTSP / encoder thread
+- RateLimitFilter: 同一個 logger、level、訊息格式與 camera 的 record 在 interval 秒內最多輸出 burst 筆，
+  其餘只計數，下一筆輸出時附上 "N similar messages suppressed"；在放進 queue 之前就過濾掉，
+  被抑制的訊息幾乎沒有成本。訊息請用 logger.warning("... %s", value) 的格式，讓變動的值不影響比對
+- camera_logger(): 帶有 mac / ip / pid 的 LoggerAdapter，輸出為 "[mac ip pid] message"
+- fork 出來的子進程會自動重新啟動自己的 listener thread；spawn / forkserver 的子進程在入口呼叫
+  init_process(logging_settings())，設定由父進程經由參數傳入
+'''
+
+LOGGER_NAME = 'ameba'
+LOG_FORMAT = '%(asctime)s %(levelname)-7s %(context)s%(message)s'
+
+_listener = None
+_rate_limit = None
+_settings = {}
+_lock = threading.Lock()
+
+
+class RateLimitFilter(logging.Filter):
+    """Passes at most `burst` records per `interval` seconds for each message template and camera."""
+
+    def __init__(self, interval=5.0, burst=1):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.suppressed_total = 0
+        self._windows = {}  # key -> [window start, passed in window, suppressed since last output]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.interval <= 0:
+            return True
+        key = (record.name, record.levelno, str(record.msg), getattr(record, 'context', ''))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if len(self._windows) > 4096:
+                    # forget templates that went quiet, the dict must not grow with every message
+                    self._windows = {k: w for k, w in self._windows.items() if now - w[0] < self.interval}
+            elif window[1] < self.burst:
+                window[1] += 1
+                suppressed = window[2]
+                window[2] = 0
+            else:
+                window[2] += 1
+                self.suppressed_total += 1
+                return False
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar messages suppressed)"
+            record.args = None
+        return True
+
+
+class _ContextFilter(logging.Filter):
+    """Gives every record the `context` field used by LOG_FORMAT."""
+
+    def filter(self, record):
+        if not hasattr(record, 'context'):
+            record.context = ''
+        return True
+
+
+class CameraLoggerAdapter(logging.LoggerAdapter):
+    """Adds the camera's mac, ip and the process id to every record."""
+
+    def process(self, msg, kwargs):
+        kwargs.setdefault('extra', {})['context'] = self.extra['context']
+        return msg, kwargs
+
+
+def get_logger(name):
+    """Returns the logger of a module, below the 'ameba' logger."""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def camera_logger(name, mac=None, ip=None):
+    """
+    Returns a logger whose records carry the camera context.
+
+    Args:
+        name (str): Module name, as for get_logger().
+        mac (str, optional): Camera MAC address.
+        ip (str, optional): Camera IP address.
+    """
+    parts = [p for p in (mac, ip) if p] + [f"pid {os.getpid()}"]
+    return CameraLoggerAdapter(get_logger(name), {'context': f"[{' '.join(parts)}] "})
+
+
+def setup_logging(level=logging.INFO, rate_limit_interval=5.0, rate_limit_burst=1, stream=None):
+    """
+    Routes the 'ameba' loggers through a queue to a listener thread writing to `stream`.
+
+    Args:
+        level (int | str): Lowest level logged.
+        rate_limit_interval (float): Window of the RateLimitFilter in seconds, 0 disables it.
+        rate_limit_burst (int): Records of one template passed per window.
+        stream: Output stream, stdout by default.
+    """
+    global _listener, _rate_limit
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+        _settings.update(level=level, rate_limit_interval=rate_limit_interval,
+                         rate_limit_burst=rate_limit_burst, stream=stream)
+
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(logging.Formatter(LOG_FORMAT, datefmt='%H:%M:%S'))
+        log_queue = queue.SimpleQueue()
+        handler = logging.handlers.QueueHandler(log_queue)
+        handler.addFilter(_ContextFilter())
+        _rate_limit = RateLimitFilter(rate_limit_interval, rate_limit_burst)
+        handler.addFilter(_rate_limit)
+
+        logger = logging.getLogger(LOGGER_NAME)
+        for old in list(logger.handlers):
+            logger.removeHandler(old)
+        logger.addHandler(handler)
+        logger.setLevel(level)
+        logger.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, output)
+        _listener.start()
+
+
+def init_process(settings=None):
+    """
+    Sets up logging in a child process that did not inherit it (spawn / forkserver start method).
+
+    Args:
+        settings (dict, optional): logging_settings() of the parent, setup_logging() defaults otherwise.
+    """
+    if _listener is None:
+        setup_logging(**(settings or {}))
+
+
+def logging_settings():
+    """Arguments of this process's setup_logging() that can be passed to a child's init_process()."""
+    with _lock:
+        return {key: value for key, value in _settings.items() if key != 'stream'}  # streams do not pickle
+
+
+def stop_logging():
+    """Writes out the queued records and stops the listener thread."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def suppressed_count():
+    """Records dropped by the rate limit of this process so far."""
+    return _rate_limit.suppressed_total if _rate_limit else 0
+
+
+def _restart_in_child():
+    # the listener thread does not survive fork(); a forked child gets its own queue and thread
+    global _listener, _rate_limit, _lock
+    if _listener is not None:
+        _lock = threading.Lock()  # another thread may have held it at fork time
+        _listener = None
+        _rate_limit = None
+        setup_logging(**_settings)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_in_child)
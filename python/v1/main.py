@@ -1,12 +1,22 @@
 # main.py
 
 from server import Server
-import cv2
+from async_server import AsyncServer
 import os
-import queue
-import threading
 from mdns_service import MDNSService
-from utils import get_local_ip
+from encoder_pool import EncoderPool, SaveRequestDispatcher
+from frame_index import FrameIndex, FrameIndexWriter
+from frame_sync import FrameSync, FrameSetSaver
+from batch_callback import FrameBatcher
+from rate_control import RateController
+from motion_gate import MotionGate
+from mosaic_display import MosaicDisplay
+from worker_pool import RtspWorkerPool, worker_context
+from metrics import MetricsCollector, MetricsServer
+from log import setup_logging, stop_logging
+from profiling import enable_profiling, install_signal_dump, dump as dump_profile
+from segment_recorder import RecordingLauncher
+from utils import get_local_ip, FRAME_RING_SLOTS
 import time
 
 # TODO: 可以開關 opencv
@@ -27,37 +37,149 @@ import time
 SHOW_STREAM = True
 SAVE_PICTURE = True
 SAVE_EVERY_N_FRAME = 15
+# Serve every camera connection from one asyncio event loop instead of one thread per camera
+USE_ASYNC_SERVER = True
+# Encode JPEGs of every camera in one worker pool of this process, fed from the shared frame rings
+USE_CENTRAL_ENCODER = True
+ENCODER_WORKERS = os.cpu_count() or 1
+# Frames waiting to be saved per camera, and what to drop when the encoder or disk falls behind:
+# 'drop-oldest', 'drop-newest', 'block' (wait SAVE_QUEUE_TIMEOUT seconds) or 'sample-down'
+SAVE_QUEUE_SIZE = 8
+SAVE_QUEUE_POLICY = 'drop-oldest'
+SAVE_QUEUE_TIMEOUT = 0.1
+# With SHOW_STREAM off, only convert the frames that will be saved (grab() every frame, retrieve() one in
+# SAVE_EVERY_N_FRAME); the CPU saved per camera is printed when its RTSP client stops
+DECODE_ONLY_SAVED_FRAMES = True
+# FFmpeg options used to open each RTSP stream: 'default', 'lowest-latency' or 'most-robust' (see ingest_profile.py)
+INGEST_PROFILE = 'default'
+# With SHOW_STREAM on, show every camera in one tiled window refreshed PREVIEW_FPS times per second by a
+# single display process, instead of one full-rate window per RTSP process
+USE_MOSAIC_DISPLAY = True
+PREVIEW_FPS = 10
+MOSAIC_TILE_SIZE = (480, 270)
+# How a silent camera is detected: 'fixed' drops it HEARTBEAT_TIMEOUT seconds after its last heartbeat,
+# 'phi' learns each camera's heartbeat interval and drops it a few seconds after a missed one
+# (HEARTBEAT_TIMEOUT is used until a few intervals were seen, see failure_detector.py)
+HEARTBEAT_DETECTOR = 'fixed'
+HEARTBEAT_TIMEOUT = 30
+# Keep this many RTSP worker processes started (OpenCV already imported) and hand each registered camera to
+# one of them, so a camera's first frame only waits for the RTSP handshake; 0 starts a new process per camera
+RTSP_WORKER_POOL = 2
+# Serve per-camera pipeline metrics (FPS, reconnects, save queue, encode time, heartbeat age, CPU/RSS) in
+# Prometheus text format at http://METRICS_HOST:METRICS_PORT/metrics; 0 disables the endpoint
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108
+# Lowest level written by the ameba loggers ('DEBUG' also shows every heartbeat); each log message (per camera)
+# is written at most once per LOG_RATE_LIMIT seconds and the repeats are only counted, 0 writes all of them
+LOG_LEVEL = 'INFO'
+LOG_RATE_LIMIT = 5.0
+# Time one frame in PROFILE_SAMPLE_EVERY at every hot path stage (read, handoff, callback, display, encode, write,
+# see profiling.py) and print the latency table when a client stops or on `kill -USR1 <pid>`; 0 disables it
+PROFILE_SAMPLE_EVERY = 0
+# Record each camera's HEVC/H.264 stream as is (ffmpeg -c copy, no decoding) into RECORD_SEGMENT_SECONDS long
+# RECORD_CONTAINER ('mp4' or 'mkv') files under RECORD_DIR/<camera ip>/, listed with their time range in index.csv;
+# None disables it. Needs ffmpeg on PATH. RECORD_ONLY records without starting the decoding RTSP client
+RECORD_DIR = None
+RECORD_SEGMENT_SECONDS = 60
+RECORD_CONTAINER = 'mp4'
+RECORD_ONLY = False
+# How saved frames are stored: 'archive' appends them to per-camera segment files with a (seq, timestamp) index
+# under ARCHIVE_DIR/<camera ip>/ (see frame_archive.py, python-test/export_archive.py writes them out as JPEGs),
+# 'jpeg' writes one img/<camera ip>/<seq>.jpg file per frame
+SAVE_FORMAT = 'jpeg'
+ARCHIVE_DIR = 'archive'
+# Record every saved frame (camera, connection, seq, capture time, file / archive offset, size) in this SQLite
+# database (e.g. 'frames.db'), queried with frame_index.FrameIndex(FRAME_INDEX).query(camera, start_ms, end_ms);
+# None disables it
+FRAME_INDEX = None
+# Only save a frame when at least MOTION_MIN_CHANGED_RATIO of its pixels (compared downsampled, in grayscale) changed
+# by more than MOTION_PIXEL_THRESHOLD gray levels since the camera's last saved frame, plus one frame every
+# MOTION_KEEPALIVE seconds without motion (see motion_gate.py, e.g. 0.01); 0 saves every SAVE_EVERY_N_FRAME-th frame
+MOTION_MIN_CHANGED_RATIO = 0
+MOTION_PIXEL_THRESHOLD = 25
+MOTION_KEEPALIVE = 60.0
+# Assemble frames of all cameras captured within SYNC_TOLERANCE_MS of each other into frame sets (see frame_sync.py,
+# needs FRAME_RING_SLOTS > 0); 0 disables it. A camera without a frame in a set is waited for up to SYNC_MAX_WAIT
+# seconds, then SYNC_POLICY 'wait' drops the set, 'skip' leaves the camera out and 'pad' adds its latest frame.
+# One set every SYNC_SAVE_EVERY seconds is saved as SYNC_DIR/<set time ms>/<camera ip>.jpg
+SYNC_TOLERANCE_MS = 0
+SYNC_POLICY = 'wait'
+SYNC_MAX_WAIT = 0.1
+SYNC_SAVE_EVERY = 1.0
+SYNC_DIR = 'sync'
+# Hand the frames of all cameras to one batch callback (BatchCallback below) as a (n, H, W, 3) array of BATCH_SIZE
+# frames, or fewer when BATCH_TIMEOUT_MS passed since the first one, scaled to BATCH_FRAME_SHAPE; one frame in
+# BATCH_EVERY of each camera (see batch_callback.py, needs FRAME_RING_SLOTS > 0). 0 disables it
+BATCH_SIZE = 0
+BATCH_TIMEOUT_MS = 50
+BATCH_FRAME_SHAPE = (720, 1280, 3)
+BATCH_EVERY = 1
+# Crop, downsample, resize and convert every frame once in its RTSP process, before the frame ring, the callbacks,
+# saving and display see it (see frame_transform.py): RTSPClientOptions crop (x, y, w, h), decimate (keep every n-th
+# pixel), resize_width / resize_height (0 keeps the aspect ratio), interpolation ('nearest', 'linear', 'area', 'cubic',
+# 'lanczos') and color ('bgr', 'gray', 'yuv', 'i420'). Applies to every camera, change one camera at runtime with the
+# stream control set_options command; {} leaves frames as decoded
+FRAME_TRANSFORM = {}
+# Lower the frame rate and bitrate of every camera when the server CPU exceeds RATE_CPU_HIGH percent or the received
+# throughput exceeds 85% of RATE_LINK_MBPS (0 ignores it), raise them again below RATE_CPU_LOW (see rate_control.py).
+# Commands and acknowledgements go over the control connection, needs the RTSP.ino with command support; cameras
+# start at the top of RATE_FPS_RANGE / RATE_BITRATE_RANGE_MBPS, which should match RTSP_FPS / BIT_RATE_MPS
+RATE_CONTROL = False
+RATE_FPS_RANGE = (5, 30)
+RATE_BITRATE_RANGE_MBPS = (0.5, 4)
+RATE_CPU_HIGH = 85
+RATE_CPU_LOW = 60
+RATE_LINK_MBPS = 0
 
 
 class FrameCallback:
-    def __init__(self, n=5):
+    def __init__(self, n=5, save_queue=None, queue_size=8, queue_policy='drop-oldest', queue_timeout=0.1,
+                 archive_dir=None, index_path=None, motion_gate=None):
         """
         Initialize the FrameCallback instance.
 
         Args:
             n (int): Process every n frames.
+            save_queue (multiprocessing.Queue, optional): When set, frames that live in a FrameRing
+                are saved by the central EncoderPool of the main process instead of this process.
+            queue_size (int): Bound of the local save queue.
+            queue_policy (str): Drop policy of the local save queue, see frame_queue.POLICIES.
+            queue_timeout (float): Seconds to wait under the 'block' policy.
+            archive_dir (str, optional): Local pool appends frames to FrameArchives in this directory
+                instead of writing JPEG files.
+            index_path (str, optional): Local pool records the saved frames in this FrameIndex database.
+            motion_gate (MotionGate, optional): Skips every n-th frame that did not change enough.
         """
         self.n = n
+        self.archive_dir = archive_dir
+        self.index_path = index_path
+        self.frame_index = None
+        self.motion_gate = motion_gate
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy
+        self.queue_timeout = queue_timeout
         self.frame_count = {}
-        self.queue = None  # Queue to store frames for saving
-        self.stop_thread = False
-        # Initialize the worker thread as None (lazy initialization)
-        self.worker_thread = None
-        self.condition = None  # Condition variable for event-driven logic
+        self.save_queue = save_queue
+        # Local encoder pool, created lazily inside the RTSP process
+        self.encoder_pool = None
         self.initialized = False
 
     def initialize_worker(self):
         """
-        Initialize the worker thread and queue only once using lru_cache to ensure single execution.
+        Initialize the local encoder pool only once, in the process that calls back.
         """
         # variable init
         self.initialized = True
-        self.queue = queue.Queue()  # Initialize the queue
-        self.worker_thread = threading.Thread(target=self.save_frame_worker)
-        self.condition = threading.Condition()
+        if self.index_path:
+            self.frame_index = FrameIndexWriter(self.index_path)
+        self.encoder_pool = EncoderPool(num_workers=1, queue_size=self.queue_size,
+                                        queue_policy=self.queue_policy, queue_timeout=self.queue_timeout,
+                                        archive_dir=self.archive_dir, frame_index=self.frame_index)
 
         # thread starts
-        self.worker_thread.start()
+        if self.frame_index is not None:
+            self.frame_index.start()
+        self.encoder_pool.start()
 
     def __call__(self, frame, other_info):
         """
@@ -65,12 +187,10 @@ class FrameCallback:
 
         Args:
             frame (numpy.ndarray): The captured frame.
-            other_info (dict): Dictionary containing 'ip' and 'seq' keys.
+            other_info (dict): Dictionary containing 'ip', 'mac', 'seq', 'session' and 'timestamp' keys,
+                'ring' when the frame is also in a shared memory FrameRing, and 'reused_buffer' when the
+                frame is a FrameTransform output buffer that must be copied to outlive the call.
         """
-        # Ensure worker thread is initialized only once
-        if self.initialized == False:
-            self.initialize_worker()
-
         ip = other_info.get('ip')
         seq = other_info.get('seq')
 
@@ -84,72 +204,107 @@ class FrameCallback:
 
         self.frame_count[ip] += 1
 
-        # Process every n frames
-        if self.frame_count[ip] % self.n == 0:
+        # Process every n frames, counting the frames the RTSP client skipped without decoding
+        step = max(1, self.n // other_info.get('decode_every', 1))
+        if self.frame_count[ip] % step == 0:
             # Define the save directory based on IP address
             save_dir = os.path.join("img", ip)
             filename = f"{seq}.jpg"
             filepath = os.path.join(save_dir, filename)
 
-            # Use the condition to notify the worker thread when a new frame is ready
             if SAVE_PICTURE:
-                with self.condition:
-                    self.queue.put((frame, filepath))
-                    self.condition.notify()  # Notify worker thread
-
-    def save_frame_worker(self):
-        """
-        Worker thread to save frames from the queue.
+                scores = other_info.get('scores')
+                if self.motion_gate is not None:
+                    save, changed = self.motion_gate.check(ip, frame, other_info.get('timestamp'))
+                    if not save:
+                        return
+                    scores = dict(scores or {}, motion=changed)
+                ring = other_info.get('ring')
+                if self.save_queue is not None and ring:
+                    # only the slot reference crosses the process boundary
+                    self.save_queue.put((ring, seq, filepath, ip, other_info.get('mac'), other_info.get('session'),
+                                         scores))
+                else:
+                    # Ensure the local pool is initialized only once
+                    if self.initialized == False:
+                        self.initialize_worker()
+                    if other_info.get('reused_buffer'):
+                        frame = frame.copy()
+                    self.encoder_pool.submit(frame, filepath, ip, seq, other_info.get('timestamp'),
+                                             other_info.get('mac'), other_info.get('session'), scores)
+
+    def metrics(self):
         """
-        while True:
-            with self.condition:
-                while self.queue.empty() and not self.stop_thread:
-                    self.condition.wait()  # Wait until notified or stop_thread is set
-
-                # If stop_thread is set and queue is empty, exit the loop
-                if self.stop_thread and self.queue.empty():
-                    break
-
-                # Get the frame and filepath from the queue
-                frame, filepath = self.queue.get()
-
-            # Process the frame outside of the lock
-            save_dir = os.path.dirname(filepath)
+        Statistics of the local encoder pool, reported by the RTSP process to metrics.py.
 
-            # Ensure the save directory exists
-            os.makedirs(save_dir, exist_ok=True)
-
-            # Save the frame to the file
-            success = cv2.imwrite(filepath, frame)
-            if success:
-                pass
-            else:
-                print(f"Failed to save frame to {filepath}")
+        Returns:
+            dict: EncoderPool.stats() of this process, empty when frames go to the central encoder.
+        """
+        return self.encoder_pool.stats() if self.encoder_pool is not None else {}
 
-            # Mark the task as done
-            self.queue.task_done()
+    def gate_stats(self, camera):
+        """
+        Motion gate decisions of a camera, reported by the RTSP process to metrics.py.
 
-    def stop(self):
+        Returns:
+            dict: MotionGate.stats() of the camera, empty without a motion gate.
         """
-        Stop the worker thread and ensure all frames in the queue are saved before stopping.
+        if self.motion_gate is None:
+            return {}
+        return self.motion_gate.stats(camera).get(camera, {})
+
+    def stop(self, timeout=None):
         """
-        with self.condition:
-            self.stop_thread = True
-            self.condition.notify_all()  # Wake up the worker thread if it's waiting
+        Stop the local encoder pool and ensure all queued frames are saved before stopping.
 
+        Args:
+            timeout (float, optional): Seconds to wait for the queue, frames still queued after that
+                are dropped. None waits for all of them.
+        """
         print(f'frame count: {self.frame_count}')
 
-        if self.worker_thread is not None:
+        if self.encoder_pool is not None:
             # Wait until the queue is empty before stopping
             print("Waiting for the queue to be empty...")
-            self.queue.join()  # Block until all tasks are done
-
-            # Signal the thread to stop
-            self.worker_thread.join()
+            self.encoder_pool.stop(timeout)
+            self.encoder_pool.print_stats()
+            if self.frame_index is not None:
+                self.frame_index.stop()
+                self.frame_index = None
             print("Worker thread stopped after processing all frames.")
+            # a pooled RTSP worker (worker_pool.py) calls back for its next camera with the same instance
+            self.encoder_pool = None
+            self.initialized = False
+        self.frame_count = {}
+
+
+
+class BatchCallback:
+    """
+    Example batch callback: one vectorized call per batch of frames from every camera.
+    """
+
+    def __init__(self):
+        self.brightness = {}
 
+    def __call__(self, frames, meta, cameras):
+        """
+        Args:
+            frames (numpy.ndarray): (n, H, W, 3) uint8 batch, reused after this call returns.
+            meta (numpy.ndarray): (n,) batch_callback.META_DTYPE with 'camera', 'seq', 'timestamp',
+                'height' and 'width' of each frame.
+            cameras (list): IP address of each meta['camera'] index.
+        """
+        # replace with the analytics model, copy whatever has to outlive the call
+        means = frames[:, ::8, ::8].mean(axis=(1, 2, 3))
+        for camera, mean in zip(meta['camera'], means):
+            self.brightness[cameras[camera]] = float(mean)
 
 if __name__ == "__main__":
+    # before the worker pool and the display are started: the display inherits it, the pooled workers
+    # (forkserver) are handed logging_settings() instead
+    setup_logging(level=LOG_LEVEL, rate_limit_interval=LOG_RATE_LIMIT)
+    enable_profiling(PROFILE_SAMPLE_EVERY)
     current_ip = get_local_ip()
 
     # start mDNS service on local network
@@ -170,12 +325,153 @@ if __name__ == "__main__":
     print(f"SHOW_STREAM: {SHOW_STREAM}")
     print(f"SAVE_PICTURE: : {SAVE_PICTURE}")
     print(f"SAVE_EVERY_N_FRAME: {SAVE_EVERY_N_FRAME}")
+    print(f"USE_ASYNC_SERVER: {USE_ASYNC_SERVER}")
+    print(f"USE_CENTRAL_ENCODER: {USE_CENTRAL_ENCODER} (ENCODER_WORKERS: {ENCODER_WORKERS})")
+    print(f"SAVE_QUEUE: {SAVE_QUEUE_SIZE} frames per camera, policy {SAVE_QUEUE_POLICY}")
+    print(f"DECODE_ONLY_SAVED_FRAMES: {DECODE_ONLY_SAVED_FRAMES}")
+    print(f"INGEST_PROFILE: {INGEST_PROFILE}")
+    print(f"USE_MOSAIC_DISPLAY: {USE_MOSAIC_DISPLAY} (PREVIEW_FPS: {PREVIEW_FPS})")
+    print(f"RTSP_WORKER_POOL: {RTSP_WORKER_POOL}")
+    print(f"METRICS: {f'http://{METRICS_HOST}:{METRICS_PORT}/metrics' if METRICS_PORT else 'off'}")
+    print(f"HEARTBEAT_DETECTOR: {HEARTBEAT_DETECTOR} (HEARTBEAT_TIMEOUT: {HEARTBEAT_TIMEOUT} s)")
+    print(f"LOG_LEVEL: {LOG_LEVEL} (LOG_RATE_LIMIT: {LOG_RATE_LIMIT} s)")
+    print(f"PROFILE_SAMPLE_EVERY: {PROFILE_SAMPLE_EVERY}")
+    print(f"RECORD_DIR: {RECORD_DIR} ({RECORD_SEGMENT_SECONDS} s {RECORD_CONTAINER} segments, "
+          f"RECORD_ONLY: {RECORD_ONLY})")
+    print(f"SAVE_FORMAT: {SAVE_FORMAT}" + (f" (ARCHIVE_DIR: {ARCHIVE_DIR})" if SAVE_FORMAT == 'archive' else ''))
+    print(f"FRAME_INDEX: {FRAME_INDEX}")
+    print(f"MOTION_MIN_CHANGED_RATIO: {MOTION_MIN_CHANGED_RATIO} (MOTION_PIXEL_THRESHOLD: {MOTION_PIXEL_THRESHOLD}, "
+          f"MOTION_KEEPALIVE: {MOTION_KEEPALIVE} s)")
+    print(f"SYNC_TOLERANCE_MS: {SYNC_TOLERANCE_MS} (SYNC_POLICY: {SYNC_POLICY}, SYNC_MAX_WAIT: {SYNC_MAX_WAIT} s, "
+          f"SYNC_SAVE_EVERY: {SYNC_SAVE_EVERY} s)")
+    print(f"BATCH_SIZE: {BATCH_SIZE} (BATCH_TIMEOUT_MS: {BATCH_TIMEOUT_MS}, BATCH_FRAME_SHAPE: {BATCH_FRAME_SHAPE}, "
+          f"BATCH_EVERY: {BATCH_EVERY})")
+    print(f"FRAME_TRANSFORM: {FRAME_TRANSFORM or 'off'}")
+    print(f"RATE_CONTROL: {RATE_CONTROL} (RATE_FPS_RANGE: {RATE_FPS_RANGE}, RATE_BITRATE_RANGE_MBPS: "
+          f"{RATE_BITRATE_RANGE_MBPS}, RATE_CPU_HIGH / LOW: {RATE_CPU_HIGH} / {RATE_CPU_LOW}, "
+          f"RATE_LINK_MBPS: {RATE_LINK_MBPS or 'off'})")
     print(" ")
     print("##########################################################################")
     print("Please Change `SHOW_STREAM` to False if CPU usage is too high!!")
     time.sleep(5)
 
+    # pooled workers are not forked from this process, the queue must come from their context
+    save_queue = worker_context().Queue() if USE_CENTRAL_ENCODER else None
+    archive_dir = ARCHIVE_DIR if SAVE_FORMAT == 'archive' else None
+
+    motion_gate = None
+    if MOTION_MIN_CHANGED_RATIO > 0:
+        motion_gate = MotionGate(min_changed_ratio=MOTION_MIN_CHANGED_RATIO, pixel_threshold=MOTION_PIXEL_THRESHOLD,
+                                 keepalive=MOTION_KEEPALIVE)
     # 2 pic per sec
-    frame_callback = FrameCallback(n=SAVE_EVERY_N_FRAME)
-    server = Server(frame_callback=frame_callback, show_stream=SHOW_STREAM)
+    frame_callback = FrameCallback(n=SAVE_EVERY_N_FRAME, save_queue=save_queue, queue_size=SAVE_QUEUE_SIZE,
+                                   queue_policy=SAVE_QUEUE_POLICY, queue_timeout=SAVE_QUEUE_TIMEOUT,
+                                   archive_dir=archive_dir, index_path=FRAME_INDEX, motion_gate=motion_gate)
+    worker_pool = None
+    if RTSP_WORKER_POOL > 0:
+        # workers, including the replacements started later, come from a fork server (see worker_pool.py)
+        worker_pool = RtspWorkerPool(frame_callback=frame_callback, size=RTSP_WORKER_POOL)
+        worker_pool.start()
+    server_cls = AsyncServer if USE_ASYNC_SERVER else Server
+    rtsp_options = {'ingest_profile': INGEST_PROFILE, 'profile_sample_every': PROFILE_SAMPLE_EVERY}
+    if DECODE_ONLY_SAVED_FRAMES and not SHOW_STREAM:
+        rtsp_options.update(decode_mode='sampled', sample_every=SAVE_EVERY_N_FRAME)
+    rtsp_options.update(FRAME_TRANSFORM)
+    display = None
+    if SHOW_STREAM and USE_MOSAIC_DISPLAY and FRAME_RING_SLOTS > 0:
+        display = MosaicDisplay(preview_fps=PREVIEW_FPS, tile_width=MOSAIC_TILE_SIZE[0],
+                                tile_height=MOSAIC_TILE_SIZE[1])
+        display.start()
+    rtsp_launcher = worker_pool.launch if worker_pool else None
+    if RECORD_DIR:
+        rtsp_launcher = RecordingLauncher(RECORD_DIR, segment_seconds=RECORD_SEGMENT_SECONDS,
+                                          container=RECORD_CONTAINER, launcher=rtsp_launcher,
+                                          record_only=RECORD_ONLY).launch
+    server = server_cls(frame_callback=frame_callback, show_stream=SHOW_STREAM and display is None,
+                        rtsp_options=rtsp_options, display=display,
+                        failure_detector=HEARTBEAT_DETECTOR, heartbeat_timeout=HEARTBEAT_TIMEOUT,
+                        rtsp_launcher=rtsp_launcher)
+    if PROFILE_SAMPLE_EVERY > 0:
+        # every RTSP process prints its own table, the main one adds ring_copy / encode / write
+        # only RTSP processes install the handler, SIGUSR1 would end an ffmpeg recorder
+        install_signal_dump(forward=lambda: [info['process'].pid
+                                             for info in server.camera_manager.get_cameras().values()
+                                             if hasattr(info['process'], 'send')])
+
+    use_sync = SYNC_TOLERANCE_MS > 0 and FRAME_RING_SLOTS > 0
+    frame_index = None
+    if FRAME_INDEX and (USE_CENTRAL_ENCODER or use_sync):
+        frame_index = FrameIndexWriter(FRAME_INDEX)
+        frame_index.start()
+    elif FRAME_INDEX:
+        FrameIndex(FRAME_INDEX).close()  # only the RTSP processes write it, a bad path must fail here already
+    if USE_CENTRAL_ENCODER:
+        encoder_pool = EncoderPool(num_workers=ENCODER_WORKERS, queue_size=SAVE_QUEUE_SIZE,
+                                   queue_policy=SAVE_QUEUE_POLICY, queue_timeout=SAVE_QUEUE_TIMEOUT,
+                                   archive_dir=archive_dir, frame_index=frame_index)
+        encoder_pool.start()
+        dispatcher = SaveRequestDispatcher(save_queue, encoder_pool, server.camera_manager)
+        dispatcher.start()
+
+    frame_sync = None
+    if use_sync:
+        # JPEG files per set, apart from the frames saved one camera at a time
+        sync_pool = EncoderPool(num_workers=1, queue_size=SAVE_QUEUE_SIZE, frame_index=frame_index)
+        sync_pool.start()
+        frame_sync = FrameSync(server.camera_manager, FrameSetSaver(sync_pool, SYNC_DIR, every=SYNC_SAVE_EVERY),
+                               tolerance=SYNC_TOLERANCE_MS / 1000, policy=SYNC_POLICY, max_wait=SYNC_MAX_WAIT)
+        frame_sync.start()
+
+    frame_batcher = None
+    if BATCH_SIZE > 0 and FRAME_RING_SLOTS > 0:
+        frame_batcher = FrameBatcher(server.camera_manager, BatchCallback(), batch_size=BATCH_SIZE,
+                                     timeout=BATCH_TIMEOUT_MS / 1000, shape=BATCH_FRAME_SHAPE, every=BATCH_EVERY)
+        frame_batcher.start()
+
+    rate_controller = None
+    if RATE_CONTROL:
+        # RTSP.ino's BIT_RATE_MPS counts 1024 * 1024 bit/s
+        bitrate_range = tuple(int(mbps * 1024 * 1024) for mbps in RATE_BITRATE_RANGE_MBPS)
+        rate_controller = RateController(server.camera_manager, fps_range=RATE_FPS_RANGE, bitrate_range=bitrate_range,
+                                         cpu_high=RATE_CPU_HIGH, cpu_low=RATE_CPU_LOW,
+                                         link_capacity=RATE_LINK_MBPS * 1e6)
+        rate_controller.start()
+
+    metrics_server = None
+    if METRICS_PORT:
+        collector = MetricsCollector(server.camera_manager, encoder_pool=encoder_pool if USE_CENTRAL_ENCODER else None,
+                                     dispatcher=dispatcher if USE_CENTRAL_ENCODER else None, worker_pool=worker_pool,
+                                     frame_sync=frame_sync, frame_batcher=frame_batcher,
+                                     rate_controller=rate_controller)
+        collector.start()
+        metrics_server = MetricsServer(collector, host=METRICS_HOST, port=METRICS_PORT)
+        metrics_server.start()
+
     server.start()
+
+    if metrics_server is not None:
+        metrics_server.stop()
+        collector.stop()
+
+    if rate_controller is not None:
+        rate_controller.stop()
+    if frame_batcher is not None:
+        frame_batcher.stop()
+    if frame_sync is not None:
+        frame_sync.stop()
+        sync_pool.stop()
+    if USE_CENTRAL_ENCODER:
+        dispatcher.stop()
+        encoder_pool.stop()
+        encoder_pool.print_stats()
+    if frame_index is not None:
+        frame_index.stop()
+    dump_profile()
+
+    if display is not None:
+        display.stop()
+
+    if worker_pool is not None:
+        worker_pool.stop()
+
+    stop_logging()
@@ -0,0 +1,386 @@
+# metrics.py
+
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from camera_commands import RESULTS
+from log import suppressed_count
+from motion_gate import DECISIONS
+from profiling import get_profiler, QUANTILES
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+'''
+Metrics
+
+以 Prometheus text exposition format 提供每台 camera 的 pipeline 狀態，取代只能看 console 的 camera table:
+- RTSP 子進程: MetricsCollector 每 interval 秒經由 command pipe (stream_control.py 的 'metrics' command)
+  向每個 RTSP 進程要一份 RTSPClient.metrics()，加上該進程的 CPU 時間與 RSS，下一輪時讀回來
+  (不需要另外的 queue，worker pool 的 worker 也可以使用)
+- 主進程: CameraManager 的 heartbeat 年齡與 deadline、中央 EncoderPool 的 queue / encode / 寫入統計、
+  SaveRequestDispatcher 來不及複製的 frame、RtspWorkerPool 的 worker 數量、主進程的 CPU / RSS
+- segment_recorder.py 錄影時，每台 camera 的錄影狀態、完成的片段數與 bytes
+- frame_sync.py 開啟時，組成、部分與丟棄的 frame set 數，set 內的 skew，以及每台 camera 對上、缺少、補上的 frame 數
+- batch_callback.py 開啟時，batch 與 frame 數、丟棄的 frame 與 batch callback 的耗時
+- motion_gate.py 開啟時，每台 camera 因變化、keepalive 存下與略過的 frame 數，以及最近一次的變化比例
+- profiling.py 開啟時，每個 stage 的延遲以 ameba_stage_seconds summary (p50 / p90 / p99) 輸出
+- 每台 camera 的 command (camera_commands.py) 依結果的數量與是否支援 command；rate_control.py 開啟時，
+  每台 camera 的目標 fps 與 bitrate，以及 controller 讀到的 CPU 與 throughput
+- MetricsServer: http://<host>:<port>/metrics，ThreadingHTTPServer 在背景 thread 執行
+
+Counter 以 _total 結尾，可以在 Prometheus 以 rate() 計算 FPS 與 drop rate。RSS 需要 psutil，沒有安裝時省略。
+'''
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def process_usage():
+    """
+    CPU time and memory of the calling process.
+
+    Returns:
+        dict: 'cpu_seconds', 'pid', and 'rss_bytes' when psutil is installed.
+    """
+    usage = {'cpu_seconds': time.process_time(), 'pid': os.getpid()}
+    if psutil is not None:
+        usage['rss_bytes'] = psutil.Process().memory_info().rss
+    return usage
+
+
+def _format_value(value):
+    # exact integers for counters like bytes written, repr() keeps the precision of floats
+    return str(int(value)) if isinstance(value, int) else repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_metrics(families):
+    """
+    Renders metric families in the text exposition format.
+
+    Args:
+        families (list): (name, type, help, samples) tuples, samples being (labels dict, value) pairs
+            or (suffix, labels dict, value) for the _sum / _count samples of a summary.
+
+    Returns:
+        str: The exposition text.
+    """
+    lines = []
+    for name, metric_type, help_text, samples in families:
+        if not samples:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for sample in samples:
+            suffix, labels, value = sample if len(sample) == 3 else ('', *sample)
+            label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            value = _format_value(value)
+            lines.append(f"{name}{suffix}{{{label_text}}} {value}" if label_text else f"{name}{suffix} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsCollector:
+    """Gathers the metrics of the main process and, through their command pipes, of every RTSP process."""
+
+    def __init__(self, camera_manager, encoder_pool=None, dispatcher=None, worker_pool=None, frame_sync=None,
+                 frame_batcher=None, rate_controller=None, interval=2.0):
+        """
+        Initializes the MetricsCollector.
+
+        Args:
+            camera_manager (CameraManager): Source of the cameras and their RTSP process handles.
+            encoder_pool (EncoderPool, optional): The central encoder.
+            dispatcher (SaveRequestDispatcher, optional): Feeds the central encoder.
+            worker_pool (RtspWorkerPool, optional): Pool the RTSP clients run on.
+            frame_sync (FrameSync, optional): Cross-camera frame set assembly.
+            frame_batcher (FrameBatcher, optional): Batch callback across cameras.
+            rate_controller (RateController, optional): Adjusts the frame rate and bitrate of the cameras.
+            interval (float): Seconds between metrics requests to the RTSP processes.
+        """
+        self.camera_manager = camera_manager
+        self.encoder_pool = encoder_pool
+        self.frame_sync = frame_sync
+        self.frame_batcher = frame_batcher
+        self.rate_controller = rate_controller
+        self.dispatcher = dispatcher
+        self.worker_pool = worker_pool
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._request_loop, name='MetricsCollector', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _request_loop(self):
+        while not self.stop_event.is_set():
+            for info in self.camera_manager.get_cameras().values():
+                process = info['process']
+                if hasattr(process, 'request_metrics'):
+                    process.poll()  # reads the reply to the previous request
+                    process.request_metrics()
+            self.stop_event.wait(self.interval)
+
+    def collect(self):
+        """
+        Returns:
+            list: Metric families for format_metrics().
+        """
+        now = time.time()
+        monotonic_now = time.monotonic()
+        cameras = self.camera_manager.get_cameras()
+        f = {}
+
+        def add(name, metric_type, help_text, sample):
+            f.setdefault(name, (name, metric_type, help_text, []))[3].append(sample)
+
+        add('ameba_cameras_connected', 'gauge', 'Cameras registered with the server.', ({}, len(cameras)))
+        by_cam_ip = {}
+        for ip, info in cameras.items():
+            labels = {'camera': ip, 'mac': info['mac']}
+            by_cam_ip[info['ip']] = labels
+            add('ameba_camera_heartbeat_age_seconds', 'gauge', 'Seconds since the last heartbeat.',
+                (labels, now - info['last_heartbeat']))
+            if info.get('deadline') is not None:
+                add('ameba_camera_heartbeat_deadline_seconds', 'gauge',
+                    'Seconds until the camera is dropped without another heartbeat.',
+                    (labels, info['deadline'] - monotonic_now))
+
+            if info.get('control') is not None:
+                self._add_commands(add, labels, info['control'].stats())
+            recording = getattr(info['process'], 'recording_stats', None)
+            if recording is not None:
+                self._add_recording(add, labels, recording())
+            child = getattr(info['process'], 'metrics', None)
+            if not child:
+                continue
+            add('ameba_camera_up', 'gauge', 'Whether the RTSP stream is open.', (labels, int(child['connected'])))
+            add('ameba_camera_paused', 'gauge', 'Whether the stream is paused by a command.',
+                (labels, int(child['paused'])))
+            add('ameba_camera_ingest_fps', 'gauge', 'Smoothed frame rate seen by the RTSP client.',
+                (labels, child['fps']))
+            add('ameba_camera_frames_total', 'counter', 'Frames handed to the frame callback.',
+                (labels, child['frames']))
+            add('ameba_camera_frames_grabbed_total', 'counter', 'Frames read from the stream.',
+                (labels, child['grabbed']))
+            add('ameba_camera_frames_decoded_total', 'counter', 'Frames converted to BGR images.',
+                (labels, child['decoded']))
+            add('ameba_camera_read_failures_total', 'counter', 'Frame reads that returned nothing.',
+                (labels, child['read_failures']))
+            add('ameba_camera_reconnects_total', 'counter', 'Streams reopened after the first connection.',
+                (labels, child['reconnects']))
+            add('ameba_rtsp_process_log_suppressed_total', 'counter', 'Log records dropped by the rate limit.',
+                (labels, child.get('log_suppressed', 0)))
+            add('ameba_rtsp_process_cpu_seconds_total', 'counter', 'CPU time of the RTSP process.',
+                (labels, child['cpu_seconds']))
+            if 'rss_bytes' in child:
+                add('ameba_rtsp_process_resident_memory_bytes', 'gauge', 'Resident memory of the RTSP process.',
+                    (labels, child['rss_bytes']))
+            add('ameba_camera_metrics_age_seconds', 'gauge', 'Age of the RTSP process metrics.',
+                (labels, now - info['process'].metrics_time))
+            self._add_profile(add, labels, child.get('profile', {}))
+            if child.get('motion_gate'):
+                self._add_motion_gate(add, labels, child['motion_gate'])
+            # frames saved inside the RTSP process when the central encoder is off
+            for camera, stats in child.get('encoder', {}).items():
+                if camera != 'total':
+                    self._add_encoder(add, by_cam_ip.get(camera, labels), stats)
+
+        if self.encoder_pool is not None:
+            for camera, stats in self.encoder_pool.stats().items():
+                if camera != 'total':
+                    self._add_encoder(add, by_cam_ip.get(camera, {'camera': camera, 'mac': ''}), stats)
+        for camera, stages in get_profiler().snapshot().items():
+            self._add_profile(add, by_cam_ip.get(camera, {'camera': camera, 'mac': ''}), stages)
+        if self.dispatcher is not None:
+            add('ameba_save_requests_missed_total', 'counter',
+                'Save requests whose frame was overwritten in the ring before it was copied.',
+                ({}, self.dispatcher.missed))
+        if self.worker_pool is not None:
+            stats = self.worker_pool.stats()
+            for state in ('idle', 'busy'):
+                add('ameba_rtsp_workers', 'gauge', 'RTSP worker processes of the pool.', ({'state': state}, stats[state]))
+            for kind in ('warm', 'cold'):
+                add('ameba_rtsp_worker_launches_total', 'counter', 'Cameras started on a pooled or a new worker.',
+                    ({'kind': kind}, stats[f'{kind}_launches']))
+
+        if self.frame_sync is not None:
+            self._add_sync(add, self.frame_sync.stats(), by_cam_ip)
+        if self.frame_batcher is not None:
+            self._add_batches(add, self.frame_batcher.stats())
+        if self.rate_controller is not None:
+            self._add_rate_control(add, self.rate_controller.stats(), cameras)
+
+        add('ameba_main_process_log_suppressed_total', 'counter',
+            'Log records of the main process dropped by the rate limit.', ({}, suppressed_count()))
+        usage = process_usage()
+        add('ameba_main_process_cpu_seconds_total', 'counter', 'CPU time of the main process.',
+            ({}, usage['cpu_seconds']))
+        if 'rss_bytes' in usage:
+            add('ameba_main_process_resident_memory_bytes', 'gauge', 'Resident memory of the main process.',
+                ({}, usage['rss_bytes']))
+        return list(f.values())
+
+    @staticmethod
+    def _add_encoder(add, labels, stats):
+        add('ameba_save_queue_depth', 'gauge', 'Frames waiting for a JPEG encoder.', (labels, stats.get('depth', 0)))
+        add('ameba_save_queue_max_depth', 'gauge', 'Deepest the save queue has been.',
+            (labels, stats.get('max_depth', 0)))
+        add('ameba_save_queue_enqueued_total', 'counter', 'Frames queued for saving.',
+            (labels, stats.get('enqueued', 0)))
+        add('ameba_save_queue_dropped_total', 'counter', 'Frames dropped by the save queue policy.',
+            (labels, stats.get('dropped', 0)))
+        add('ameba_encode_seconds', 'summary', 'JPEG encode time.',
+            ('_sum', labels, stats['encode_avg_ms'] * stats['frames'] / 1000))
+        add('ameba_encode_seconds', 'summary', 'JPEG encode time.', ('_count', labels, stats['frames']))
+        add('ameba_encode_max_seconds', 'gauge', 'Longest JPEG encode.', (labels, stats['encode_max_ms'] / 1000))
+        add('ameba_encode_failures_total', 'counter', 'Frames that failed to encode.', (labels, stats['failed']))
+        add('ameba_written_bytes_total', 'counter', 'JPEG bytes written to disk.', (labels, stats['bytes']))
+
+    @staticmethod
+    def _add_recording(add, labels, stats):
+        add('ameba_recording_up', 'gauge', 'Whether ffmpeg is recording the camera.', (labels, int(stats['recording'])))
+        add('ameba_recording_segments_total', 'counter', 'Segments finished by the recorder.',
+            (labels, stats['segments']))
+        add('ameba_recording_bytes_total', 'counter', 'Bytes of the finished segments.', (labels, stats['bytes']))
+        add('ameba_recording_restarts_total', 'counter', 'Times ffmpeg exited and was restarted.',
+            (labels, stats['restarts']))
+
+    @staticmethod
+    def _add_sync(add, stats, by_cam_ip):
+        sets = {'complete': stats['sets'] - stats['partial'], 'partial': stats['partial'], 'dropped': stats['dropped']}
+        for result, count in sets.items():
+            add('ameba_sync_sets_total', 'counter', 'Frame sets by result (partial: a camera missing or padded).',
+                ({'result': result}, count))
+        help_text = 'Seconds between the first and the last frame of a set, quantiles are histogram bin upper bounds.'
+        skew = stats['skew']
+        for q in QUANTILES:
+            add('ameba_sync_skew_seconds', 'summary', help_text, ({'quantile': str(q)}, skew[q]))
+        add('ameba_sync_skew_seconds', 'summary', help_text, ('_sum', {}, skew['sum']))
+        add('ameba_sync_skew_seconds', 'summary', help_text, ('_count', {}, skew['count']))
+        for camera, s in stats['cameras'].items():
+            labels = by_cam_ip.get(camera, {'camera': camera, 'mac': s['mac'] or ''})
+            for result in ('synced', 'missing', 'padded', 'overwritten'):
+                add('ameba_sync_frames_total', 'counter', 'Frame set slots of a camera by result.',
+                    (dict(labels, result=result), s[result]))
+
+    @staticmethod
+    def _add_batches(add, stats):
+        add('ameba_batch_batches_total', 'counter', 'Batches handed to the batch callback.', ({}, stats['batches']))
+        add('ameba_batch_frames_total', 'counter', 'Frames handed to the batch callback.', ({}, stats['frames']))
+        for reason in ('dropped', 'overwritten'):
+            add('ameba_batch_lost_frames_total', 'counter',
+                'Frames not batched: every buffer busy in the callback, or overwritten in the ring while copied.',
+                ({'reason': reason}, stats[reason]))
+        help_text = 'Batch callback run time, quantiles are histogram bin upper bounds.'
+        consumer = stats['consumer']
+        for q in QUANTILES:
+            add('ameba_batch_callback_seconds', 'summary', help_text, ({'quantile': str(q)}, consumer[q]))
+        add('ameba_batch_callback_seconds', 'summary', help_text, ('_sum', {}, consumer['sum']))
+        add('ameba_batch_callback_seconds', 'summary', help_text, ('_count', {}, consumer['count']))
+
+    @staticmethod
+    def _add_commands(add, labels, stats):
+        for result in RESULTS:
+            add('ameba_camera_commands_total', 'counter', 'Commands sent to the camera by result.',
+                (dict(labels, result=result), stats[result]))
+        add('ameba_camera_commands_pending', 'gauge', 'Commands waiting for an acknowledgement.',
+            (labels, stats['pending']))
+        add('ameba_camera_commands_supported', 'gauge', 'Whether the firmware answers commands.',
+            (labels, int(stats['supported'])))
+
+    @staticmethod
+    def _add_rate_control(add, stats, cameras):
+        load = stats['load']
+        add('ameba_rate_control_overloaded', 'gauge', 'Whether the last load reading slowed every camera down.',
+            ({}, int(stats['overloaded'])))
+        if load.get('cpu') is not None:
+            add('ameba_rate_control_cpu_percent', 'gauge', 'Server CPU usage read by the rate controller.',
+                ({}, load['cpu']))
+        if load.get('throughput') is not None:
+            add('ameba_rate_control_throughput_bps', 'gauge', 'Received bit/s read by the rate controller.',
+                ({}, load['throughput']))
+        for ip, s in stats['cameras'].items():
+            labels = {'camera': ip, 'mac': cameras[ip]['mac'] if ip in cameras else ''}
+            add('ameba_camera_target_fps', 'gauge', 'Frame rate the rate controller asks of the camera.',
+                (labels, s['fps']))
+            add('ameba_camera_target_bitrate_bps', 'gauge', 'Bitrate the rate controller asks of the camera.',
+                (labels, s['bitrate']))
+            for direction in ('increases', 'decreases'):
+                add('ameba_rate_control_changes_total', 'counter', 'Rate increases and decreases of the camera.',
+                    (dict(labels, direction=direction[:-1]), s[direction]))
+
+    @staticmethod
+    def _add_motion_gate(add, labels, stats):
+        for decision in DECISIONS:
+            add('ameba_motion_gate_frames_total', 'counter',
+                'Candidate frames by motion gate decision (motion, keepalive saves, skipped).',
+                (dict(labels, decision=decision), stats[decision]))
+        add('ameba_motion_gate_changed_ratio', 'gauge', 'Changed pixel fraction of the last candidate frame.',
+            (labels, stats['last_ratio']))
+
+    @staticmethod
+    def _add_profile(add, labels, stages):
+        help_text = 'Sampled latency of a hot path stage (profiling.py), quantiles are histogram bin upper bounds.'
+        for stage, s in stages.items():
+            stage_labels = dict(labels, stage=stage)
+            for q in QUANTILES:
+                add('ameba_stage_seconds', 'summary', help_text, (dict(stage_labels, quantile=str(q)), s[q]))
+            add('ameba_stage_seconds', 'summary', help_text, ('_sum', stage_labels, s['sum']))
+            add('ameba_stage_seconds', 'summary', help_text, ('_count', stage_labels, s['count']))
+
+    def render(self):
+        """Returns the current metrics as exposition text."""
+        return format_metrics(self.collect())
+
+
+class MetricsServer:
+    """Serves a MetricsCollector at http://host:port/metrics from a background thread."""
+
+    def __init__(self, collector, host='127.0.0.1', port=9108):
+        self.collector = collector
+        self.host = host
+        self.port = port
+        self.httpd = None
+        self.thread = None
+
+    def start(self):
+        collector = self.collector
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = collector.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # one line per scrape would drown the camera table
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='MetricsServer', daemon=True)
+        self.thread.start()
+        print(f"Metrics served at http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.thread.join()
@@ -1,12 +1,16 @@
 # process_wrapper.py
 
 from rtsp_client import RTSPClient, RTSPClientOptions
+from stream_control import serve_commands
+from log import init_process, stop_logging
+from profiling import get_profiler, install_signal_dump
 import time
 
 
-def run_rtsp_client(cam_ip, port, mac, frame_callback=None, show_stream=True, show_fps=True):
+def create_rtsp_client(cam_ip, port, mac, frame_callback=None, show_stream=True, show_fps=True, frame_ring=None,
+                       options=None):
     """
-    包裝函數，用於在獨立進程中啟動 RTSPClient。
+    Builds the RTSPClient of a camera with the process defaults, without starting it.
 
     Args:
         cam_ip (str): Camera IP address.
@@ -14,6 +18,11 @@ def run_rtsp_client(cam_ip, port, mac, frame_callback=None, show_stream=True, sh
         mac (str): MAC address of the camera.
         frame_callback: User's callback
         show_fps (bool): Whether to display FPS on the video frames.
+        frame_ring (FrameRing, optional): Shared memory ring every decoded frame is written to.
+        options (dict, optional): Extra RTSPClientOptions arguments, e.g. decode_mode.
+
+    Returns:
+        RTSPClient: The client.
     """
 
     options = RTSPClientOptions(
@@ -22,22 +31,53 @@ def run_rtsp_client(cam_ip, port, mac, frame_callback=None, show_stream=True, sh
         window_width=800,         # 視窗寬度
         window_height=600,        # 視窗高度
         retry_interval=5,         # 連線失敗後重試間隔（秒）
-        show_fps=show_fps         # 是否顯示 FPS
+        show_fps=show_fps,        # 是否顯示 FPS
+        **(options or {})
     )
 
-    client = RTSPClient(
+    return RTSPClient(
         cam_ip=cam_ip,
         port=port,
         mac=mac,
         options=options,
-        frame_callback=frame_callback
+        frame_callback=frame_callback,
+        frame_ring=frame_ring
     )
 
+
+def run_rtsp_client(cam_ip, port, mac, frame_callback=None, show_stream=True, show_fps=True, frame_ring=None,
+                    options=None, control=None):
+    """
+    包裝函數，用於在獨立進程中啟動 RTSPClient。
+
+    Args:
+        cam_ip (str): Camera IP address.
+        port (str): RTSP port.
+        mac (str): MAC address of the camera.
+        frame_callback: User's callback
+        show_fps (bool): Whether to display FPS on the video frames.
+        frame_ring (FrameRing, optional): Shared memory ring every decoded frame is written to.
+        options (dict, optional): Extra RTSPClientOptions arguments, e.g. decode_mode.
+        control (multiprocessing.connection.Connection, optional): Command pipe, see stream_control.py.
+    """
+
+    init_process()
+    client = create_rtsp_client(cam_ip, port, mac, frame_callback, show_stream, show_fps, frame_ring, options)
+    if get_profiler().enabled:
+        install_signal_dump()
+
     client.start()
 
     try:
-        while True:
+        if control is not None:
+            serve_commands(client, control)
+            return
+        # the client thread ends by itself when a file or synthetic frame source finishes
+        while client.thread.is_alive():
             time.sleep(1)
+        client.stop()
     except KeyboardInterrupt:
         print('Close owing to KeyboardInterrupt from run_rtsp_client')
         client.stop()
+    finally:
+        stop_logging()  # a daemon process exits without atexit, write out the queued records first
@@ -0,0 +1,292 @@
+# profiling.py
+
+import array
+import math
+import os
+import signal
+import threading
+import time
+import numpy as np
+
+'''
+Profiling
+
+量測每張 frame 在 hot path 各個階段花的時間，讓每一項最佳化都有數字可以比較:
+- 每個 (camera, stage) 一個 StageTimer，延遲記錄在預先配置的 int64 array histogram (1 µs 到約 16 秒，
+  每個 2 倍分成 BINS_PER_OCTAVE 格，誤差約 9%)，記錄時只做一次 log2 與幾個加法，不配置記憶體也不取 lock；
+  percentile 計算時才以 numpy 直接讀取同一塊記憶體。一個 stage 只應由一個 thread 記錄
+  (EncoderPool 的多個 encoder thread 在自己的 stats lock 內記錄)
+- sample_every = n 時每個 stage 只量測 n 次中的 1 次
+- 預設是 NullProfiler: stage() 回傳 NULL_STAGE，start() 回傳 0、stop() 什麼都不做，關閉時只剩一次 method call
+- report() 印出每個 stage 的 samples / mean / p50 / p90 / p99 / max (percentile 為 bin 的上界)，
+  snapshot() 給 metrics.py 輸出成 Prometheus summary
+- install_signal_dump(): 收到 SIGUSR1 時印出該進程的 report，主進程會再把 signal 轉送給 RTSP 子進程
+  (kill -USR1 <server pid>)
+
+階段 (STAGES):
+  read        FreshestFrame 的 capture.read() (sampled decoding 時為 grab())
+  retrieve    sampled decoding 的 capture.retrieve()
+  handoff     FreshestFrame 放入 frame 到 RTSPClient 的 read() 取得它
+  callback    使用者的 frame_callback
+  preview     預覽視窗的 resize / copy
+  fps_overlay _add_fps()
+  display     cv2.imshow() + cv2.waitKey()
+  ring_copy   SaveRequestDispatcher 從 FrameRing 複製要存的 frame
+  encode      EncoderPool 的 cv2.imencode()
+  write       EncoderPool 寫入一個 JPEG 檔
+
+fork 出來的子進程會換成一個新的、空的 profiler (相同的 sample_every)；spawn 的子進程由
+RTSPClientOptions.profile_sample_every 啟用。
+'''
+
+STAGES = ('read', 'retrieve', 'handoff', 'callback', 'preview', 'fps_overlay', 'display', 'ring_copy', 'encode',
+          'write')
+BINS_PER_OCTAVE = 8
+NUM_BINS = 24 * BINS_PER_OCTAVE + 1  # 1 µs .. 2^24 µs (16.8 s), the last bin takes everything slower
+QUANTILES = (0.5, 0.9, 0.99)
+
+# upper edge of every bin in seconds, the value reported for a percentile falling into it
+BIN_EDGES = np.exp2(np.arange(1, NUM_BINS + 1) / BINS_PER_OCTAVE) * 1e-6
+
+_log2 = math.log2
+_perf_counter = time.perf_counter
+
+
+class StageTimer:
+    """Latency histogram of one stage of one camera."""
+
+    __slots__ = ('stage', 'camera', 'sample_every', 'counts', 'count', 'total', 'max', '_skip')
+
+    enabled = True
+
+    def __init__(self, stage, camera='', sample_every=1):
+        self.stage = stage
+        self.camera = camera
+        self.sample_every = max(1, sample_every)
+        # array.array: indexing it from Python is several times cheaper than a numpy scalar update
+        self.counts = array.array('q', bytes(8 * NUM_BINS))
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._skip = 0
+
+    def sample(self):
+        """Returns True for the one call in `sample_every` that should be timed."""
+        self._skip += 1
+        if self._skip < self.sample_every:
+            return False
+        self._skip = 0
+        return True
+
+    def start(self):
+        """Returns the start time when this call is sampled, otherwise 0."""
+        return _perf_counter() if self.sample() else 0.0
+
+    def stop(self, start):
+        """Records the time since `start`, a value returned by start()."""
+        if start:
+            self.record(_perf_counter() - start)
+
+    def record(self, seconds):
+        """Adds one latency in seconds to the histogram, from the stage's only recording thread."""
+        us = seconds * 1e6
+        index = int(_log2(us) * BINS_PER_OCTAVE) if us > 1.0 else 0
+        self.counts[index if index < NUM_BINS else NUM_BINS - 1] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Upper bound of the `q` quantile in seconds, from the histogram."""
+        if not self.count:
+            return 0.0
+        cumulative = np.cumsum(np.frombuffer(self.counts, dtype=np.int64))
+        index = int(np.searchsorted(cumulative, q * cumulative[-1]))
+        return min(float(BIN_EDGES[min(index, NUM_BINS - 1)]), self.max)
+
+    def summary(self):
+        """
+        Returns:
+            dict: 'count' (timed calls), 'sum' and 'max' in seconds and one entry per QUANTILES value.
+        """
+        result = {'count': self.count, 'sum': self.total, 'max': self.max}
+        for q in QUANTILES:
+            result[q] = self.quantile(q)
+        return result
+
+
+class _NullStage:
+    """Stand-in of a StageTimer while profiling is off."""
+
+    __slots__ = ()
+    enabled = False
+
+    def sample(self):
+        return False
+
+    def start(self):
+        return 0.0
+
+    def stop(self, start):
+        pass
+
+    def record(self, seconds):
+        pass
+
+
+NULL_STAGE = _NullStage()
+
+
+class NullProfiler:
+    """Profiler used while profiling is off, every stage is NULL_STAGE."""
+
+    enabled = False
+    sample_every = 0
+
+    def stage(self, name, camera=''):
+        return NULL_STAGE
+
+    def snapshot(self, camera=None):
+        return {}
+
+    def report(self, camera=None):
+        return ''
+
+
+class Profiler:
+    """StageTimers of one process, created on first use of a (camera, stage)."""
+
+    enabled = True
+
+    def __init__(self, sample_every=1):
+        """
+        Initializes the Profiler.
+
+        Args:
+            sample_every (int): Time one call in n of every stage.
+        """
+        self.sample_every = max(1, sample_every)
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name, camera=''):
+        """
+        Returns the StageTimer of a stage; look it up once and keep it, not once per frame.
+
+        Args:
+            name (str): One of STAGES.
+            camera (str): Camera the stage belongs to, the ip address.
+        """
+        key = (camera, name)
+        timer = self._stages.get(key)
+        if timer is None:
+            with self._lock:
+                timer = self._stages.setdefault(key, StageTimer(name, camera, self.sample_every))
+        return timer
+
+    def snapshot(self, camera=None):
+        """
+        Returns:
+            dict: {camera: {stage: StageTimer.summary()}} of the stages timed at least once, only
+                `camera` when given.
+        """
+        with self._lock:
+            timers = list(self._stages.values())
+        result = {}
+        for timer in timers:
+            if timer.count and (camera is None or timer.camera == camera):
+                result.setdefault(timer.camera, {})[timer.stage] = timer.summary()
+        return result
+
+    def report(self, camera=None):
+        """Returns the per-stage latency table of this process as text."""
+        snapshot = self.snapshot(camera)
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        lines = [f"\n=== Stage latency (pid {os.getpid()}, 1 in {self.sample_every} timed) ===",
+                 f"{'Camera':<16} {'Stage':<12} {'Samples':>8} {'Mean ms':>9} {'p50 ms':>9} {'p90 ms':>9}"
+                 f" {'p99 ms':>9} {'Max ms':>9}",
+                 "-" * 88]
+        for cam in sorted(snapshot):
+            for stage, s in sorted(snapshot[cam].items(), key=lambda item: order.get(item[0], len(order))):
+                lines.append(f"{cam or '-':<16} {stage:<12} {s['count']:>8} {s['sum'] / s['count'] * 1000:>9.3f}"
+                             f" {s[0.5] * 1000:>9.3f} {s[0.9] * 1000:>9.3f} {s[0.99] * 1000:>9.3f}"
+                             f" {s['max'] * 1000:>9.3f}")
+        if not snapshot:
+            lines.append("No stage timed yet.")
+        lines.append("==========================\n")
+        return '\n'.join(lines)
+
+
+_profiler = NullProfiler()
+
+
+def get_profiler():
+    """Returns the profiler of this process, a NullProfiler unless enable_profiling() was called."""
+    return _profiler
+
+
+def enable_profiling(sample_every=1):
+    """
+    Turns profiling on in this process. Components look their stages up when they are created,
+    so call it before starting them.
+
+    Args:
+        sample_every (int): Time one call in n of every stage, 0 turns profiling off.
+
+    Returns:
+        Profiler | NullProfiler: The profiler now in use.
+    """
+    global _profiler
+    if sample_every <= 0:
+        if _profiler.enabled:
+            _profiler = NullProfiler()
+    elif _profiler.sample_every != sample_every:
+        _profiler = Profiler(sample_every)
+    return _profiler
+
+
+def dump(camera=None):
+    """Prints the report of this process's profiler."""
+    if _profiler.enabled:
+        print(_profiler.report(camera))
+
+
+def install_signal_dump(forward=None, signum=None):
+    """
+    Prints the report whenever this process receives `signum` (SIGUSR1 by default, unavailable on
+    Windows where this does nothing).
+
+    Args:
+        forward (callable, optional): Returns the pids the signal is passed on to, e.g. the RTSP
+            processes, so one `kill -USR1` dumps every process. Only used by the installing process,
+            not by forked children that inherit the handler.
+        signum (int, optional): Signal to use instead of SIGUSR1.
+    """
+    signum = signum or getattr(signal, 'SIGUSR1', None)
+    if signum is None:
+        return
+    owner = os.getpid()
+
+    def handler(received, frame):
+        # printing from the handler itself could re-enter a print the main thread is in
+        threading.Thread(target=dump, name='ProfileDump', daemon=True).start()
+        if forward is not None and os.getpid() == owner:
+            for pid in forward():
+                try:
+                    os.kill(pid, received)
+                except (OSError, TypeError):
+                    pass  # exited meanwhile, or not started
+
+    signal.signal(signum, handler)
+
+
+def _reset_in_child():
+    # a forked RTSP process times its own frames, not a copy of the parent's counts
+    global _profiler
+    if _profiler.enabled:
+        _profiler = Profiler(_profiler.sample_every)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_in_child)
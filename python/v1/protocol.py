@@ -0,0 +1,354 @@
+# protocol.py
+
+import struct
+from collections import namedtuple
+
+'''
+Control protocol between AMB82-MINI and the server
+
+Binary frame (big endian, 6-byte header):
+
+    +-------+---------+----------+-------+----------------+-----------------+
+    | magic | version | msg_type | flags | length (u16)   | payload[length] |
+    | 0xA5  | 0x01    |          |       |                |                 |
+    +-------+---------+----------+-------+----------------+-----------------+
+
+- DEVICE_INFO payload: mac (6 bytes) + ipv4 (4 bytes) + rtsp port (u16)
+- HEARTBEAT payload: empty
+- STATUS payload: reserved for future status reports, passed through untouched
+- COMMAND (server -> camera) payload: command id (u16) + param (u8) + value (u32)
+- ACK (camera -> server) payload: command id (u16) + param (u8) + status (u8) + applied value (u32)
+
+COMMAND 的 param: PARAM_FPS (frame/s)、PARAM_BITRATE (bit/s)、PARAM_RESOLUTION (width << 16 | height)。
+camera 套用後以相同的 command id 回覆 ACK，status 見 ACK_STATUSES，value 為實際套用的值
+(例如超出範圍時被 clamp 的值)。
+
+協商方式: 連線的第一個 byte 若為 MAGIC 即使用 binary frame，否則視為舊版 RTSP.ino 的
+文字協定 (`mac,ip,port\\r\\n` 與 `AliveHeartBeat\\r\\n`)。MAGIC (0xA5) 不是合法的 ASCII 字元，
+因此兩種協定不會混淆。
+文字協定的 command / ack 為 `SET,<id>,<param>,<value>\\r\\n` 與 `ACK,<id>,<param>,<status>,<value>\\r\\n`，
+param 與 status 以名稱表示 (例如 `SET,7,fps,15`、`ACK,7,fps,ok,15`、`SET,8,resolution,1280x720`)。
+MAC 的第 3 個字元是 ':'，所以 `ACK,` / `SET,` 不會與 device info 混淆。camera 端以同一個 ControlParser
+解析 server 送來的 command (第一個 byte 決定協定)。
+'''
+
+MAGIC = 0xA5
+VERSION = 1
+TEXT_VERSION = 0  # version reported for messages parsed from the legacy text protocol
+HEADER = struct.Struct('>BBBBH')
+HEADER_SIZE = HEADER.size
+MAX_PAYLOAD = 4096
+MAX_TEXT_LINE = 256
+
+MSG_DEVICE_INFO = 0x01
+MSG_HEARTBEAT = 0x02
+MSG_STATUS = 0x03
+MSG_COMMAND = 0x10
+MSG_ACK = 0x11
+
+PARAM_FPS = 0x01
+PARAM_BITRATE = 0x02
+PARAM_RESOLUTION = 0x03
+PARAMS = {PARAM_FPS: 'fps', PARAM_BITRATE: 'bitrate', PARAM_RESOLUTION: 'resolution'}
+PARAM_IDS = {name: param for param, name in PARAMS.items()}
+
+ACK_OK = 0
+ACK_CLAMPED = 1  # applied, with the value in the ack instead of the requested one
+ACK_UNSUPPORTED = 2
+ACK_INVALID = 3
+ACK_FAILED = 4
+ACK_STATUSES = {ACK_OK: 'ok', ACK_CLAMPED: 'clamped', ACK_UNSUPPORTED: 'unsupported', ACK_INVALID: 'invalid',
+                ACK_FAILED: 'failed'}
+ACK_STATUS_IDS = {name: status for status, name in ACK_STATUSES.items()}
+
+MODE_BINARY = 'binary'
+MODE_TEXT = 'text'
+
+TEXT_HEARTBEAT = b'AliveHeartBeat'
+TEXT_COMMAND = b'SET,'
+TEXT_ACK = b'ACK,'
+DEVICE_INFO = struct.Struct('>6s4sH')
+COMMAND = struct.Struct('>HBI')
+ACK = struct.Struct('>HBBI')
+_WHITESPACE = b' \t\r\n'
+
+# payload is a memoryview into the parser buffer, only valid until the next feed()
+ControlMessage = namedtuple('ControlMessage', ['msg_type', 'version', 'flags', 'payload'])
+# value is an int, (width, height) for PARAM_RESOLUTION
+Command = namedtuple('Command', ['command_id', 'param', 'value'])
+CommandAck = namedtuple('CommandAck', ['command_id', 'param', 'status', 'value'])
+_new_message = tuple.__new__  # skips the namedtuple __new__ wrapper on the hot path
+_unpack_header = HEADER.unpack_from
+_EMPTY = memoryview(b'')
+_TEXT_HEARTBEAT_LEN = len(TEXT_HEARTBEAT)
+
+
+class ProtocolError(ValueError):
+    """Raised when the control stream cannot be parsed any further."""
+
+
+class ControlParser:
+    """Incremental parser for the control stream of a single camera connection."""
+
+    def __init__(self, max_payload=MAX_PAYLOAD, max_text_line=MAX_TEXT_LINE):
+        """
+        Initializes the ControlParser.
+
+        Args:
+            max_payload (int): Largest binary payload accepted before the stream is rejected.
+            max_text_line (int): Longest legacy text line accepted before the stream is rejected.
+        """
+        self.max_payload = max_payload
+        self.max_text_line = max_text_line
+        self.mode = None  # negotiated from the first byte received
+        self._buf = bytearray()
+        self._pos = 0  # start of the first unparsed byte in _buf
+
+    def feed(self, data):
+        """
+        Appends received bytes and returns every complete message.
+
+        Payloads are memoryviews into the internal buffer, so no per-message copies are made.
+        They stay valid until the next call to feed(); copy them if they must live longer.
+
+        Args:
+            data (bytes-like): Bytes read from the socket.
+
+        Returns:
+            list: ControlMessage tuples in arrival order.
+        """
+        self._compact()
+        self._buf += data
+        if self.mode is None and self._buf:
+            self.mode = MODE_BINARY if self._buf[0] == MAGIC else MODE_TEXT
+
+        if self.mode == MODE_BINARY:
+            return self._parse_binary()
+        return self._parse_text()
+
+    def _parse_binary(self):
+        messages = []
+        view = memoryview(self._buf)
+        pos = self._pos
+        end = len(view)
+        while end - pos >= HEADER_SIZE:
+            magic, version, msg_type, flags, length = _unpack_header(view, pos)
+            if magic != MAGIC:
+                self._pos = pos
+                raise ProtocolError(f"Bad frame magic 0x{magic:02X}")
+            if length > self.max_payload:
+                self._pos = pos
+                raise ProtocolError(f"Frame payload too large: {length} bytes")
+            start = pos + HEADER_SIZE
+            if end - start < length:
+                break  # wait for the rest of the payload
+            pos = start + length
+            # unknown versions are still skipped by length, the caller decides what to do
+            payload = view[start:pos] if length else _EMPTY
+            messages.append(_new_message(ControlMessage, (msg_type, version, flags, payload)))
+        self._pos = pos
+        return messages
+
+    def _parse_text(self):
+        messages = []
+        buf = self._buf
+        view = None
+        pos = self._pos
+        while True:
+            newline = buf.find(b'\r\n', pos)
+            if newline < 0:
+                if len(buf) - pos > self.max_text_line:
+                    self._pos = pos
+                    raise ProtocolError("Text line too long without terminator")
+                break
+            start, stop = pos, newline
+            pos = newline + 2
+
+            while start < stop and buf[start] in _WHITESPACE:
+                start += 1
+            while stop > start and buf[stop - 1] in _WHITESPACE:
+                stop -= 1
+            if start == stop:
+                continue
+
+            if stop - start == _TEXT_HEARTBEAT_LEN and buf.startswith(TEXT_HEARTBEAT, start):
+                messages.append(_new_message(ControlMessage, (MSG_HEARTBEAT, TEXT_VERSION, 0, _EMPTY)))
+                continue
+            if view is None:
+                view = memoryview(buf)
+            if buf.startswith(TEXT_ACK, start):
+                msg_type = MSG_ACK
+            elif buf.startswith(TEXT_COMMAND, start):
+                msg_type = MSG_COMMAND
+            else:
+                msg_type = MSG_DEVICE_INFO
+            messages.append(_new_message(ControlMessage, (msg_type, TEXT_VERSION, 0, view[start:stop])))
+        self._pos = pos
+        return messages
+
+    def _compact(self):
+        """Drops the prefix parsed by the previous feed()."""
+        if self._pos == 0:
+            return
+        try:
+            del self._buf[:self._pos]
+        except BufferError:
+            # a caller kept a payload view alive; leave that buffer to it and start a new one
+            self._buf = bytearray(self._buf[self._pos:])
+        self._pos = 0
+
+
+def decode_device_info(msg):
+    """
+    Decodes a DEVICE_INFO message from either protocol.
+
+    Args:
+        msg (ControlMessage): Message yielded by ControlParser.
+
+    Returns:
+        tuple: (mac, ip, port) as strings, same as the legacy `mac,ip,port` line.
+
+    Raises:
+        ValueError: If the payload is malformed.
+    """
+    if msg.version == TEXT_VERSION:
+        parts = bytes(msg.payload).decode('ascii', errors='replace').split(',')
+        if len(parts) != 3:
+            raise ValueError(f"Invalid device info: {','.join(parts)}")
+        mac, ip, port = parts
+        return mac, ip, port
+
+    if len(msg.payload) != DEVICE_INFO.size:
+        raise ValueError(f"Invalid device info payload length: {len(msg.payload)}")
+    mac, ip, port = DEVICE_INFO.unpack(msg.payload)
+    return ':'.join(f'{b:02X}' for b in mac), '.'.join(str(b) for b in ip), str(port)
+
+
+def encode_frame(msg_type, payload=b'', flags=0):
+    """Builds a binary control frame."""
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Payload too large: {len(payload)} bytes")
+    return HEADER.pack(MAGIC, VERSION, msg_type, flags, len(payload)) + bytes(payload)
+
+
+def encode_device_info(mac, ip, port):
+    """Builds a binary DEVICE_INFO frame, the counterpart of `sendDeviceInfo` in RTSP.ino."""
+    mac_bytes = bytes(int(part, 16) for part in mac.split(':'))
+    ip_bytes = bytes(int(part) for part in ip.split('.'))
+    return encode_frame(MSG_DEVICE_INFO, DEVICE_INFO.pack(mac_bytes, ip_bytes, int(port)))
+
+
+def encode_heartbeat():
+    """Builds a binary HEARTBEAT frame."""
+    return encode_frame(MSG_HEARTBEAT)
+
+
+def _pack_value(param, value):
+    if param == PARAM_RESOLUTION:
+        width, height = value
+        return (int(width) << 16) | int(height)
+    return int(value)
+
+
+def _unpack_value(param, value):
+    if param == PARAM_RESOLUTION:
+        return value >> 16, value & 0xFFFF
+    return value
+
+
+def _format_value(param, value):
+    if param == PARAM_RESOLUTION:
+        return f'{value[0]}x{value[1]}'
+    return str(int(value))
+
+
+def _parse_value(param, text):
+    if param == PARAM_RESOLUTION:
+        width, height = text.lower().split('x')
+        return int(width), int(height)
+    return int(text)
+
+
+def _text_fields(msg, count):
+    parts = bytes(msg.payload).decode('ascii', errors='replace').split(',')
+    if len(parts) != count:
+        raise ValueError(f"Invalid {parts[0]} line: {','.join(parts)}")
+    return parts[1:]
+
+
+def encode_command(command_id, param, value, mode=MODE_BINARY):
+    """
+    Builds a COMMAND for the camera in the protocol of its connection.
+
+    Args:
+        command_id (int): 1-65535, echoed by the camera's ACK.
+        param (int): PARAM_FPS, PARAM_BITRATE or PARAM_RESOLUTION.
+        value (int | tuple): Frame rate, bit/s, or (width, height).
+        mode (str): MODE_BINARY or MODE_TEXT, the ControlParser.mode of the connection.
+
+    Returns:
+        bytes: The frame or the text line.
+    """
+    if param not in PARAMS:
+        raise ValueError(f"Unknown command param 0x{param:02X}")
+    if mode == MODE_TEXT:
+        return f'SET,{command_id},{PARAMS[param]},{_format_value(param, value)}\r\n'.encode('ascii')
+    return encode_frame(MSG_COMMAND, COMMAND.pack(command_id, param, _pack_value(param, value)))
+
+
+def decode_command(msg):
+    """
+    Decodes a COMMAND message from either protocol.
+
+    Returns:
+        Command: (command_id, param, value).
+
+    Raises:
+        ValueError: If the payload is malformed or the param unknown.
+    """
+    if msg.version == TEXT_VERSION:
+        command_id, name, value = _text_fields(msg, 4)
+        if name not in PARAM_IDS:
+            raise ValueError(f"Unknown command param {name!r}")
+        param = PARAM_IDS[name]
+        return Command(int(command_id), param, _parse_value(param, value))
+
+    if len(msg.payload) != COMMAND.size:
+        raise ValueError(f"Invalid command payload length: {len(msg.payload)}")
+    command_id, param, value = COMMAND.unpack(msg.payload)
+    if param not in PARAMS:
+        raise ValueError(f"Unknown command param 0x{param:02X}")
+    return Command(command_id, param, _unpack_value(param, value))
+
+
+def encode_ack(command_id, param, status, value, mode=MODE_BINARY):
+    """Builds the camera's ACK of a command, the counterpart of `sendAck` in RTSP.ino."""
+    if mode == MODE_TEXT:
+        return (f'ACK,{command_id},{PARAMS[param]},{ACK_STATUSES[status]},'
+                f'{_format_value(param, value)}\r\n').encode('ascii')
+    return encode_frame(MSG_ACK, ACK.pack(command_id, param, status, _pack_value(param, value)))
+
+
+def decode_ack(msg):
+    """
+    Decodes an ACK message from either protocol.
+
+    Returns:
+        CommandAck: (command_id, param, status, applied value).
+
+    Raises:
+        ValueError: If the payload is malformed, or the param or status unknown.
+    """
+    if msg.version == TEXT_VERSION:
+        command_id, name, status, value = _text_fields(msg, 5)
+        if name not in PARAM_IDS or status not in ACK_STATUS_IDS:
+            raise ValueError(f"Unknown ack param {name!r} or status {status!r}")
+        param = PARAM_IDS[name]
+        return CommandAck(int(command_id), param, ACK_STATUS_IDS[status], _parse_value(param, value))
+
+    if len(msg.payload) != ACK.size:
+        raise ValueError(f"Invalid ack payload length: {len(msg.payload)}")
+    command_id, param, status, value = ACK.unpack(msg.payload)
+    if param not in PARAMS or status not in ACK_STATUSES:
+        raise ValueError(f"Unknown ack param 0x{param:02X} or status {status}")
+    return CommandAck(command_id, param, status, _unpack_value(param, value))
@@ -0,0 +1,266 @@
+# rate_control.py
+
+import os
+import threading
+import time
+from log import get_logger
+from protocol import ACK_OK
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+'''
+Rate control
+
+RTSP.ino 的 RTSP_FPS 與 BIT_RATE_MPS 是寫死的，camera 多了之後 server 解碼不完、Wi-Fi 也塞不下。RateController
+經由 CommandChannel (camera_commands.py) 調整每台 camera 的 fps 與 bitrate，採用 AIMD (與 TCP 壅塞控制相同):
+- 每 interval 秒讀一次負載: server 的 CPU 使用率與網路收到的 throughput (SystemLoad，需要 psutil；沒有安裝時
+  以 load average 估計 CPU，不使用 throughput)，以及每台 camera 實際送達的 frame rate (RTSP 進程 metrics 的
+  grabbed 增加量)
+- 過載: CPU 超過 cpu_high，或 throughput 超過 link_capacity 的 link_high 比例 (link_capacity 為 0 時不看)，所有
+  camera 的 fps 與 bitrate 乘上 decrease；某台 camera 送達的 frame 少於目標的 min_delivered 比例 (該 camera 的
+  Wi-Fi 塞住或 server 來不及讀) 時只降它自己
+- 有餘裕: CPU 低於 cpu_low 且 throughput 低於 link_low 比例，而且上次降低後已過 hold 秒，fps 加 fps_step、
+  bitrate 加 bitrate_step，直到 fps_range / bitrate_range 的上限
+- 乘法降低、加法增加讓所有 camera 收斂到相近的速率，也不會在門檻附近來回震盪
+- 數值有變才送 command，同一個參數的上一個 command 還沒 ACK 時不送新的；不支援 command 的 camera
+  (CommandChannel.supported 為 False) 維持原本的速率
+
+解析度只能由 CameraManager.command_camera(ip, 'resolution', (w, h)) 手動修改: camera 換解析度時會重新啟動
+stream，不適合自動調整。每條新連線的目標從 fps_range / bitrate_range 的上限開始，第一次調整時送出 (重新連線的板子
+保留原本的速率，重開機的板子回到 RTSP_FPS / BIT_RATE_MPS)。
+'''
+
+log = get_logger('rate_control')
+
+
+class SystemLoad:
+    """CPU usage and received network throughput of the server, the default load of RateController."""
+
+    def __init__(self):
+        self._last = None  # (monotonic time, bytes received)
+        if psutil is not None:
+            psutil.cpu_percent(None)  # the first call only starts the measurement
+
+    def __call__(self):
+        """
+        Returns:
+            dict: 'cpu' percent of all cores since the previous call, 'throughput' bit/s received since then
+                (None on the first call or without psutil).
+        """
+        if psutil is None:
+            cpu = os.getloadavg()[0] / (os.cpu_count() or 1) * 100 if hasattr(os, 'getloadavg') else 0.0
+            return {'cpu': cpu, 'throughput': None}
+        now = time.monotonic()
+        received = psutil.net_io_counters().bytes_recv
+        throughput = None
+        if self._last is not None and now > self._last[0]:
+            throughput = (received - self._last[1]) * 8 / (now - self._last[0])
+        self._last = (now, received)
+        return {'cpu': psutil.cpu_percent(None), 'throughput': throughput}
+
+
+class _CameraRate:
+    """Targets and counters of one camera."""
+
+    __slots__ = ('control', 'fps', 'bitrate', 'applied', 'ceilings', 'commands', 'changed', 'decreased',
+                 'increases', 'decreases', 'grabbed', 'delivered')
+
+    def __init__(self, control, fps, bitrate, now):
+        self.control = control
+        self.fps = fps
+        self.bitrate = bitrate
+        # param -> value the camera acknowledged, unknown on a new connection: a reconnected board keeps its rates,
+        # a rebooted one runs RTSP.ino's defaults, the first step sends both targets
+        self.applied = {}
+        self.ceilings = {}  # param -> highest value the camera accepted when it clamped a command
+        self.commands = {}  # param -> id of the last command sent
+        self.changed = now  # last fps change, frames are only counted once it settled
+        self.decreased = 0.0
+        self.increases = 0
+        self.decreases = 0
+        self.grabbed = None  # (metrics time, grabbed frames) of the previous RTSP process metrics
+        self.delivered = None  # frames/s the RTSP client read
+
+
+class RateController(threading.Thread):
+    """Lowers and raises the frame rate and bitrate of every camera from the server and network load (AIMD)."""
+
+    def __init__(self, camera_manager, fps_range=(5, 30), bitrate_range=(512 * 1024, 4 * 1024 * 1024),
+                 cpu_high=85.0, cpu_low=60.0, link_capacity=0, link_high=0.85, link_low=0.6, decrease=0.7,
+                 fps_step=2, bitrate_step=256 * 1024, min_delivered=0.8, interval=2.0, hold=10.0, load=None):
+        """
+        Initializes the RateController.
+
+        Args:
+            camera_manager (CameraManager): Source of the cameras and their CommandChannels.
+            fps_range (tuple): Lowest and highest frame rate sent, cameras start at the highest.
+            bitrate_range (tuple): Lowest and highest bitrate sent in bit/s, cameras start at the highest (RTSP.ino's
+                BIT_RATE_MPS counts 1024 * 1024 bit/s).
+            cpu_high (float): CPU percent above which every camera is slowed down.
+            cpu_low (float): CPU percent below which cameras may speed up.
+            link_capacity (float): Bit/s the server's network (the Wi-Fi AP) carries, 0 ignores throughput.
+            link_high (float): Fraction of link_capacity above which every camera is slowed down.
+            link_low (float): Fraction of link_capacity below which cameras may speed up.
+            decrease (float): Factor the fps and bitrate are multiplied by when slowing down.
+            fps_step (float): Frame rate added per interval when speeding up.
+            bitrate_step (float): Bit/s added per interval when speeding up.
+            min_delivered (float): Fraction of its target fps below which a camera counts as congested.
+            interval (float): Seconds between adjustments.
+            hold (float): Seconds after a decrease before the camera speeds up again.
+            load (callable, optional): Returns {'cpu': percent, 'throughput': bit/s or None}, SystemLoad()
+                when None.
+        """
+        super().__init__(name='RateController', daemon=True)
+        self.camera_manager = camera_manager
+        self.fps_range = fps_range
+        self.bitrate_range = bitrate_range
+        self.cpu_high = cpu_high
+        self.cpu_low = cpu_low
+        self.link_capacity = link_capacity
+        self.link_high = link_high
+        self.link_low = link_low
+        self.decrease = decrease
+        self.fps_step = fps_step
+        self.bitrate_step = bitrate_step
+        self.min_delivered = min_delivered
+        self.interval = interval
+        self.hold = hold
+        self.load = load or SystemLoad()
+        self.last_load = {}
+        self.overloaded = False
+        self._rates = {}
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.step()
+            except Exception:
+                log.exception("Rate control step failed")
+
+    def _delivered_fps(self, rate, process):
+        """Frames/s the camera's RTSP client read between its last two metrics, None when unknown."""
+        if hasattr(process, 'request_metrics'):
+            process.poll()  # reads the reply to the previous request
+            process.request_metrics()
+        metrics = getattr(process, 'metrics', None)
+        if not metrics or not metrics.get('connected'):
+            rate.grabbed = rate.delivered = None
+            return None
+        sample = (process.metrics_time, metrics['grabbed'])
+        previous = rate.grabbed
+        if previous is None or sample[1] < previous[1]:
+            rate.grabbed, rate.delivered = sample, None  # first metrics of a new process
+        elif sample[0] > previous[0]:
+            rate.grabbed = sample
+            rate.delivered = (sample[1] - previous[1]) / (sample[0] - previous[0])
+        return rate.delivered
+
+    def step(self):
+        """Reads the load once and adjusts every camera, called every interval seconds by the thread."""
+        now = time.monotonic()
+        load = self.load()
+        self.last_load = load
+        cpu = load.get('cpu') or 0.0
+        throughput = load.get('throughput')
+        link = self.link_capacity > 0 and throughput is not None
+        self.overloaded = cpu > self.cpu_high or (link and throughput > self.link_high * self.link_capacity)
+        headroom = cpu < self.cpu_low and (not self.link_capacity
+                                           or (link and throughput < self.link_low * self.link_capacity))
+
+        cameras = self.camera_manager.get_cameras()
+        self._rates = {ip: rate for ip, rate in self._rates.items() if ip in cameras}
+        for ip, info in cameras.items():
+            control = info.get('control')
+            if control is None or control.closed or not control.supported:
+                continue
+            rate = self._rates.get(ip)
+            if rate is None or rate.control is not control:
+                rate = self._rates[ip] = _CameraRate(control, self.fps_range[1], self.bitrate_range[1], now)
+            delivered = self._delivered_fps(rate, info['process'])
+            behind = (delivered is not None and now - rate.changed >= 2 * self.interval
+                      and delivered < self.min_delivered * rate.applied.get('fps', rate.fps))
+            if self.overloaded or behind:
+                fps = max(self.fps_range[0], rate.fps * self.decrease)
+                bitrate = max(self.bitrate_range[0], rate.bitrate * self.decrease)
+                if (fps, bitrate) != (rate.fps, rate.bitrate):
+                    rate.decreases += 1
+                    log.info("Slowing %s down to %.0f fps, %.2f Mbps (%s)", ip, fps, bitrate / 1e6,
+                             'server overloaded' if self.overloaded else f'{delivered:.1f} fps delivered')
+                rate.decreased = now
+            elif headroom and now - rate.decreased >= self.hold:
+                fps = min(rate.ceilings.get('fps', self.fps_range[1]), rate.fps + self.fps_step)
+                bitrate = min(rate.ceilings.get('bitrate', self.bitrate_range[1]), rate.bitrate + self.bitrate_step)
+                if (fps, bitrate) != (rate.fps, rate.bitrate):
+                    rate.increases += 1
+            else:
+                fps, bitrate = rate.fps, rate.bitrate
+            if round(fps) != round(rate.fps):
+                rate.changed = now
+            rate.fps, rate.bitrate = fps, bitrate
+            self._command(control, rate, 'fps', round(fps))
+            self._command(control, rate, 'bitrate', int(bitrate))
+
+    @staticmethod
+    def _command(control, rate, param, value):
+        """Sends a changed target once the previous command for the param was answered or timed out."""
+        command_id = rate.commands.get(param)
+        if command_id is not None:
+            if control.pending(param):
+                return
+            del rate.commands[param]
+            ack = control.wait(command_id, timeout=0)
+            if ack is not None:
+                rate.applied[param] = ack.value  # what the camera runs at, also when clamped or rejected
+                if ack.status != ACK_OK:
+                    # follow the camera's limit instead of repeating the command
+                    if ack.value < getattr(rate, param):
+                        rate.ceilings[param] = min(ack.value, rate.ceilings.get(param, ack.value))
+                    setattr(rate, param, ack.value)
+                    return
+        if value != rate.applied.get(param):
+            command_id = control.send(param, value)
+            if command_id is not None:
+                rate.commands[param] = command_id
+
+    def stats(self):
+        """
+        Returns:
+            dict: 'load' (last load reading), 'overloaded', and 'cameras' {ip: 'fps', 'bitrate' targets,
+                'delivered_fps', 'increases', 'decreases'}.
+        """
+        rates = dict(self._rates)
+        return {
+            'load': dict(self.last_load),
+            'overloaded': self.overloaded,
+            'cameras': {ip: {'fps': rate.fps, 'bitrate': rate.bitrate, 'delivered_fps': rate.delivered,
+                             'increases': rate.increases, 'decreases': rate.decreases}
+                        for ip, rate in rates.items()},
+        }
+
+    def report(self):
+        s = self.stats()
+        cameras = self.camera_manager.get_cameras()
+        lines = [f"\n=== Rate control (fps {self.fps_range[0]}-{self.fps_range[1]}, "
+                 f"{self.bitrate_range[0] / 1e6:.2f}-{self.bitrate_range[1] / 1e6:.2f} Mbps) ===",
+                 f"{'Camera':<16} {'FPS':>5} {'Mbps':>6} {'Delivered':>10} {'Up':>4} {'Down':>5} {'Sent':>5}"
+                 f" {'Acked':>6} {'Timeout':>8}",
+                 "-" * 72]
+        for ip, rate in sorted(s['cameras'].items()):
+            control = cameras.get(ip, {}).get('control')
+            commands = control.stats() if control is not None else {}
+            delivered = f"{rate['delivered_fps']:.1f}" if rate['delivered_fps'] is not None else '-'
+            lines.append(f"{ip:<16} {rate['fps']:>5.0f} {rate['bitrate'] / 1e6:>6.2f} {delivered:>10}"
+                         f" {rate['increases']:>4} {rate['decreases']:>5} {commands.get('sent', 0):>5}"
+                         f" {commands.get('acked', 0) + commands.get('clamped', 0):>6} {commands.get('timeout', 0):>8}")
+        lines.append("==========================\n")
+        return '\n'.join(lines)
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        print(self.report())
@@ -4,7 +4,11 @@ import cv2
 import time
 import threading
 import numpy as np
-import os
+import inspect
+from frame_source import get_frame_source
+from frame_transform import FrameTransform, TRANSFORM_OPTIONS
+from log import get_logger, camera_logger, suppressed_count
+from profiling import get_profiler, enable_profiling
 
 
 class RTSPClientOptions:
@@ -16,7 +20,18 @@ class RTSPClientOptions:
                  window_width=640,
                  window_height=480,
                  retry_interval=5,
-                 show_fps=False):
+                 show_fps=False,
+                 decode_mode='full',
+                 sample_every=1,
+                 ingest_profile='default',
+                 frame_source=None,
+                 profile_sample_every=0,
+                 crop=None,
+                 decimate=1,
+                 resize_width=0,
+                 resize_height=0,
+                 interpolation='area',
+                 color='bgr'):
         """
         Initializes the RTSPClientOptions.
 
@@ -27,6 +42,24 @@ class RTSPClientOptions:
             window_height (int): Height of the display window.
             retry_interval (int): Seconds to wait before retrying connection after failure.
             show_fps (bool): Whether to display FPS on the video frames.
+            decode_mode (str): 'full' decodes every frame with read(). 'sampled' calls grab() on
+                every packet and retrieve() (BGR conversion + allocation) only on one in
+                `sample_every` frames; it is ignored while display_window is on.
+            sample_every (int): Frames per retrieved frame in 'sampled' mode.
+            ingest_profile (str | IngestProfile): FFmpeg capture options used to open the stream,
+                a preset name from ingest_profile.INGEST_PRESETS or an IngestProfile.
+            frame_source (FrameSource, optional): Where frames come from instead of the camera's RTSP
+                stream, e.g. a VideoFileSource or SyntheticSource from frame_source.py.
+            profile_sample_every (int): Time one frame in n per hot path stage (profiling.py), 0 leaves
+                profiling as the process has it, off unless enabled elsewhere.
+            crop (tuple, optional): (x, y, w, h) region of the frame kept by the RTSP process, see
+                frame_transform.py. The transform options apply before the frame ring, the callback,
+                saving and display.
+            decimate (int): Keep every n-th pixel of every n-th row (after crop, before resize).
+            resize_width (int): Width frames are resized to, 0 keeps it or follows resize_height's ratio.
+            resize_height (int): Height frames are resized to, 0 keeps it or follows resize_width's ratio.
+            interpolation (str): Resize interpolation: 'nearest', 'linear', 'area', 'cubic' or 'lanczos'.
+            color (str): Pixel format of the frames: 'bgr', 'gray', 'yuv' or 'i420'.
         """
         self.display_window = display_window
         self.resize_window = resize_window
@@ -34,12 +67,64 @@ class RTSPClientOptions:
         self.window_height = window_height
         self.retry_interval = retry_interval
         self.show_fps = show_fps
+        self.decode_mode = decode_mode
+        self.sample_every = sample_every
+        self.ingest_profile = ingest_profile
+        self.frame_source = frame_source
+        self.profile_sample_every = profile_sample_every
+        self.crop = crop
+        self.decimate = decimate
+        self.resize_width = resize_width
+        self.resize_height = resize_height
+        self.interpolation = interpolation
+        self.color = color
+
+
+READ_BACKOFF_MIN = 0.01  # first pause after a failed read, doubled per consecutive failure
+READ_BACKOFF_MAX = 1.0
+READ_FAILURE_TIMEOUT = 5.0  # seconds of nothing but failed reads before the stream is given up
+
+# options that only take effect on a new connection, set_options() reconnects when one changes
+RECONNECT_OPTIONS = ('display_window', 'resize_window', 'window_width', 'window_height', 'decode_mode',
+                     'sample_every', 'ingest_profile', 'frame_source') + TRANSFORM_OPTIONS
+
+
+class DecodeStats:
+    """CPU spent in grab()/retrieve(), used to report what sampled decoding saves."""
+
+    def __init__(self):
+        self.grabbed = 0
+        self.retrieved = 0
+        self.failed = 0  # grab(), retrieve() or read() calls that returned no frame
+        self.grab_cpu = 0.0
+        self.retrieve_cpu = 0.0
+
+    def merge(self, other):
+        self.grabbed += other.grabbed
+        self.retrieved += other.retrieved
+        self.failed += other.failed
+        self.grab_cpu += other.grab_cpu
+        self.retrieve_cpu += other.retrieve_cpu
+
+    def summary(self):
+        """Returns a one-line report of the CPU time saved by skipping retrieve()."""
+        if not self.retrieved:
+            return "no frames retrieved"
+        retrieve_avg = self.retrieve_cpu / self.retrieved
+        saved = (self.grabbed - self.retrieved) * retrieve_avg
+        spent = self.grab_cpu + self.retrieve_cpu
+        ratio = saved / (saved + spent) * 100 if saved + spent > 0 else 0.0
+        return (f"grabbed {self.grabbed}, retrieved {self.retrieved}, "
+                f"grab {self.grab_cpu / max(self.grabbed, 1) * 1000:.2f} ms, "
+                f"retrieve {retrieve_avg * 1000:.2f} ms CPU per frame, "
+                f"saved {saved:.1f} s CPU ({ratio:.0f}% of full decoding)")
 
 
 class FreshestFrame(threading.Thread):
     """Thread that continuously captures the latest frame from a VideoCapture object."""
 
-    def __init__(self, capture, callback=None, name='FreshestFrame'):
+    def __init__(self, capture, callback=None, name='FreshestFrame', frame_ring=None, sample_every=1,
+                 lossless=False, logger=None, failure_timeout=READ_FAILURE_TIMEOUT, camera='', transform=None):
         """
         Initializes the FreshestFrame thread.
 
@@ -47,15 +132,46 @@ class FreshestFrame(threading.Thread):
             capture (cv2.VideoCapture): The VideoCapture object.
             callback (function, optional): Function to call with each new frame.
             name (str): Thread name.
+            frame_ring (FrameRing, optional): Shared memory ring each frame is also written to; dropped
+                (set to None) at the first frame that does not fit, the owner then saves frames itself.
+            sample_every (int): When > 1, grab() every frame but retrieve() only one in n.
+            lossless (bool): Wait until read() took the previous frame instead of replacing it,
+                for sources that are not live (file replay as fast as possible).
+            logger (logging.Logger, optional): Where read failures are reported.
+            failure_timeout (float): Seconds of consecutive failed reads after which the thread stops
+                and sets `failed`, so the owner can reconnect.
+            camera (str): Camera the read / retrieve stages are profiled under.
+            transform (FrameTransform, optional): Applied to every frame before it is handed over, into
+                3 output buffers rotated so the one written is neither the latest nor the one read()
+                returned last; the frame returned by read() stays intact until the next read().
         """
         super().__init__(name=name)
         self.capture = capture
         assert self.capture.isOpened(), "VideoCapture must be opened."
         self.cond = threading.Condition()
         self.running = False
+        self.released = False
         self.frame = None
+        self.frame_time = 0.0  # perf_counter() when the latest frame was handed over
         self.latestnum = 0
+        self.consumed = 0
+        self.lossless = lossless
         self.callback = callback
+        self.frame_ring = frame_ring
+        self.sample_every = max(1, sample_every)
+        self.decode_stats = DecodeStats()
+        self.log = logger or get_logger('rtsp_client')
+        self.failure_timeout = failure_timeout
+        self.failed = False  # stopped because reads kept failing
+        self._failures = 0
+        self._failing_since = None
+        self.transform = transform
+        self._published = None  # transform buffer of self.frame
+        self._held = None  # transform buffer read() returned last
+        profiler = get_profiler()
+        self._prof_read = profiler.stage('read', camera)
+        self._prof_retrieve = profiler.stage('retrieve', camera)
+        self._prof_transform = profiler.stage('transform', camera)
         self.start()
 
     def start(self):
@@ -65,23 +181,131 @@ class FreshestFrame(threading.Thread):
 
     def release(self, timeout=None):
         """Stops the thread and releases the VideoCapture."""
-        self.running = False
+        self.released = True
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
         self.join(timeout=timeout)
         self.capture.release()
 
+    def _read_failed(self, what):
+        """
+        Backs off after a failed read: 10 ms, doubled per consecutive failure up to 1 s, so a stalled
+        stream no longer spins a core. Returns False once reads failed for `failure_timeout` seconds.
+        """
+        self.decode_stats.failed += 1
+        self._failures += 1
+        now = time.monotonic()
+        if self._failing_since is None:
+            self._failing_since = now
+        elif now - self._failing_since >= self.failure_timeout:
+            self.log.warning("%d consecutive %s failures in %.1f s, giving up on the stream",
+                             self._failures, what, now - self._failing_since)
+            self.failed = True
+            return False
+        self.log.warning("Failed to %s frame", what)
+        delay = min(READ_BACKOFF_MAX, READ_BACKOFF_MIN * 2 ** (self._failures - 1))
+        with self.cond:
+            self.cond.wait_for(lambda: not self.running, delay)  # release() cuts the pause short
+        return True
+
+    def _read_succeeded(self):
+        if self._failures:
+            self._failures = 0
+            self._failing_since = None
+
     def run(self):
         """Continuously captures frames and updates the latest frame."""
-        counter = 0
+        try:
+            self._capture()
+        except Exception:
+            # e.g. a cv2.error from the capture or the transform; the owner reconnects on `failed`
+            self.log.exception("Frame capture failed, giving up on the stream")
+            self.failed = True
+        finally:
+            with self.cond:
+                self.running = False  # wake up readers when the source ends
+                self.cond.notify_all()
+
+    def _capture(self):
+        # continue the ring's numbering so seq stays monotonic across reconnects
+        counter = self.frame_ring.latest_seq if self.frame_ring else 0
+        stats = self.decode_stats
         while self.running:
-            ret, img = self.capture.read()
-            if not ret:
-                print(
-                    f"FreshestFrame: Failed to read frame. PID: {os.getpid()}")
-                continue
-            counter += 1
+            if self.sample_every > 1:
+                # grab() demuxes and decodes, retrieve() converts to a new BGR frame
+                start = time.thread_time()
+                timed = self._prof_read.start()
+                ret = self.capture.grab()
+                self._prof_read.stop(timed)
+                stats.grab_cpu += time.thread_time() - start
+                if not ret:
+                    if not self.capture.isOpened():
+                        break  # the frame source ended
+                    if not self._read_failed('grab'):
+                        break
+                    continue
+                self._read_succeeded()
+                counter += 1
+                stats.grabbed += 1
+                if counter % self.sample_every:
+                    continue
+                start = time.thread_time()
+                timed = self._prof_retrieve.start()
+                ret, img = self.capture.retrieve()
+                self._prof_retrieve.stop(timed)
+                stats.retrieve_cpu += time.thread_time() - start
+                if not ret:
+                    if not self._read_failed('retrieve'):
+                        break
+                    continue
+                stats.retrieved += 1
+            else:
+                timed = self._prof_read.start()
+                ret, img = self.capture.read()
+                self._prof_read.stop(timed)
+                if not ret:
+                    if not self.capture.isOpened():
+                        break  # the frame source ended
+                    if not self._read_failed('read'):
+                        break
+                    continue
+                self._read_succeeded()
+                counter += 1
+                stats.grabbed += 1
+                stats.retrieved += 1
+
+            if self.lossless:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.consumed >= self.latestnum or not self.running)
+                if not self.running:
+                    break
+
+            published = None
+            if self.transform is not None:
+                # read() only ever takes the published buffer, so it cannot take the one picked here
+                published = next(i for i in range(3) if i != self._published and i != self._held)
+                timed = self._prof_transform.start()
+                try:
+                    img = self.transform.apply(img, published)
+                except ValueError as e:
+                    self.log.error("Frame transform %r failed, frames are passed on unchanged: %s",
+                                   self.transform, e)
+                    self.transform = None
+                    published = None
+                self._prof_transform.stop(timed)
+
+            if self.frame_ring and not self.frame_ring.write(img, counter, time.time()):
+                # e.g. an i420 transform output is 1.5x the height of the frame the ring was sized for
+                self.log.warning("Frame of shape %s does not fit the frame ring (max %s), frames are no "
+                                 "longer shared and are saved by the RTSP process", img.shape,
+                                 self.frame_ring.max_shape)
+                self.frame_ring = None
 
             with self.cond:
                 self.frame = img
+                self._published = published
+                self.frame_time = time.perf_counter()
                 self.latestnum = counter
                 self.cond.notify_all()
 
@@ -94,7 +318,9 @@ class FreshestFrame(threading.Thread):
 
         Args:
             wait (bool): Whether to wait for a new frame.
-            seqnumber (int, optional): Specific frame sequence number to wait for.
+            seqnumber (int, optional): Specific frame sequence number to wait for, defaults to
+                any frame newer than the last one returned (a frame that arrived while the caller
+                was busy is returned at once).
             timeout (float, optional): Timeout in seconds.
 
         Returns:
@@ -103,22 +329,24 @@ class FreshestFrame(threading.Thread):
         with self.cond:
             if wait:
                 if seqnumber is None:
-                    seqnumber = self.latestnum + 1
+                    seqnumber = self.consumed + 1
                 if seqnumber < 1:
                     seqnumber = 1
 
-                rv = self.cond.wait_for(
-                    lambda: self.latestnum >= seqnumber, timeout=timeout)
-                if not rv:
-                    return (self.latestnum, self.frame)
+                self.cond.wait_for(
+                    lambda: self.latestnum >= seqnumber or not self.running, timeout=timeout)
 
+            if self.consumed != self.latestnum:
+                self.consumed = self.latestnum
+                self.cond.notify_all()
+            self._held = self._published
             return (self.latestnum, self.frame)
 
 
 class RTSPClient:
     """RTSP client to handle streaming and display."""
 
-    def __init__(self, cam_ip, port, mac, options=None, frame_callback=None):
+    def __init__(self, cam_ip, port, mac, options=None, frame_callback=None, frame_ring=None):
         """
         Initializes the RTSPClient.
 
@@ -128,52 +356,214 @@ class RTSPClient:
             mac (str): MAC address of the camera.
             options (RTSPClientOptions, optional): Configuration options.
             frame_callback (function, optional): Function to call with each new frame.
+            frame_ring (FrameRing, optional): Shared memory ring every captured frame is written to.
         """
         self.cam_ip = cam_ip
         self.port = port
         self.mac = mac
         self.options = options if options else RTSPClientOptions()
         self.frame_callback = frame_callback
+        self.frame_ring = frame_ring
         self._stop_event = threading.Event()
         self.thread = threading.Thread(target=self._run, daemon=True)
         self.fps = 0.0  # Initialize FPS
         self.alpha = 0.1  # Low-pass filter coefficient
+        self.decode_stats = DecodeStats()  # accumulated over reconnects
+        self._reconnect_event = threading.Event()  # switch() / set_options() asked for a new connection
+        self._pause_event = threading.Event()
+        self.frames = 0  # frames handed to the callback
+        self.connects = 0  # streams opened, the first one included
+        self.session = None  # unix ms the current stream was opened, identifies its frames across restarts
+        self._freshest_frame = None  # of the open stream, for metrics()
+        self._stats_lock = threading.Lock()  # counters must not step back while a stream is released
+        self.log = camera_logger('rtsp_client', mac, cam_ip)
+        FrameTransform.from_options(vars(self.options))  # raises ValueError for a bad transform option
+        if self.options.profile_sample_every:
+            enable_profiling(self.options.profile_sample_every)
 
     def start(self):
         """Starts the RTSP client in a separate thread."""
-        print(f"[{self.mac}] Starting RTSP client.")
+        self.log.info("Starting RTSP client.")
         self.thread.start()
 
-    def stop(self):
-        """Stops the RTSP client."""
-        print(f"[{self.mac}] Stopping RTSP client.")
+    def stop(self, drain_timeout=None):
+        """
+        Stops the RTSP client.
+
+        Args:
+            drain_timeout (float, optional): Seconds the frame callback may spend saving the frames it
+                still has queued, passed to its stop() when it takes a timeout. None waits for all of them.
+        """
+        self.log.info("Stopping RTSP client.")
         self._stop_event.set()
         self.thread.join()
         # wait for img store thread stop
         if hasattr(self.frame_callback, 'stop') and callable(getattr(self.frame_callback, 'stop')):
-            self.frame_callback.stop()
+            if 'timeout' in inspect.signature(self.frame_callback.stop).parameters:
+                self.frame_callback.stop(timeout=drain_timeout)
+            else:
+                self.frame_callback.stop()
         else:
-            print("self.frame_callback does not have a 'stop' method.")    
+            self.log.debug("The frame callback has no stop() method.")
                 
-        print(f"[{self.mac}] RTSP client stopped.")
+        self.log.info("RTSP client stopped.")
+
+    def switch(self, cam_ip=None, port=None, mac=None):
+        """Reconnects to another stream (or the same one again) without restarting the client thread."""
+        if cam_ip is not None:
+            self.cam_ip = cam_ip
+        if port is not None:
+            self.port = port
+        if mac is not None:
+            self.mac = mac
+        self.log = camera_logger('rtsp_client', self.mac, self.cam_ip)
+        self._reconnect_event.set()
+
+    def pause(self):
+        """Closes the stream until resume(); the client thread keeps running."""
+        self._pause_event.set()
+
+    def resume(self):
+        """Reopens the stream closed by pause()."""
+        self._pause_event.clear()
+        self._reconnect_event.set()
+
+    def set_options(self, **changes):
+        """
+        Changes RTSPClientOptions of the running client.
+
+        show_fps and retry_interval apply at once, the others (see RECONNECT_OPTIONS) reconnect the stream.
+
+        Raises:
+            ValueError: If an option does not exist, or a transform option is out of range.
+        """
+        unknown = [name for name in changes if not hasattr(self.options, name)]
+        if unknown:
+            raise ValueError(f"Unknown RTSPClientOptions {unknown}")
+        if any(name in TRANSFORM_OPTIONS for name in changes):
+            FrameTransform.from_options(dict(vars(self.options), **changes))
+        for name, value in changes.items():
+            setattr(self.options, name, value)
+        if any(name in RECONNECT_OPTIONS for name in changes):
+            self._reconnect_event.set()
+
+    def metrics(self):
+        """
+        Returns the client's counters, see metrics.py.
+
+        Returns:
+            dict: camera, mac, fps, frames, reconnects, connected, paused, decoded, grabbed,
+                read_failures, log_suppressed, plus 'encoder' with the callback's own encoder statistics
+                when it has a metrics() method, 'motion_gate' with its gate_stats() of this camera and
+                'profile' with the stage latencies when profiling is on.
+        """
+        stats = DecodeStats()
+        with self._stats_lock:
+            stats.merge(self.decode_stats)
+            freshest_frame = self._freshest_frame
+            if freshest_frame is not None:
+                stats.merge(freshest_frame.decode_stats)
+        result = {
+            'camera': self.cam_ip,
+            'mac': self.mac,
+            'fps': self.fps,
+            'frames': self.frames,
+            'reconnects': max(0, self.connects - 1),
+            'connected': freshest_frame is not None and freshest_frame.running,
+            'paused': self._pause_event.is_set(),
+            'decoded': stats.retrieved,
+            'grabbed': stats.grabbed,
+            'read_failures': stats.failed,
+            'log_suppressed': suppressed_count(),
+        }
+        profile = get_profiler().snapshot(self.cam_ip)
+        if profile:
+            result['profile'] = profile[self.cam_ip]
+        if callable(getattr(self.frame_callback, 'metrics', None)):
+            result['encoder'] = self.frame_callback.metrics()
+        if callable(getattr(self.frame_callback, 'gate_stats', None)):
+            result['motion_gate'] = self.frame_callback.gate_stats(self.cam_ip)
+        return result
 
     def _run(self):
         """Internal method to handle the RTSP stream."""
-        rtsp_url = f"rtsp://{self.cam_ip}:{self.port}"
+        rtsp_url = None
         cap = None
         freshest_frame = None
+        last_seq = None
+        window_name = None
+        paused = False
+        sample_every = 1
+        transform = None
+        frame_source = None
 
         while not self._stop_event.is_set():
+            if self._reconnect_event.is_set() or self._pause_event.is_set():
+                # switch(), pause() or set_options(): close the stream, the loop below opens the new one
+                self._reconnect_event.clear()
+                if freshest_frame:
+                    self._release_freshest_frame(freshest_frame)
+                    freshest_frame = None
+                if cap is not None:
+                    cap.release()
+                    cap = None
+                if window_name:
+                    cv2.destroyWindow(window_name)
+                    window_name = None
+                if self._pause_event.is_set():
+                    if not paused:
+                        self.log.info("Stream paused.")
+                        paused = True
+                    self._stop_event.wait(0.2)
+                    continue
+                if paused:
+                    self.log.info("Stream resumed.")
+                    paused = False
+            if getattr(cap, 'finished', False):
+                self.log.info("Frame source %r finished.", frame_source)
+                break
             if cap is None or not cap.isOpened():
-                print(f"[{self.mac}] Connecting to RTSP stream at {rtsp_url}")
-                cap = cv2.VideoCapture(rtsp_url)
+                if freshest_frame:
+                    self._release_freshest_frame(freshest_frame)
+                # read on every connect, switch() and set_options() may have changed them
+                rtsp_url = f"rtsp://{self.cam_ip}:{self.port}"
+                sample_every = 1
+                if self.options.decode_mode == 'sampled':
+                    if self.options.display_window:
+                        self.log.info("Sampled decoding is disabled while the stream is displayed.")
+                    else:
+                        sample_every = max(1, self.options.sample_every)
+                transform = FrameTransform.from_options(vars(self.options))
+                if transform is not None:
+                    self.log.info("Frames are transformed by %r", transform)
+                profiler = get_profiler()  # per connection, switch() may have changed the camera
+                prof_handoff = profiler.stage('handoff', self.cam_ip)
+                prof_callback = profiler.stage('callback', self.cam_ip)
+                prof_preview = profiler.stage('preview', self.cam_ip)
+                prof_overlay = profiler.stage('fps_overlay', self.cam_ip)
+                prof_display = profiler.stage('display', self.cam_ip)
+                try:
+                    frame_source = get_frame_source(self.options.frame_source, self.options.ingest_profile)
+                    self.log.info("Connecting to %r at %s", frame_source, rtsp_url)
+                    cap = frame_source.open(rtsp_url)
+                except (OSError, ValueError, TypeError) as e:
+                    cap = None
+                    if self.options.frame_source is not None:
+                        # a replay directory without files does not fill up later
+                        self.log.error("Cannot open frame source %r: %s", self.options.frame_source, e)
+                        break
+                    # e.g. an unknown ingest_profile, set_options() may still fix it
+                    self.log.error("Cannot open the stream: %s. Retrying in %s seconds...", e,
+                                   self.options.retry_interval)
+                    self._stop_event.wait(self.options.retry_interval)
+                    continue
                 if not cap.isOpened():
-                    print(
-                        f"[{self.mac}] Failed to open RTSP stream. Retrying in {self.options.retry_interval} seconds...")
+                    self.log.warning("Failed to open RTSP stream. Retrying in %s seconds...",
+                                     self.options.retry_interval)
                     if cap:
                         cap.release()
                     cap = None
-                    time.sleep(self.options.retry_interval)
+                    self._stop_event.wait(self.options.retry_interval)
                     continue
 
                 if self.options.display_window:
@@ -185,16 +575,35 @@ class RTSPClient:
                             window_name, self.options.window_width, self.options.window_height)
 
                 # Initialize FreshestFrame
-                freshest_frame = FreshestFrame(cap, callback=None)
+                freshest_frame = FreshestFrame(cap, callback=None, frame_ring=self.frame_ring,
+                                               sample_every=sample_every,
+                                               lossless=not getattr(cap, 'realtime', True), logger=self.log,
+                                               camera=self.cam_ip, transform=transform)
+                self._freshest_frame = freshest_frame
+                self.connects += 1
+                self.session = int(time.time() * 1000)
+                last_seq = None
 
             if freshest_frame:
                 seq, frame = freshest_frame.read(wait=True, timeout=1.0)
+                if freshest_frame.failed:
+                    self.log.warning("Stream stopped delivering frames. Reconnecting in %s seconds...",
+                                     self.options.retry_interval)
+                    self._release_freshest_frame(freshest_frame)
+                    cap = None
+                    self._stop_event.wait(self.options.retry_interval)
+                    continue
                 if frame is None:
-                    print(f"[{self.mac}] No frame received. Reconnecting...")
-                    freshest_frame.release()
+                    self.log.warning("No frame received. Reconnecting...")
+                    self._release_freshest_frame(freshest_frame)
                     cap = None
-                    time.sleep(self.options.retry_interval)
+                    self._stop_event.wait(self.options.retry_interval)
                     continue
+                if seq == last_seq:
+                    continue  # timed out waiting, do not call back twice with the same frame
+                last_seq = seq
+                if prof_handoff.sample():
+                    prof_handoff.record(time.perf_counter() - freshest_frame.frame_time)
 
                 # Process FPS with low-pass filter
                 current_time = time.time()
@@ -208,33 +617,67 @@ class RTSPClient:
                         (1 - self.alpha) * self.fps
                 self._last_time = current_time
 
-                if self.options.show_fps:
-                    frame = self._add_fps(frame)
-
+                self.frames += 1
                 if self.frame_callback:
                     other_info = {'mac': self.mac,
-                                  'rtsp': rtsp_url, 'seq': seq, 'ip': self.cam_ip}
+                                  'rtsp': rtsp_url, 'seq': seq, 'ip': self.cam_ip,
+                                  # None once frames stopped fitting, the callback then encodes locally
+                                  'ring': self.frame_ring.name if freshest_frame.frame_ring else None,
+                                  'decode_every': sample_every, 'timestamp': current_time,
+                                  'session': self.session,
+                                  'reused_buffer': freshest_frame.transform is not None}
+                    timed = prof_callback.start()
                     self.frame_callback(frame, other_info)
+                    prof_callback.stop(timed)
 
                 if self.options.display_window and freshest_frame:
-                    cv2.imshow(window_name, frame)
-                    if cv2.waitKey(1) & 0xFF == ord('q'):
-                        print(
-                            f"[{self.mac}] Quit signal received. Terminating RTSP client.")
-                        self.stop()
+                    # overlays go on a scaled preview copy, never on the frame saved by the callback
+                    timed = prof_preview.start()
+                    if self.options.resize_window:
+                        preview = cv2.resize(frame, (self.options.window_width, self.options.window_height),
+                                             interpolation=cv2.INTER_AREA)
+                    else:
+                        preview = frame.copy()
+                    prof_preview.stop(timed)
+                    if self.options.show_fps:
+                        timed = prof_overlay.start()
+                        preview = self._add_fps(preview)
+                        prof_overlay.stop(timed)
+                    timed = prof_display.start()
+                    cv2.imshow(window_name, preview)
+                    key = cv2.waitKey(1)
+                    prof_display.stop(timed)
+                    if key & 0xFF == ord('q'):
+                        self.log.info("Quit signal received. Terminating RTSP client.")
+                        self._stop_event.set()  # run_rtsp_client calls stop() once this thread ends
                         break
 
         # Cleanup
         if freshest_frame:
-            freshest_frame.release()
+            self._release_freshest_frame(freshest_frame)
+        if sample_every > 1:
+            self.log.info("Sampled decoding: %s", self.decode_stats.summary())
+        if get_profiler().enabled:
+            print(get_profiler().report(self.cam_ip))
         if cap and cap.isOpened():
             cap.release()
         if self.options.display_window:
             cv2.destroyAllWindows()
-        print(f"[{self.mac}] RTSP client process terminated.")
+        if self.frame_ring:
+            self.frame_ring.close()
+        self.log.info("RTSP client process terminated.")
+
+    def _release_freshest_frame(self, freshest_frame):
+        """Releases a FreshestFrame once and keeps its decode statistics."""
+        if not freshest_frame.released:
+            freshest_frame.release()
+            with self._stats_lock:
+                self.decode_stats.merge(freshest_frame.decode_stats)
+                if self._freshest_frame is freshest_frame:
+                    self._freshest_frame = None
 
     def _add_fps(self, frame):
-        """Adds FPS information to the frame using low-pass filter."""
+        """Adds FPS information to a preview frame using low-pass filter."""
         fps_text = f"FPS: {self.fps:.2f}"
         cv2.putText(frame, fps_text, (10, 30),
                     cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
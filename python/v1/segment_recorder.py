@@ -0,0 +1,358 @@
+# segment_recorder.py
+
+import csv
+import io
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from camera_client_handler import launch_rtsp_process
+from log import camera_logger
+from utils import STREAM_STOP_GRACE
+
+'''
+SegmentRecorder
+
+不經過 decode / re-encode，把 camera 的 HEVC / H.264 stream (RTSP.ino 的 VideoSetting) 原封不動地
+remux 成固定長度的 MP4 / MKV 片段:
+- 每台 camera 一個 ffmpeg 子進程: -c copy + segment muxer，只在 keyframe 切檔，CPU 成本只有解封包與寫檔
+- 檔案: <directory>/<camera ip>/<開始時間 %Y%m%d-%H%M%S>.mp4；MP4 使用 fragmented MP4，
+  ffmpeg 被強制結束時已寫入的部分仍可播放
+- ffmpeg 每完成一個片段就在 stdout (segment list, csv) 輸出一行，SegmentRecorder 把它轉成牆上時間
+  追加到 <camera 目錄>/index.csv (file, start, end, duration, bytes)，find_segments() 依時間範圍查詢
+- ffmpeg 結束 (camera 斷線) 時等 retry_interval 秒後重新開始；terminate() 經由 stdin 送出 'q'，
+  讓 ffmpeg 寫完目前的片段再結束
+
+RecordingLauncher 是 register_camera 的 rtsp_launcher:
+- 預設在原本的 RTSP client 之外多開一個錄影進程 (camera 需要同時服務兩個 RTSP session)，
+  回傳的 RecordedProcess 與原本的 handle 用法相同 (command、metrics 都轉交給 RTSP client)
+- record_only=True 時只錄影、不 decode，camera 的 handle 就是 SegmentRecorder
+
+需要 PATH 上有 ffmpeg (或以 ffmpeg 參數指定路徑)。
+'''
+
+CONTAINERS = {
+    # segment format, file extension, extra muxer options
+    'mp4': ('mp4', 'mp4', ['-segment_format_options', 'movflags=+frag_keyframe+empty_moov+default_base_moof']),
+    'mkv': ('matroska', 'mkv', []),
+}
+INDEX_FILE = 'index.csv'
+INDEX_FIELDS = ('file', 'start', 'end', 'duration', 'bytes')
+
+Segment = namedtuple('Segment', INDEX_FIELDS)
+
+# Held while ffmpeg is started and by every fork() of this process (the RTSP processes and pool workers).
+# A process forked in the middle of Popen would inherit the write ends of ffmpeg's pipes: Popen would wait
+# for that process to exit, and the recorder would never see ffmpeg's stdout close.
+_popen_lock = threading.Lock()
+
+
+def _after_fork_in_child():
+    global _popen_lock
+    _popen_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=lambda: _popen_lock.acquire(), after_in_parent=lambda: _popen_lock.release(),
+                        after_in_child=_after_fork_in_child)
+
+
+def ffmpeg_command(url, pattern, segment_seconds=60, container='mp4', rtsp_transport='tcp', ffmpeg='ffmpeg'):
+    """
+    Builds the ffmpeg command line recording `url` into segments.
+
+    Args:
+        url (str): RTSP url of the camera.
+        pattern (str): Output path with strftime fields, e.g. 'rec/10.0.0.2/%Y%m%d-%H%M%S.mp4'.
+        segment_seconds (float): Target segment length, segments are cut at the next keyframe.
+        container (str): One of CONTAINERS.
+        rtsp_transport (str): 'tcp' or 'udp'.
+        ffmpeg (str): ffmpeg executable.
+
+    Returns:
+        list: The arguments for subprocess.
+    """
+    segment_format, _, options = CONTAINERS[container]
+    return [ffmpeg, '-hide_banner', '-nostats', '-loglevel', 'warning',
+            '-rtsp_transport', rtsp_transport, '-i', url,
+            '-map', '0', '-c', 'copy',
+            '-f', 'segment', '-segment_time', str(segment_seconds), '-segment_format', segment_format,
+            *options, '-reset_timestamps', '1', '-strftime', '1',
+            '-segment_list', 'pipe:1', '-segment_list_type', 'csv',
+            pattern]
+
+
+def read_index(camera_dir):
+    """
+    Returns:
+        list: The Segments of a camera directory in recording order, empty without an index.
+    """
+    path = os.path.join(camera_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, newline='') as f:
+        return [Segment(row['file'], float(row['start']), float(row['end']), float(row['duration']),
+                        int(row['bytes']))
+                for row in csv.DictReader(f)]
+
+
+def find_segments(camera_dir, start=None, end=None):
+    """
+    Returns the Segments overlapping a time range.
+
+    Args:
+        camera_dir (str): <directory>/<camera ip> of a SegmentRecorder.
+        start (float, optional): Unix time the range starts at, open when None.
+        end (float, optional): Unix time the range ends at, open when None.
+    """
+    return [segment for segment in read_index(camera_dir)
+            if (start is None or segment.end > start) and (end is None or segment.start < end)]
+
+
+class SegmentRecorder:
+    """Records one camera's stream into segments with ffmpeg, restarting it when the stream drops."""
+
+    def __init__(self, cam_ip, port, mac, directory, segment_seconds=60, container='mp4', rtsp_transport='tcp',
+                 ffmpeg='ffmpeg', retry_interval=5):
+        """
+        Initializes the SegmentRecorder.
+
+        Args:
+            cam_ip (str): Camera IP address.
+            port (str): RTSP port.
+            mac (str): MAC address of the camera.
+            directory (str): Recordings root, segments go to <directory>/<cam_ip>/.
+            segment_seconds (float): Target segment length.
+            container (str): 'mp4' or 'mkv'.
+            rtsp_transport (str): 'tcp' or 'udp'.
+            ffmpeg (str): ffmpeg executable.
+            retry_interval (float): Seconds before ffmpeg is restarted after it exited.
+        """
+        if container not in CONTAINERS:
+            raise ValueError(f"Unknown container {container!r}, expected one of {list(CONTAINERS)}")
+        self.cam_ip = cam_ip
+        self.port = port
+        self.mac = mac
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.container = container
+        self.rtsp_transport = rtsp_transport
+        self.ffmpeg = ffmpeg
+        self.retry_interval = retry_interval
+        self.segments = 0
+        self.bytes = 0
+        self.restarts = 0
+        self.log = camera_logger('recorder', mac, cam_ip)
+        self._proc = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._restart = False  # switch() asked for ffmpeg to be restarted at once
+        self.thread = threading.Thread(target=self._run, name=f'Recorder-{cam_ip}', daemon=True)
+
+    @property
+    def camera_dir(self):
+        return os.path.join(self.directory, self.cam_ip)
+
+    @property
+    def pid(self):
+        proc = self._proc
+        return proc.pid if proc else None
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def is_alive(self):
+        return self.thread.is_alive()
+
+    def _quit_ffmpeg(self):
+        # 'q' makes ffmpeg finish the open segment and print its list entry before exiting
+        with self._lock:
+            proc = self._proc
+            if proc is None or proc.poll() is not None:
+                return
+            try:
+                proc.stdin.write(b'q')
+                proc.stdin.flush()
+            except (BrokenPipeError, OSError, ValueError):
+                proc.terminate()
+
+    def switch(self, cam_ip=None, port=None, mac=None):
+        """Moves the recorder to another stream, finishing the current segment first."""
+        with self._lock:
+            self.cam_ip = cam_ip or self.cam_ip
+            self.port = port or self.port
+            self.mac = mac or self.mac
+            self.log = camera_logger('recorder', self.mac, self.cam_ip)
+            self._restart = True
+        self._quit_ffmpeg()
+        return self.is_alive()
+
+    def terminate(self):
+        """Finishes the current segment and stops recording, join() waits for it."""
+        self._stop_event.set()
+        self._quit_ffmpeg()
+
+    def stop(self, timeout=STREAM_STOP_GRACE):
+        self.terminate()
+        self.join(timeout)
+
+    def join(self, timeout=None):
+        """Waits for ffmpeg to finish, it is killed after `timeout` seconds (STREAM_STOP_GRACE when None)."""
+        timeout = STREAM_STOP_GRACE if timeout is None else timeout
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            with self._lock:
+                proc = self._proc
+            if proc is not None:
+                self.log.warning("ffmpeg %s did not finish within %.0f s, killing it.", proc.pid, timeout)
+                proc.kill()
+            self.thread.join()
+
+    def recording_stats(self):
+        """Returns the counters exported by metrics.py."""
+        proc = self._proc
+        return {'recording': proc is not None and proc.poll() is None, 'segments': self.segments,
+                'bytes': self.bytes, 'restarts': self.restarts}
+
+    def _run(self):
+        executable = shutil.which(self.ffmpeg)
+        if executable is None:
+            self.log.error("%s not found, recording is disabled.", self.ffmpeg)
+            return
+        while not self._stop_event.is_set():
+            with self._lock:
+                self._restart = False
+                camera_dir = self.camera_dir
+                url = f"rtsp://{self.cam_ip}:{self.port}"
+            os.makedirs(camera_dir, exist_ok=True)
+            extension = CONTAINERS[self.container][1]
+            command = ffmpeg_command(url, os.path.join(camera_dir, f'%Y%m%d-%H%M%S.{extension}'),
+                                     self.segment_seconds, self.container, self.rtsp_transport, executable)
+            try:
+                with _popen_lock:
+                    proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE)
+            except OSError as e:
+                self.log.error("Failed to start ffmpeg: %s", e)
+                self._stop_event.wait(self.retry_interval)
+                continue
+            with self._lock:
+                self._proc = proc
+                restart = self._restart
+            self.log.info("Recording %s into %s (%s s %s segments).", url, camera_dir, self.segment_seconds,
+                          self.container)
+            if self._stop_event.is_set() or restart:
+                self._quit_ffmpeg()  # terminate() or switch() came before the process was visible to them
+            stderr_thread = threading.Thread(target=self._log_stderr, args=(proc.stderr,), daemon=True)
+            stderr_thread.start()
+            for line in io.TextIOWrapper(proc.stdout, encoding='utf-8', errors='replace'):
+                self._add_segment(camera_dir, line)
+            code = proc.wait()
+            stderr_thread.join()
+            with self._lock:
+                self._proc = None
+                restart = self._restart
+            if self._stop_event.is_set() or restart:
+                continue
+            self.restarts += 1
+            self.log.warning("ffmpeg exited with code %s. Restarting in %s seconds...", code, self.retry_interval)
+            self._stop_event.wait(self.retry_interval)
+        self.log.info("Recording stopped: %d segments, %.1f MB.", self.segments, self.bytes / 1e6)
+
+    def _add_segment(self, camera_dir, line):
+        """Appends the segment of one ffmpeg list entry ("file,start,end") to the index."""
+        try:
+            name, start, end = next(csv.reader([line]))
+            duration = float(end) - float(start)
+        except (StopIteration, ValueError):
+            return
+        finished = time.time()  # the entry is printed when the segment is closed
+        name = os.path.basename(name)
+        try:
+            size = os.path.getsize(os.path.join(camera_dir, name))
+        except OSError:
+            size = 0
+        index_path = os.path.join(camera_dir, INDEX_FILE)
+        new_index = not os.path.exists(index_path)
+        with open(index_path, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if new_index:
+                writer.writerow(INDEX_FIELDS)
+            writer.writerow([name, f"{finished - duration:.3f}", f"{finished:.3f}", f"{duration:.3f}", size])
+        self.segments += 1
+        self.bytes += size
+
+    def _log_stderr(self, pipe):
+        for line in io.TextIOWrapper(pipe, encoding='utf-8', errors='replace'):
+            line = line.strip()
+            if line:
+                self.log.warning("ffmpeg: %s", line)
+
+
+class RecordedProcess:
+    """RTSP process handle that also stops, switches and reports its camera's SegmentRecorder."""
+
+    def __init__(self, process, recorder):
+        self.process = process
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        # commands, metrics and pid come from the RTSP process
+        return getattr(self.process, name)
+
+    def switch(self, cam_ip=None, port=None, mac=None):
+        if not hasattr(self.process, 'switch') or not self.process.switch(cam_ip, port, mac):
+            return False
+        self.recorder.switch(cam_ip, port, mac)
+        return True
+
+    def terminate(self):
+        self.recorder.terminate()
+        self.process.terminate()
+
+    def join(self, timeout=None):
+        self.process.join(timeout)
+        self.recorder.join()
+
+    def recording_stats(self):
+        return self.recorder.recording_stats()
+
+
+class RecordingLauncher:
+    """`rtsp_launcher` of register_camera that records every camera it starts."""
+
+    def __init__(self, directory, segment_seconds=60, container='mp4', rtsp_transport='tcp', ffmpeg='ffmpeg',
+                 launcher=None, record_only=False):
+        """
+        Initializes the RecordingLauncher.
+
+        Args:
+            directory (str): Recordings root.
+            segment_seconds (float): Target segment length.
+            container (str): 'mp4' or 'mkv'.
+            rtsp_transport (str): 'tcp' or 'udp'.
+            ffmpeg (str): ffmpeg executable.
+            launcher (callable, optional): Launcher of the RTSP client, launch_rtsp_process when None.
+            record_only (bool): Only record, do not start an RTSP client.
+        """
+        if container not in CONTAINERS:
+            raise ValueError(f"Unknown container {container!r}, expected one of {list(CONTAINERS)}")
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.container = container
+        self.rtsp_transport = rtsp_transport
+        self.ffmpeg = ffmpeg
+        self.launcher = launcher
+        self.record_only = record_only
+
+    def launch(self, cam_ip, port, mac, frame_callback, show_stream, frame_ring, rtsp_options):
+        recorder = SegmentRecorder(cam_ip, port, mac, self.directory, self.segment_seconds, self.container,
+                                   self.rtsp_transport, self.ffmpeg).start()
+        if self.record_only:
+            return recorder
+        launcher = self.launcher or launch_rtsp_process
+        process = launcher(cam_ip, port, mac, frame_callback, show_stream, frame_ring, rtsp_options)
+        return RecordedProcess(process, recorder)
@@ -5,21 +5,28 @@ import threading
 from utils import get_local_ip, MAX_CAMERA_NUM, SOCKET_TIMEOUT
 from camera_manager import CameraManager
 from camera_client_handler import CameraClientHandler
+from log import get_logger
+
+log = get_logger('server')
 
 
 class Server:
     """Main server class to listen for camera client connections."""
 
-    def __init__(self, host='0.0.0.0', port=12345, frame_callback=None, show_stream=True):
+    def __init__(self, host='0.0.0.0', port=12345, frame_callback=None, show_stream=True, rtsp_options=None,
+                 display=None, rtsp_launcher=None, failure_detector='fixed', heartbeat_timeout=30):
         self.host = host
         self.port = port
         self.server_socket = None
         self.client_threads = {}
-        self.camera_manager = CameraManager(client_threads=self.client_threads)
+        self.camera_manager = CameraManager(client_threads=self.client_threads, display=display,
+                                            timeout=heartbeat_timeout, failure_detector=failure_detector)
         self.heartbeat_thread = None
         self.camera_table_thread = None
         self.frame_callback = frame_callback
         self.show_stream = show_stream
+        self.rtsp_options = rtsp_options  # extra RTSPClientOptions for every camera
+        self.rtsp_launcher = rtsp_launcher  # starts the RTSP client of a camera, see register_camera
 
     def start(self):
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -52,7 +59,7 @@ class Server:
                     client_socket, addr = self.server_socket.accept()
                     
                     # if a connection was accepted
-                    print(f'A connection from {addr[0]}:{addr[1]} was accepted.')
+                    log.info('A connection from %s:%s was accepted.', addr[0], addr[1])
                     
                     # check if there is already a running thread
                     # addr format -> (ip,port)
@@ -65,7 +72,8 @@ class Server:
                         print(f'Closed client handler thread: {addr} .')
                     
                     client_handler = CameraClientHandler(
-                        client_socket, addr, self.camera_manager, self.frame_callback, self.show_stream)
+                        client_socket, addr, self.camera_manager, self.frame_callback, self.show_stream,
+                        self.rtsp_options, self.rtsp_launcher)
                     client_handler.daemon = True
                     client_handler.start()
                     
@@ -102,8 +110,7 @@ class Server:
                 if process and process.is_alive():
                     print(
                         f"Terminating RTSP client for {mac} at {info['ip']}:{info['port']}")
-                    process.terminate()
-                    process.join()
+                self.camera_manager.release_camera(info)
             self.camera_manager.connected_cameras.clear()
         print("All RTSP client processes have been terminated.")
 
@@ -0,0 +1,190 @@
+# stream_control.py
+
+import threading
+import time
+from metrics import process_usage
+from utils import STREAM_DRAIN_TIMEOUT, STREAM_STOP_GRACE
+from log import get_logger
+
+'''
+Stream control
+
+每個 RTSP 進程 (launch_rtsp_process 建立的進程，或 worker_pool 的 worker) 都有一條 command pipe，
+主進程不再需要 terminate() 才能停止它:
+- stop: 停止 RTSPClient，FrameCallback 在 drain_timeout 秒內把 queue 中的 frame 存完 (超過時間的才丟掉)，
+  取代原本 terminate() 造成的 JPEG 遺失
+- switch: 換到新的 URL (例如 camera 以新的 IP / port 重新註冊)，進程與 FrameRing 都沿用
+- pause / resume: 關閉 stream 但保留進程，resume 後重新連線
+- set_options: 在執行中修改 RTSPClientOptions，例如 show_fps、decode_mode、ingest_profile
+- metrics: 子進程回覆 RTSPClient.metrics() 與進程的 CPU / RSS，handle 在 poll() 時讀回 handle.metrics (metrics.py)
+
+子進程以 serve_commands() 接收 command；主進程持有的 handle (RtspProcess / worker_pool.PooledRtspProcess)
+提供與 multiprocessing.Process 相同的 is_alive() / terminate() / join() / pid，terminate() 也改為送出 stop，
+join() 等待超過 drain_timeout + STREAM_STOP_GRACE 仍未結束才強制結束進程。
+'''
+
+CMD_STOP = 'stop'
+CMD_SWITCH = 'switch'
+CMD_PAUSE = 'pause'
+CMD_RESUME = 'resume'
+CMD_SET_OPTIONS = 'set_options'
+CMD_METRICS = 'metrics'
+COMMANDS = (CMD_STOP, CMD_SWITCH, CMD_PAUSE, CMD_RESUME, CMD_SET_OPTIONS, CMD_METRICS)
+
+log = get_logger('stream_control')
+
+
+def serve_commands(client, conn, drain_timeout=STREAM_DRAIN_TIMEOUT):
+    """
+    Runs commands from `conn` on a started RTSPClient until it is told to stop or its thread ends,
+    then stops it.
+
+    Args:
+        client (RTSPClient): The started client.
+        conn (multiprocessing.connection.Connection): Child end of the command pipe.
+        drain_timeout (float): Default seconds the frame callback may spend saving queued frames.
+
+    Returns:
+        bool: False if the pipe was closed, i.e. the main process is gone.
+    """
+    connected = True
+    try:
+        # the client thread ends by itself when a file or synthetic frame source finishes
+        while client.thread.is_alive():
+            if not conn.poll(0.5):
+                continue
+            message = conn.recv()
+            if not isinstance(message, tuple):
+                continue  # e.g. the None asking an idle pooled worker to exit
+            command, kwargs = message
+            if command == CMD_STOP:
+                drain_timeout = kwargs.get('drain_timeout', drain_timeout)
+                break
+            try:
+                if command == CMD_SWITCH:
+                    client.switch(**kwargs)
+                elif command == CMD_PAUSE:
+                    client.pause()
+                elif command == CMD_RESUME:
+                    client.resume()
+                elif command == CMD_SET_OPTIONS:
+                    client.set_options(**kwargs)
+                elif command == CMD_METRICS:
+                    conn.send(('metrics', dict(client.metrics(), **process_usage())))
+                else:
+                    client.log.warning("Unknown stream command %r", command)
+            except (TypeError, ValueError) as e:
+                client.log.warning("Invalid %s command: %s", command, e)
+    except (EOFError, OSError):
+        connected = False
+    client.stop(drain_timeout=drain_timeout)
+    return connected
+
+
+class StreamHandle:
+    """Commands of the main process to one RTSP client, sent over its command pipe."""
+
+    conn = None
+    metrics = None  # last reply to request_metrics()
+    metrics_time = None
+
+    def _on_message(self, message):
+        """Keeps a metrics reply. Returns False for other messages."""
+        if message[0] != 'metrics':
+            return False
+        self.metrics = message[1]
+        self.metrics_time = time.time()
+        return True
+
+    def poll(self):
+        """Reads the replies that arrived on the pipe."""
+        raise NotImplementedError
+
+    def send(self, command, **kwargs):
+        """
+        Sends one of COMMANDS.
+
+        Returns:
+            bool: False if the RTSP process is gone.
+        """
+        if command not in COMMANDS:
+            raise ValueError(f"Unknown stream command {command!r}, expected one of {COMMANDS}")
+        try:
+            self.conn.send((command, kwargs))
+            return True
+        except (BrokenPipeError, OSError):
+            return False
+
+    def stop(self, drain_timeout=STREAM_DRAIN_TIMEOUT):
+        """Stops the client after up to `drain_timeout` seconds of saving queued frames."""
+        return self.send(CMD_STOP, drain_timeout=drain_timeout)
+
+    def switch(self, cam_ip=None, port=None, mac=None):
+        """Moves the client to another stream, keeping its process."""
+        return self.send(CMD_SWITCH, cam_ip=cam_ip, port=port, mac=mac)
+
+    def pause(self):
+        return self.send(CMD_PAUSE)
+
+    def resume(self):
+        return self.send(CMD_RESUME)
+
+    def set_options(self, **options):
+        """Changes RTSPClientOptions of the running client."""
+        return self.send(CMD_SET_OPTIONS, **options)
+
+    def request_metrics(self):
+        """Asks for a metrics snapshot, available in `metrics` after a later poll()."""
+        return self.send(CMD_METRICS)
+
+
+class RtspProcess(StreamHandle):
+    """A dedicated RTSP process and its command pipe, returned by launch_rtsp_process."""
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self._lock = threading.Lock()
+        self.stop_timeout = STREAM_DRAIN_TIMEOUT + STREAM_STOP_GRACE
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def poll(self):
+        with self._lock:
+            try:
+                while self.conn.poll():
+                    self._on_message(self.conn.recv())
+            except (EOFError, OSError):
+                pass  # the process is gone or joined
+
+    def stop(self, drain_timeout=STREAM_DRAIN_TIMEOUT):
+        self.stop_timeout = drain_timeout + STREAM_STOP_GRACE
+        return super().stop(drain_timeout)
+
+    def terminate(self):
+        """Stops the client gracefully, like stop(); kill() ends the process at once."""
+        if self.process.is_alive() and not self.stop():
+            self.process.terminate()
+
+    def kill(self):
+        self.process.kill()
+
+    def join(self, timeout=None):
+        """
+        Waits for the process to exit. It is terminated when it is still running after `timeout`
+        seconds (the drain timeout plus STREAM_STOP_GRACE when None).
+        """
+        timeout = self.stop_timeout if timeout is None else timeout
+        self.process.join(timeout)
+        if self.process.is_alive():
+            log.warning("RTSP process %s did not stop within %.0f s, terminating it.", self.pid, timeout)
+            self.process.terminate()
+            self.process.join()
+        with self._lock:
+            self.conn.close()
+
@@ -5,6 +5,11 @@ import socket
 DEBUG = False
 SOCKET_TIMEOUT = 1.0
 MAX_CAMERA_NUM = 12
+LISTEN_BACKLOG = 256  # accept queue of the asyncio control plane
+FRAME_RING_SLOTS = 4  # shared memory frame slots per camera, 0 disables the ring
+FRAME_RING_MAX_SHAPE = (1080, 1920, 3)  # VIDEO_FHD in RTSP.ino
+STREAM_DRAIN_TIMEOUT = 5.0  # seconds a stopping RTSP process may spend saving its queued frames
+STREAM_STOP_GRACE = 5.0  # extra seconds for the stream itself to close before the process is killed
 
 def get_local_ip():
     """Returns the local IP address within the LAN."""
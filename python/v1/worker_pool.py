@@ -0,0 +1,329 @@
+# worker_pool.py
+
+import multiprocessing
+import os
+from multiprocessing import resource_tracker
+import threading
+import time
+import cv2  # noqa: F401  warm-up: launch_rtsp_process children forked from here start with it loaded
+from camera_client_handler import launch_rtsp_process
+from process_wrapper import create_rtsp_client
+from stream_control import StreamHandle, serve_commands
+from log import get_logger, init_process, logging_settings, stop_logging
+from profiling import get_profiler, install_signal_dump
+from utils import STREAM_DRAIN_TIMEOUT, STREAM_STOP_GRACE
+
+'''
+RtspWorkerPool
+
+預先啟動的 RTSP worker 進程池，取代每次註冊都建立新的 multiprocessing.Process:
+- worker 啟動時就完成 interpreter 啟動與 cv2 / numpy / rtsp_client 的 import (spawn 平台上還包含重新 import main.py)，
+  之後在 idle 狀態等待 control pipe 上的工作
+- launch() 與 launch_rtsp_process 的參數相同 (register_camera 的 rtsp_launcher)，把 camera 的 URL、FrameRing
+  與 rtsp_options 經由 pipe 交給一個 idle worker，註冊到第一張 frame 只剩 RTSP handshake 的時間
+- 回傳的 PooledRtspProcess 與 multiprocessing.Process 有相同的 is_alive() / terminate() / join() / pid，
+  也接受 stream_control.py 的 command (switch / pause / resume / set_options)；terminate() 只停止該 worker 上的
+  RTSPClient (並存完 queue 中的 frame)，worker 完成後回到 pool 給下一台 camera 使用
+- 每交出一個 worker 就在背景補一個新的，idle 的 worker 維持在 size 個；多出來的 worker 直接結束
+- worker 由 forkserver 建立 (沒有 forkserver 的平台使用 spawn): 補 worker 時 server 的 thread 都在執行，直接 fork
+  可能把其他 thread 持有的 lock 複製到子進程。fork server 是單一 thread，啟動時 import WARM_MODULES，
+  之後 fork 出來的 worker 一樣不需要重新 import
+
+frame_callback 在 worker 建立時傳入 (FrameCallback 含有 multiprocessing.Queue，只能經由繼承傳遞，而且必須以
+worker_context() 建立)，所以 launch() 收到其他的 callback 時會改用 launch_rtsp_process 建立一般的進程。
+'''
+
+# imported once by the fork server, every worker forked from it starts with them loaded
+WARM_MODULES = ['cv2', 'numpy', 'process_wrapper']
+
+log = get_logger('worker_pool')
+
+
+def worker_context():
+    """
+    multiprocessing context the workers are started with, see the overview above. Queues and locks
+    in the pool's frame_callback must be created from it.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(WARM_MODULES)
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def _worker_main(conn, frame_callback, log_settings):
+    """Loop of a pooled worker process: runs one camera's RTSPClient per job received on `conn`."""
+    init_process(log_settings)  # the fork server never ran setup_logging(), nothing to inherit
+    conn.send(('ready', os.getpid()))
+    try:
+        while True:
+            try:
+                job = conn.recv()
+            except EOFError:
+                break  # the pool is gone
+            if job is None:
+                break
+            if len(job) == 2:
+                continue  # a stream command that raced the end of the previous camera
+            cam_ip, port, mac, show_stream, frame_ring, options = job
+            client = create_rtsp_client(cam_ip, port, mac, frame_callback, show_stream, frame_ring=frame_ring,
+                                        options=options)
+            if get_profiler().enabled:
+                install_signal_dump()  # before the main process forwards SIGUSR1 here, its default ends the worker
+            client.start()
+            if not serve_commands(client, conn):
+                break  # the pool is gone
+            conn.send(('done', mac))
+    except KeyboardInterrupt:
+        print('Close owing to KeyboardInterrupt from RTSP worker')
+    finally:
+        stop_logging()
+
+
+class _Worker:
+    """Parent side of one worker process."""
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.ready = False
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def wait_ready(self, timeout=None):
+        """Waits for the worker to finish its imports. Returns False on timeout or death."""
+        if not self.ready and self.conn.poll(timeout):
+            self.ready = self.conn.recv()[0] == 'ready'
+        return self.ready
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class PooledRtspProcess(StreamHandle):
+    """One camera's lease of a pooled worker, used like the RtspProcess of launch_rtsp_process."""
+
+    def __init__(self, pool, worker, mac):
+        self.pool = pool
+        self.worker = worker
+        self.conn = worker.conn
+        self.mac = mac
+        self.pid = worker.pid
+        self.stopping = False
+        self._done = False
+        self._lock = threading.RLock()
+
+    def _poll_done(self, timeout=0.0):
+        """Consumes the worker's messages until 'done' arrives, returns whether the lease ended."""
+        if self._done:
+            return True
+        try:
+            while self.worker.conn.poll(timeout):
+                message = self.worker.conn.recv()
+                if message[0] == 'done':
+                    self._finish(reuse=True)
+                    return True
+                if not self._on_message(message):
+                    # 'ready' of a worker that took its first job before it was read
+                    self.worker.ready = True
+        except (EOFError, OSError):
+            self._finish(reuse=False)
+            return True
+        if not self.worker.process.is_alive():
+            self._finish(reuse=False)
+            return True
+        return False
+
+    def _finish(self, reuse):
+        self._done = True
+        self.pool._release(self.worker, reuse)
+
+    def is_alive(self):
+        with self._lock:
+            return not self._poll_done()
+
+    def poll(self):
+        with self._lock:
+            self._poll_done()
+
+    def send(self, command, **kwargs):
+        # once the lease ended the worker may already serve another camera
+        with self._lock:
+            if self._poll_done():
+                return False
+            return super().send(command, **kwargs)
+
+    def terminate(self):
+        """Stops this camera's RTSPClient gracefully; the worker itself keeps running."""
+        with self._lock:
+            if self._done or self.stopping:
+                return
+            self.stopping = True
+            if not self.stop():
+                self._finish(reuse=False)
+
+    def join(self, timeout=None):
+        """
+        Waits for the RTSPClient to stop. A worker that does not stop within `timeout` (the pool's
+        stop_timeout when None) is killed and replaced, so a hung stream cannot block the caller.
+        """
+        timeout = self.pool.stop_timeout if timeout is None else timeout
+        with self._lock:
+            deadline = time.monotonic() + timeout
+            while not self._poll_done(max(0.0, min(0.5, deadline - time.monotonic()))):
+                if time.monotonic() >= deadline:
+                    log.warning("[%s] RTSP worker %s did not stop within %.0f s, killing it.",
+                                self.mac, self.pid, timeout)
+                    self._finish(reuse=False)
+                    break
+
+
+class RtspWorkerPool:
+    """Warm worker processes that run RTSP clients and are reused across cameras and reconnects."""
+
+    def __init__(self, frame_callback=None, size=2, stop_timeout=STREAM_DRAIN_TIMEOUT + STREAM_STOP_GRACE):
+        """
+        Initializes the RtspWorkerPool.
+
+        Args:
+            frame_callback: The server's frame callback, handed to every worker at start.
+            size (int): Idle workers kept ready.
+            stop_timeout (float): Seconds a worker may take to stop a client (including saving its
+                queued frames) before it is killed.
+        """
+        self.frame_callback = frame_callback
+        self.size = size
+        self.stop_timeout = stop_timeout
+        self.idle = []
+        self.busy = set()
+        self.warm_launches = 0
+        self.cold_launches = 0
+        self._lock = threading.Lock()
+        self._refilling = False
+        self._stopped = False
+        self._context = worker_context()
+
+    def _spawn(self):
+        # workers must share this process's resource tracker: one of their own would unlink the
+        # FrameRings they attach to as soon as it exits
+        resource_tracker.ensure_running()
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = self._context.Process(target=_worker_main,
+                                        args=(child_conn, self.frame_callback, logging_settings()),
+                                        name='RtspWorker', daemon=True)
+        process.start()
+        child_conn.close()
+        return _Worker(process, parent_conn)
+
+    def start(self, wait=True, timeout=30.0):
+        """
+        Starts `size` idle workers.
+
+        Args:
+            wait (bool): Return only once every worker finished importing.
+            timeout (float): Seconds to wait for them.
+        """
+        workers = [self._spawn() for _ in range(self.size)]
+        if wait:
+            deadline = time.monotonic() + timeout
+            for worker in workers:
+                worker.wait_ready(max(0.0, deadline - time.monotonic()))
+        with self._lock:
+            self.idle.extend(workers)
+        print(f"RTSP worker pool started with {self.size} worker(s).")
+
+    def launch(self, cam_ip, port, mac, frame_callback, show_stream, frame_ring, rtsp_options):
+        """
+        Runs a camera's RTSP client on an idle worker, the `rtsp_launcher` of register_camera.
+
+        Returns:
+            PooledRtspProcess: Handle with is_alive(), terminate(), join() and pid.
+        """
+        if frame_callback is not self.frame_callback:
+            # a worker only knows the callback it was started with
+            return launch_rtsp_process(cam_ip, port, mac, frame_callback, show_stream, frame_ring, rtsp_options)
+
+        job = (cam_ip, port, mac, show_stream, frame_ring, rtsp_options)
+        while True:
+            with self._lock:
+                worker = self.idle.pop() if self.idle else None
+                if worker is not None:
+                    self.warm_launches += 1
+                else:
+                    self.cold_launches += 1
+            if worker is None:
+                worker = self._spawn()
+            try:
+                worker.conn.send(job)
+                break
+            except (BrokenPipeError, OSError):
+                worker.kill()  # died while idle, try the next one
+        with self._lock:
+            self.busy.add(worker)
+        self._refill()
+        return PooledRtspProcess(self, worker, mac)
+
+    def _refill(self):
+        """Tops the idle workers up to `size` in the background."""
+        with self._lock:
+            if self._refilling or self._stopped or len(self.idle) >= self.size:
+                return
+            self._refilling = True
+        threading.Thread(target=self._refill_worker, name='RtspWorkerRefill', daemon=True).start()
+
+    def _refill_worker(self):
+        try:
+            while True:
+                with self._lock:
+                    if self._stopped or len(self.idle) >= self.size:
+                        return
+                worker = self._spawn()
+                worker.wait_ready(30.0)
+                with self._lock:
+                    self.idle.append(worker)
+        finally:
+            with self._lock:
+                self._refilling = False
+
+    def _release(self, worker, reuse):
+        """Takes a worker back from a finished lease."""
+        with self._lock:
+            self.busy.discard(worker)
+            if reuse and not self._stopped and len(self.idle) < self.size:
+                self.idle.append(worker)
+                return
+        if reuse:
+            self._retire(worker)
+        else:
+            worker.kill()
+            self._refill()
+
+    @staticmethod
+    def _retire(worker):
+        try:
+            worker.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        worker.process.join(1.0)
+        worker.kill()
+
+    def stats(self):
+        """Returns launch and worker counts."""
+        with self._lock:
+            return {'idle': len(self.idle), 'busy': len(self.busy),
+                    'warm_launches': self.warm_launches, 'cold_launches': self.cold_launches}
+
+    def stop(self):
+        """Ends every idle worker. Busy ones are stopped by whoever holds their lease."""
+        with self._lock:
+            self._stopped = True
+            idle, self.idle = self.idle, []
+        for worker in idle:
+            self._retire(worker)
+        stats = self.stats()
+        print(f"RTSP worker pool stopped: {stats['warm_launches']} warm and {stats['cold_launches']} cold launches.")